@@ -0,0 +1,149 @@
+"""下载器端到端基准测试（离线）
+
+启动本地 SnapInsta 模拟服务，用合成链接分别跑各种下载模式，统计：
+每分钟链接数、单条链接 p50/p95 延迟、下载吞吐（字节/秒）和浏览器进程峰值内存。
+
+    python benchmarks/bench_download.py --links 40 --modes browser http http-service --concurrency 1 4
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from process_stats import UsageSampler
+from snapinsta_stub import add_stub_arguments, config_from_args, start_stub_server
+
+MODES = ("browser", "http", "http-service")
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def _folder_bytes(folder: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(folder, name))
+        for name in os.listdir(folder)
+        if not name.startswith(".") and not name.endswith(".part")
+    )
+
+def run_mode(mode: str, links: list, concurrency: int, work_dir: str, service=None) -> dict:
+    """用指定模式下载一遍全部链接，返回统计结果"""
+    import video_down_play
+
+    output_folder = os.path.join(work_dir, f"{mode}-c{concurrency}")
+    shutil.rmtree(output_folder, ignore_errors=True)
+    os.makedirs(output_folder)
+
+    started = {}
+    latencies = []
+    outcome = {"done": 0, "failed": 0}
+
+    def on_state(link, state, reason=None):
+        now = time.monotonic()
+        if state == "resolving":
+            started[link] = now
+        elif state in ("done", "failed"):
+            outcome[state] += 1
+            if link in started:
+                latencies.append(now - started.pop(link))
+
+    fetch_mode = "browser" if mode == "browser" else "http"
+    coro = video_down_play.download_videos_async(
+        links, output_folder, concurrency=concurrency, fetch_mode=fetch_mode,
+        service=service, on_state=on_state
+    )
+
+    # 只统计子进程（Chromium），不计入基准测试进程本身
+    with UsageSampler(interval=0.2, include_self=False) as sampler:
+        start = time.monotonic()
+        if service is not None:
+            report = asyncio.run(service.run(coro))
+        else:
+            report = asyncio.run(coro)
+        elapsed = time.monotonic() - start
+
+    total_bytes = _folder_bytes(output_folder)
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "links": len(links),
+        "done": outcome["done"],
+        "failed": outcome["failed"],
+        "seconds": round(elapsed, 2),
+        "links_per_min": round(len(links) / elapsed * 60, 1) if elapsed else 0.0,
+        "p50_latency": round(_percentile(latencies, 0.50), 2),
+        "p95_latency": round(_percentile(latencies, 0.95), 2),
+        "bytes": total_bytes,
+        "bytes_per_sec": round(total_bytes / elapsed) if elapsed else 0,
+        "peak_browser_rss_mb": round(sampler.peak_rss / 1024 / 1024, 1),
+        "report": report,
+    }
+
+def print_table(results: list) -> None:
+    header = f"{'模式':<14}{'并发':>4}{'成功':>6}{'失败':>6}{'耗时s':>8}{'链接/分':>9}{'p50 s':>8}{'p95 s':>8}{'MB/s':>8}{'峰值RSS MB':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['mode']:<14}{r['concurrency']:>4}{r['done']:>6}{r['failed']:>6}{r['seconds']:>8.1f}"
+              f"{r['links_per_min']:>9.1f}{r['p50_latency']:>8.2f}{r['p95_latency']:>8.2f}"
+              f"{r['bytes_per_sec'] / 1024 / 1024:>8.2f}{r['peak_browser_rss_mb']:>12.1f}")
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='下载器离线基准测试')
+    parser.add_argument('--links', type=int, default=20, help='合成链接数量')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help='要测试的下载模式')
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4], help='并发页面数（可多个）')
+    parser.add_argument('--keep-rate-limits', action='store_true', help='保留限速器的默认配置（默认放开限速，只测引擎本身）')
+    parser.add_argument('--json', type=str, help='把结果写入 JSON 文件')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_args(args)
+    server, base_url = start_stub_server(config)
+
+    # 必须在导入下载模块之前设置
+    os.environ["SNAPINSTA_URL"] = base_url
+    if not args.keep_rate_limits:
+        os.environ.setdefault("RATE_LIMIT_DEFAULT", "1000:1000")
+    os.environ.setdefault("HEADLESS", "true")
+
+    links = [f"https://www.instagram.com/reel/BENCH{i:05d}/" for i in range(args.links)]
+    work_dir = tempfile.mkdtemp(prefix="bench_download_")
+    results = []
+    service = None
+    try:
+        for mode in args.modes:
+            if mode == "http-service" and service is None:
+                from browser_service import get_browser_service
+                service = get_browser_service()
+                service.start()
+            for concurrency in args.concurrency:
+                print(f"\n=== {mode} 并发 {concurrency} ===")
+                result = run_mode(mode, links, concurrency, work_dir,
+                                  service if mode == "http-service" else None)
+                results.append(result)
+                print(result["report"])
+    finally:
+        if service is not None:
+            service.shutdown()
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print_table(results)
+    print(f"\n模拟服务统计: {config.stats}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"stub": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
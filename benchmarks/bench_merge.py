@@ -0,0 +1,220 @@
+"""视频合并基准测试（离线）
+
+用 ffmpeg 的 lavfi 源（testsrc2 画面 + sine 音频）生成合成视频，按不同的视频组合、数量、
+合并方式和编码配置运行 merge_videos，统计耗时、编码帧率、峰值内存、CPU 利用率和输出大小，
+可以保存为基准文件，之后和基准对比：
+
+    python benchmarks/bench_merge.py --clips 4 16 --engines auto concat parallel moviepy --save-baseline merge_baseline.json
+    python benchmarks/bench_merge.py --clips 4 16 --engines auto concat parallel moviepy --baseline merge_baseline.json
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from process_stats import UsageSampler
+
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# auto 是命令行和网页默认使用的方式（concat → parallel → moviepy），其余用于单独比较
+ENGINES = ("auto", "concat", "filtergraph", "parallel", "moviepy", "stream")
+
+# 视频组合：每个视频的 (宽, 高, 是否有声音)，按数量循环使用
+SCENARIOS = {
+    "conform": [(720, 1280, True)],
+    "hd": [(1080, 1920, True)],
+    "mixed": [(720, 1280, True), (1080, 1920, True), (1920, 1080, True), (1080, 1080, True)],
+    "silent": [(720, 1280, False), (1080, 1080, False)],
+}
+
+def generate_clip(path: str, width: int, height: int, duration: float, audio: bool, index: int) -> None:
+    """生成一个合成视频，已存在时跳过"""
+    if os.path.exists(path):
+        return
+    args = [FFMPEG, '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate=30:duration={duration}"]
+    if audio:
+        args += ['-f', 'lavfi', '-i', f"sine=frequency={220 + 40 * index}:sample_rate=44100:duration={duration}",
+                 '-c:a', 'aac', '-ac', '2']
+    args += ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-shortest', path]
+    subprocess.run(args, check=True)
+
+def generate_scenario(clip_dir: str, scenario: str, count: int, duration: float) -> list:
+    shapes = SCENARIOS[scenario]
+    paths = []
+    for i in range(count):
+        width, height, audio = shapes[i % len(shapes)]
+        path = os.path.join(clip_dir, f"{scenario}_{i:03d}_{width}x{height}{'' if audio else '_silent'}_{duration:g}s.mp4")
+        generate_clip(path, width, height, duration, audio, i)
+        paths.append(path)
+    return paths
+
+def _worker(spec: dict) -> int:
+    """子进程中执行一次合并，每次合并使用独立的进程，互不影响内存和缓存"""
+    from video_merger import merge_videos
+    ok = merge_videos(
+        output_path=spec["output"],
+        engine=spec["engine"],
+        profile=spec["profile"],
+        workers=spec.get("workers"),
+        clips=spec["clips"],
+    )
+    return 0 if ok else 1
+
+def run_merge(clips: list, engine: str, profile: str, work_dir: str, workers: int = None) -> dict:
+    """运行一次合并并统计资源占用"""
+    from media_probe import probe_media
+
+    output = os.path.join(work_dir, f"merged-{engine}-{profile}-{len(clips)}.mp4")
+    if os.path.exists(output):
+        os.remove(output)
+    spec = {"output": output, "engine": engine, "profile": profile, "workers": workers, "clips": clips}
+
+    before = os.times()
+    start = time.monotonic()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(spec)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=work_dir)
+    # 只统计合并子进程及其 ffmpeg 子进程，不计入基准脚本本身
+    with UsageSampler(interval=0.2, pid=proc.pid) as usage:
+        stdout, stderr = proc.communicate()
+    elapsed = time.monotonic() - start
+    after = os.times()
+
+    cpu_seconds = (after.children_user - before.children_user) + (after.children_system - before.children_system)
+    record = {
+        "engine": engine,
+        "profile": profile,
+        "clips": len(clips),
+        "ok": proc.returncode == 0 and os.path.exists(output),
+        "seconds": round(elapsed, 2),
+        "cpu_seconds": round(cpu_seconds, 2),
+        # 1.0 表示用满一个核，接近 CPU 核数表示用满整台机器
+        "cpu_utilization": round(cpu_seconds / elapsed, 2) if elapsed else 0.0,
+        "peak_rss_mb": round(usage.peak_rss / 1024 / 1024, 1),
+        "peak_processes": usage.peak_children,
+        "output_bytes": 0,
+        "output_seconds": 0.0,
+        "encode_fps": 0.0,
+    }
+    if record["ok"]:
+        info = probe_media(output)
+        record["output_bytes"] = os.path.getsize(output)
+        record["output_seconds"] = round(info["duration"], 2)
+        record["encode_fps"] = round(info["duration"] * info["fps"] / elapsed, 1) if elapsed else 0.0
+        os.remove(output)
+    else:
+        record["error"] = (stderr or stdout).strip()[-500:]
+    return record
+
+def _key(record: dict) -> tuple:
+    return (record["scenario"], record["engine"], record["profile"], record["clips"])
+
+def compare_baseline(results: list, baseline: list, threshold: float) -> list:
+    """和基准对比耗时，返回变慢超过 threshold 倍的记录"""
+    reference = {_key(r): r for r in baseline if r.get("ok")}
+    regressions = []
+    print(f"\n{'场景':<10}{'方式':<13}{'配置':<9}{'数量':>5}{'基准s':>9}{'本次s':>9}{'比值':>8}")
+    for record in results:
+        base = reference.get(_key(record))
+        if not base or not record["ok"]:
+            continue
+        ratio = record["seconds"] / base["seconds"] if base["seconds"] else 0.0
+        flag = "  ⚠️ 变慢" if ratio > threshold else ""
+        print(f"{record['scenario']:<10}{record['engine']:<13}{record['profile']:<9}{record['clips']:>5}"
+              f"{base['seconds']:>9.2f}{record['seconds']:>9.2f}{ratio:>8.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(record)
+    return regressions
+
+def print_table(results: list) -> None:
+    header = (f"{'场景':<10}{'方式':<13}{'配置':<9}{'数量':>5}{'耗时s':>8}{'编码fps':>9}{'CPU':>6}"
+              f"{'峰值MB':>9}{'进程':>6}{'输出MB':>8}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        if not r["ok"]:
+            print(f"{r['scenario']:<10}{r['engine']:<13}{r['profile']:<9}{r['clips']:>5}  失败: {r.get('error', '')[:60]}")
+            continue
+        print(f"{r['scenario']:<10}{r['engine']:<13}{r['profile']:<9}{r['clips']:>5}{r['seconds']:>8.1f}"
+              f"{r['encode_fps']:>9.1f}{r['cpu_utilization']:>6.1f}{r['peak_rss_mb']:>9.1f}"
+              f"{r['peak_processes']:>6}{r['output_bytes'] / 1024 / 1024:>8.1f}")
+
+if __name__ == "__main__":
+    import argparse
+
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        sys.exit(_worker(json.loads(sys.argv[2])))
+
+    from video_merger import ENCODING_PROFILES
+
+    parser = argparse.ArgumentParser(description='视频合并离线基准测试')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=['conform', 'mixed'], help='视频组合')
+    parser.add_argument('--clips', nargs='+', type=int, default=[4, 12], help='视频数量（可多个）')
+    parser.add_argument('--duration', type=float, default=3.0, help='每个合成视频的时长（秒）')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=['auto', 'concat', 'parallel', 'moviepy'], help='合并方式')
+    parser.add_argument('--profiles', nargs='+', choices=list(ENCODING_PROFILES), default=['final'], help='编码配置')
+    parser.add_argument('--workers', type=int, default=None, help='parallel 方式的进程数')
+    parser.add_argument('--cache', action='store_true', help='允许使用过渡片段缓存（默认关闭，每次都重新编码）')
+    parser.add_argument('--clip-dir', type=str, help='合成视频的保存目录（默认临时目录，用完删除）')
+    parser.add_argument('--json', type=str, help='把结果写入 JSON 文件')
+    parser.add_argument('--baseline', type=str, help='和这个基准文件对比')
+    parser.add_argument('--save-baseline', type=str, help='把本次结果保存为基准文件')
+    parser.add_argument('--threshold', type=float, default=1.15, help='耗时超过基准多少倍算变慢')
+    args = parser.parse_args()
+
+    if not shutil.which(FFMPEG):
+        sys.exit("未找到 ffmpeg，无法生成合成视频")
+
+    # 子进程继承这些环境变量
+    if not args.cache:
+        os.environ["SEGMENT_CACHE"] = "off"
+    work_dir = tempfile.mkdtemp(prefix="bench_merge_")
+    clip_dir = args.clip_dir or os.path.join(work_dir, "clips")
+    os.makedirs(clip_dir, exist_ok=True)
+
+    results = []
+    try:
+        for scenario in args.scenarios:
+            for count in args.clips:
+                clips = generate_scenario(clip_dir, scenario, count, args.duration)
+                for profile in args.profiles:
+                    for engine in args.engines:
+                        print(f"=== {scenario} x{count} {engine} {profile} ===")
+                        record = run_merge(clips, engine, profile, work_dir, args.workers)
+                        record["scenario"] = scenario
+                        results.append(record)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print_table(results)
+
+    report = {
+        "cpu_count": os.cpu_count(),
+        "duration": args.duration,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基准已保存到 {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("cpu_count") != os.cpu_count():
+            print(f"\n⚠️ 基准是在 {baseline.get('cpu_count')} 核机器上测的，本机 {os.cpu_count()} 核，结果仅供参考")
+        regressions = compare_baseline(results, baseline.get("results", []), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 项比基准慢 {args.threshold} 倍以上")
+            sys.exit(1)
@@ -0,0 +1,246 @@
+"""离线的 SnapInsta 模拟服务
+
+模拟下载器依赖的页面结构：#s_input 输入框、Download 按钮、#closeModalBtn 模态框，
+以及 ul.download-box 下的下载项，下载项的链接指向本服务生成的合成媒体文件。
+页面、解析和媒体请求的延迟以及失败率都可以配置。
+
+单独运行：
+    python benchmarks/snapinsta_stub.py --port 8765 --resolve-delay 0.5
+然后设置 SNAPINSTA_URL=http://127.0.0.1:8765/ 再运行下载器。
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>SnapInsta stub</title>
+<style>
+  #modal { display: none; position: fixed; inset: 0; background: rgba(0,0,0,.6); }
+  #modal.open { display: block; }
+  #modal .box { background: #fff; margin: 20% auto; width: 300px; padding: 20px; }
+</style>
+</head>
+<body>
+<form id="search" onsubmit="return false;">
+  <input id="s_input" type="text" placeholder="Paste URL Instagram">
+  <button id="submit" type="button">Download</button>
+</form>
+<div id="modal"><div class="box">Ad<button id="closeModalBtn" type="button">Close</button></div></div>
+<ul class="download-box"></ul>
+<script>
+document.getElementById('submit').addEventListener('click', async function () {
+  var url = document.getElementById('s_input').value;
+  var resp = await fetch('/api/resolve?url=' + encodeURIComponent(url));
+  if (!resp.ok) { return; }
+  var data = await resp.json();
+  if (data.modal) {
+    document.getElementById('modal').classList.add('open');
+  }
+  var box = document.querySelector('ul.download-box');
+  data.items.forEach(function (item, i) {
+    setTimeout(function () {
+      var li = document.createElement('li');
+      li.innerHTML = '<div class="download-items"><div class="download-items__btn">' +
+        '<a href="' + item.href + '">' + item.label + '</a></div></div>';
+      box.appendChild(li);
+    }, i * data.stagger_ms);
+  });
+});
+document.getElementById('closeModalBtn').addEventListener('click', function () {
+  document.getElementById('modal').classList.remove('open');
+});
+</script>
+</body>
+</html>
+"""
+
+class StubConfig:
+    """模拟服务的参数"""
+
+    def __init__(self, page_delay: float = 0.0, resolve_delay: float = 0.3, media_delay: float = 0.0,
+                 failure_rate: float = 0.0, media_failure_rate: float = 0.0, modal_rate: float = 0.3,
+                 items: int = 1, photo_rate: float = 0.0, media_size: int = 2 * 1024 * 1024,
+                 stagger_ms: int = 50, seed: int = None):
+        self.page_delay = page_delay
+        self.resolve_delay = resolve_delay
+        self.media_delay = media_delay
+        self.failure_rate = failure_rate
+        self.media_failure_rate = media_failure_rate
+        self.modal_rate = modal_rate
+        self.items = items
+        self.photo_rate = photo_rate
+        self.media_size = media_size
+        self.stagger_ms = stagger_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"pages": 0, "resolves": 0, "resolve_failures": 0, "media": 0, "media_bytes": 0}
+
+    def roll(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += amount
+
+def _synthetic_bytes(name: str, size: int) -> bytes:
+    """按名称生成确定的伪随机内容，不同名称的文件内容不同"""
+    seed = hashlib.sha256(name.encode()).digest()
+    block = hashlib.sha256(seed).digest() * 2048  # 64 KB
+    data = (block * (size // len(block) + 1))[:size]
+    return seed + data[len(seed):]
+
+def _make_handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str, headers: dict = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def do_HEAD(self):
+            self.do_GET()
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            if parts.path == "/":
+                self._page()
+            elif parts.path == "/api/resolve":
+                self._resolve(parse_qs(parts.query).get("url", [""])[0])
+            elif parts.path.startswith("/media/"):
+                self._media(parts.path[len("/media/"):])
+            else:
+                self._send(404, b"not found", "text/plain")
+
+        def _page(self):
+            time.sleep(config.page_delay)
+            config.count("pages")
+            self._send(200, PAGE_TEMPLATE.encode(), "text/html; charset=utf-8")
+
+        def _resolve(self, url: str):
+            time.sleep(config.resolve_delay)
+            config.count("resolves")
+            if config.roll(config.failure_rate):
+                config.count("resolve_failures")
+                self._send(500, b'{"error": "resolve failed"}', "application/json")
+                return
+
+            match = re.search(r'/(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)', url)
+            code = match.group(1) if match else hashlib.sha1(url.encode()).hexdigest()[:10]
+            items = []
+            for i in range(config.items):
+                if config.roll(config.photo_rate):
+                    items.append({"href": f"/media/{code}_{i}.jpg", "label": "Download Photo"})
+                else:
+                    items.append({"href": f"/media/{code}_{i}.mp4", "label": "Download Video"})
+            body = json.dumps({
+                "items": items,
+                "modal": config.roll(config.modal_rate),
+                "stagger_ms": config.stagger_ms,
+            }).encode()
+            self._send(200, body, "application/json")
+
+        def _media(self, name: str):
+            time.sleep(config.media_delay)
+            if config.roll(config.media_failure_rate):
+                self._send(503, b"unavailable", "text/plain")
+                return
+
+            data = _synthetic_bytes(name, config.media_size)
+            content_type = "image/jpeg" if name.endswith(".jpg") else "video/mp4"
+            headers = {
+                "Accept-Ranges": "bytes",
+                "Content-Disposition": f'attachment; filename="{name}"',
+            }
+
+            range_header = self.headers.get("Range")
+            match = re.match(r'bytes=(\d+)-(\d*)', range_header or "")
+            if match:
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else len(data) - 1
+                if start >= len(data):
+                    self._send(416, b"", content_type, {"Content-Range": f"bytes */{len(data)}"})
+                    return
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+                data = data[start:end + 1]
+                status = 206
+            else:
+                status = 200
+
+            config.count("media")
+            config.count("media_bytes", len(data))
+            self._send(status, data, content_type, headers)
+
+    return Handler
+
+def start_stub_server(config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+    """在后台线程启动模拟服务，返回 (server, base_url)；用完调用 server.shutdown()"""
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="snapinsta-stub", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/"
+
+def add_stub_arguments(parser) -> None:
+    """把模拟服务的参数加到命令行解析器上"""
+    parser.add_argument('--page-delay', type=float, default=0.0, help='首页响应延迟（秒）')
+    parser.add_argument('--resolve-delay', type=float, default=0.3, help='解析接口响应延迟（秒）')
+    parser.add_argument('--media-delay', type=float, default=0.0, help='媒体文件首字节延迟（秒）')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='解析失败率')
+    parser.add_argument('--media-failure-rate', type=float, default=0.0, help='媒体请求失败率')
+    parser.add_argument('--modal-rate', type=float, default=0.3, help='弹出模态框的概率')
+    parser.add_argument('--items', type=int, default=1, help='每条链接的媒体数量')
+    parser.add_argument('--photo-rate', type=float, default=0.0, help='每个媒体是图片（而不是视频）的概率')
+    parser.add_argument('--media-size', type=int, default=2 * 1024 * 1024, help='每个媒体文件的字节数')
+    parser.add_argument('--stagger-ms', type=int, default=50, help='多个媒体的下载按钮依次出现的间隔（毫秒）')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子')
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(
+        page_delay=args.page_delay,
+        resolve_delay=args.resolve_delay,
+        media_delay=args.media_delay,
+        failure_rate=args.failure_rate,
+        media_failure_rate=args.media_failure_rate,
+        modal_rate=args.modal_rate,
+        items=args.items,
+        photo_rate=args.photo_rate,
+        media_size=args.media_size,
+        stagger_ms=args.stagger_ms,
+        seed=args.seed,
+    )
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SnapInsta 模拟服务')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(config_from_args(args), args.host, args.port)
+    print(f"模拟服务已启动: {base_url}")
+    print(f"运行下载器前设置 SNAPINSTA_URL={base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
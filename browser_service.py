@@ -0,0 +1,255 @@
+import asyncio
+import atexit
+import os
+import threading
+from playwright.async_api import async_playwright
+from request_filter import RequestFilter
+
+def is_headless() -> bool:
+    """根据环境变量 HEADLESS 判断是否无头运行"""
+    headless_env = os.getenv("HEADLESS", "true").lower()
+    return headless_env in ["1", "true", "yes"]
+
+async def launch_browser(p):
+    """用统一的参数启动 Chromium"""
+    return await p.chromium.launch(
+        headless=is_headless(),
+        args=['--start-maximized']
+    )
+
+class ContextPool:
+    """浏览器上下文池
+
+    每个上下文带一个页面。指定 warm_url 时，新建或归还的上下文会先在后台打开该页面，
+    下一次领取时表单已经加载好；页面崩溃或被关闭的上下文直接丢弃，按需重建。
+    指定 request_filter 时每个新上下文都会安装请求过滤。
+    所有方法都必须在创建它的事件循环中调用。
+    """
+
+    def __init__(self, browser, max_size: int = 8, warm_url: str = None,
+                 request_filter: RequestFilter = None):
+        self.browser = browser
+        self.max_size = max_size
+        self.warm_url = warm_url
+        self.request_filter = request_filter
+        self._idle = asyncio.Queue()
+        self._size = 0
+        # 有上下文放回池中或名额空出来时通知等待中的 acquire
+        self._changed = asyncio.Condition()
+        self._crashed = set()
+        self._closed = False
+        # 后台预热任务，保留引用避免被回收，关闭时取消
+        self._rewarming = set()
+
+    async def _new_context(self):
+        context = await self.browser.new_context(
+            accept_downloads=True,
+            viewport={'width': 1920, 'height': 1080}
+        )
+        if self.request_filter is not None:
+            await self.request_filter.install(context)
+        page = await context.new_page()
+        page.on("crash", lambda _: self._crashed.add(context))
+        await self._warm(context)
+        return context
+
+    async def _warm(self, context) -> None:
+        """预先打开 warm_url，失败也不影响使用（领取后会重新打开）"""
+        if not self.warm_url:
+            return
+        try:
+            await context.pages[0].goto(self.warm_url, wait_until='domcontentloaded')
+        except Exception as e:
+            print(f"预热页面失败: {str(e)}")
+
+    async def _put_idle(self, context) -> None:
+        async with self._changed:
+            self._idle.put_nowait(context)
+            self._changed.notify()
+
+    async def _free_slot(self) -> None:
+        async with self._changed:
+            self._size -= 1
+            self._changed.notify()
+
+    def _is_healthy(self, context) -> bool:
+        return (context not in self._crashed
+                and self.browser.is_connected()
+                and bool(context.pages)
+                and not context.pages[0].is_closed())
+
+    async def warm(self, count: int) -> None:
+        """预先创建 count 个上下文"""
+        count = min(count, self.max_size - self._size)
+        self._size += count
+        contexts = await asyncio.gather(*[self._new_context() for _ in range(count)], return_exceptions=True)
+        for context in contexts:
+            if isinstance(context, Exception):
+                await self._free_slot()
+                print(f"创建浏览器上下文失败: {str(context)}")
+            else:
+                await self._put_idle(context)
+
+    async def acquire(self):
+        """领取一个上下文，池已满时等待其他任务归还上下文或丢弃上下文空出名额"""
+        while True:
+            async with self._changed:
+                while self._idle.empty() and self._size >= self.max_size:
+                    await self._changed.wait()
+                context = None if self._idle.empty() else self._idle.get_nowait()
+                if context is None:
+                    self._size += 1
+
+            if context is None:
+                try:
+                    return await self._new_context()
+                except Exception:
+                    await self._free_slot()
+                    raise
+
+            if self._is_healthy(context):
+                return context
+            await self._discard(context)
+
+    async def release(self, context) -> None:
+        """归还上下文；不健康的上下文会被关闭，健康的在后台重新预热后放回池中"""
+        if self._closed or not self._is_healthy(context):
+            await self._discard(context)
+            return
+
+        async def rewarm():
+            try:
+                await self._warm(context)
+            except asyncio.CancelledError:
+                await self._discard(context)
+                raise
+            if self._closed:
+                await self._discard(context)
+            else:
+                await self._put_idle(context)
+
+        if self.warm_url:
+            task = asyncio.get_running_loop().create_task(rewarm())
+            self._rewarming.add(task)
+            task.add_done_callback(self._rewarming.discard)
+        else:
+            await self._put_idle(context)
+
+    async def _discard(self, context) -> None:
+        await self._free_slot()
+        self._crashed.discard(context)
+        try:
+            await context.close()
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        self._closed = True
+        tasks = list(self._rewarming)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while not self._idle.empty():
+            await self._discard(self._idle.get_nowait())
+
+class BrowserService:
+    """常驻浏览器服务，由 Web 界面进程持有
+
+    在独立线程的事件循环中只启动一次 Chromium，并维护一个预热过的上下文池，
+    各个请求通过 run() 把下载协程提交到这个循环中执行。浏览器崩溃后下次使用时自动重启。
+    """
+
+    def __init__(self, warm_url: str = None, max_contexts: int = 8, warm_contexts: int = 2):
+        self.warm_url = warm_url
+        self.max_contexts = max_contexts
+        self.warm_contexts = warm_contexts
+        self.loop = None
+        self.pool = None
+        self._thread = None
+        self._playwright = None
+        self._browser = None
+        self._lock = threading.Lock()
+        self._launch_lock = None
+
+    def start(self, launch: bool = True) -> None:
+        """启动事件循环线程；launch 为 True 时同时启动并预热浏览器（重复调用无副作用）"""
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self.loop.run_forever, name="browser-service", daemon=True)
+                self._thread.start()
+        if launch:
+            asyncio.run_coroutine_threadsafe(self.ensure_browser(), self.loop).result()
+
+    async def ensure_browser(self) -> ContextPool:
+        """确保浏览器在运行，返回可用的上下文池"""
+        if self._launch_lock is None:
+            self._launch_lock = asyncio.Lock()
+        async with self._launch_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self.pool
+
+            if self._browser is not None:
+                print("浏览器已断开，正在重新启动...")
+                await self._close_browser()
+
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await launch_browser(self._playwright)
+            self.pool = ContextPool(self._browser, max_size=self.max_contexts, warm_url=self.warm_url,
+                                    request_filter=RequestFilter.from_env())
+            await self.pool.warm(self.warm_contexts)
+            return self.pool
+
+    async def _close_browser(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+
+    async def run(self, coro):
+        """在服务的事件循环中执行协程，可以从任意其他事件循环中 await"""
+        self.start(launch=False)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def shutdown(self) -> None:
+        """关闭浏览器并停止事件循环"""
+        with self._lock:
+            if self.loop is None:
+                return
+            loop, self.loop = self.loop, None
+
+        async def stop():
+            await self._close_browser()
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+        try:
+            asyncio.run_coroutine_threadsafe(stop(), loop).result(timeout=30)
+        except Exception as e:
+            print(f"关闭浏览器服务时出错: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=5)
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_browser_service() -> BrowserService:
+    """获取进程内共享的浏览器服务，进程退出时自动关闭"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            from video_down_play import SNAPINSTA_URL
+            _service = BrowserService(
+                warm_url=SNAPINSTA_URL,
+                max_contexts=int(os.getenv("BROWSER_MAX_CONTEXTS", 8)),
+                warm_contexts=int(os.getenv("BROWSER_WARM_CONTEXTS", 2)),
+            )
+            atexit.register(_service.shutdown)
+        return _service
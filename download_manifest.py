@@ -0,0 +1,167 @@
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+MANIFEST_NAME = ".download_manifest.sqlite3"
+
+# 匹配 /p/、/reel/、/reels/、/tv/ 后面的短码，前面可以带用户名
+_SHORTCODE_PATTERN = re.compile(r'instagram\.com/(?:[^/?#\s]+/)?(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)')
+
+def extract_shortcode(url: str) -> Optional[str]:
+    """从 Instagram 链接中提取帖子短码，无法识别时返回 None"""
+    match = _SHORTCODE_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def file_sha256(path: str) -> str:
+    """分块计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DownloadManifest:
+    """输出目录下的下载清单（SQLite）
+
+    记录每个帖子短码下每个媒体序号对应的文件路径、大小和 SHA-256。
+    已经完整下载过的链接和媒体会被跳过；内容完全相同的文件只保留一份。
+    每条链接按提交顺序分配一个递增的序号（seq），写在文件名最前面，
+    按文件名排序合并时就是粘贴链接的顺序。
+    """
+
+    def __init__(self, folder: str):
+        self.folder = os.path.abspath(folder)
+        os.makedirs(self.folder, exist_ok=True)
+        self.path = os.path.join(self.folder, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS links (
+                shortcode TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                item_count INTEGER NOT NULL,
+                completed_at REAL NOT NULL,
+                seq INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS media (
+                shortcode TEXT NOT NULL,
+                item_index INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                seq INTEGER,
+                PRIMARY KEY (shortcode, item_index)
+            );
+            CREATE INDEX IF NOT EXISTS media_sha256 ON media (sha256);
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+        # 旧版清单没有序号列
+        for table in ("links", "media"):
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if "seq" not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN seq INTEGER")
+        self._conn.commit()
+
+    def _abs(self, path: str) -> str:
+        return os.path.join(self.folder, path)
+
+    def _item_present(self, path: str, size: int) -> bool:
+        full_path = self._abs(path)
+        return os.path.exists(full_path) and os.path.getsize(full_path) == size
+
+    def reserve_sequence(self, count: int) -> int:
+        """为一批 count 条链接预留连续的序号，返回第一个序号（同一目录下的多批下载依次排在后面）"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM counters WHERE name = 'seq'").fetchone()
+            first = row[0] if row else 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO counters (name, value) VALUES ('seq', ?)", (first + count,)
+            )
+            self._conn.commit()
+        return first
+
+    def media_path(self, seq: int, shortcode: str, item_index: int, ext: str) -> str:
+        """媒体的文件路径：序号在前保证合并顺序，短码和媒体序号用于识别"""
+        return self._abs(f"{seq:04d}_snapinsta_{shortcode}_{item_index + 1:02d}{ext}")
+
+    def find_media(self, shortcode: str, item_index: int, ext: str) -> Optional[str]:
+        """查找目录中已有的该媒体文件（任意序号，或旧版不带序号的文件名），没有时返回 None"""
+        name = f"snapinsta_{glob.escape(shortcode)}_{item_index + 1:02d}{ext}"
+        candidates = glob.glob(os.path.join(glob.escape(self.folder), f"*_{name}"))
+        candidates.append(self._abs(name))
+        for path in sorted(candidates):
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                return path
+        return None
+
+    def link_done(self, shortcode: str) -> bool:
+        """该帖子的所有媒体是否都已下载且文件仍然存在"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT item_count FROM links WHERE shortcode = ?", (shortcode,)
+            ).fetchone()
+            if row is None:
+                return False
+            items = self._conn.execute(
+                "SELECT path, size FROM media WHERE shortcode = ?", (shortcode,)
+            ).fetchall()
+        return len(items) >= row[0] and all(self._item_present(path, size) for path, size in items)
+
+    def has_item(self, shortcode: str, item_index: int) -> bool:
+        """该媒体是否已下载且文件仍然存在"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, size FROM media WHERE shortcode = ? AND item_index = ?",
+                (shortcode, item_index)
+            ).fetchone()
+        return row is not None and self._item_present(*row)
+
+    def record_item(self, shortcode: str, item_index: int, path: str, seq: int = None) -> str:
+        """登记一个下载完成的文件，返回最终保存位置
+
+        如果已有内容相同的文件，新文件会被删除，清单指向已有的文件。
+        """
+        size = os.path.getsize(path)
+        sha256 = file_sha256(path)
+        rel_path = os.path.relpath(os.path.abspath(path), self.folder)
+
+        with self._lock:
+            duplicates = self._conn.execute(
+                "SELECT path, size FROM media WHERE sha256 = ? AND path != ?", (sha256, rel_path)
+            ).fetchall()
+            for dup_path, dup_size in duplicates:
+                if self._item_present(dup_path, dup_size):
+                    os.remove(path)
+                    rel_path = dup_path
+                    print(f"内容重复，复用已有文件: {dup_path}")
+                    break
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media (shortcode, item_index, path, size, sha256, created_at, seq) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (shortcode, item_index, rel_path, size, sha256, time.time(), seq)
+            )
+            self._conn.commit()
+        return self._abs(rel_path)
+
+    def mark_link_done(self, shortcode: str, url: str, item_count: int, seq: int = None) -> None:
+        """登记一个帖子的全部媒体已下载"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO links (shortcode, url, item_count, completed_at, seq) VALUES (?, ?, ?, ?, ?)",
+                (shortcode, url, item_count, time.time(), seq)
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,744 @@
+import logging
+import merge_trace
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from media_probe import FFPROBE, probe_many, probe_media
+from segment_cache import SegmentCache, file_digest, get_segment_cache
+from segment_store import SegmentStore
+from PIL import Image
+from video_merger import (DEFAULT_PROFILE, DING_MAX, END_MAX, ENCODING_PROFILES, FINAL_DURATION, TAIL_TRIM,
+                          TRANSITION_DURATION, normalize_clips, sound_path, transition_frame)
+
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# 输出参数，和 moviepy 路径的 write_videofile 保持一致
+DEFAULT_SETTINGS = {
+    'size': (720, 1280),
+    'fps': '30',
+    'vcodec': 'libx264',
+    'preset': 'medium',
+    'crf': 23,
+    'threads': 0,
+    'pix_fmt': 'yuv420p',
+    'profile': 'high',
+    'timescale': 15360,
+    'acodec': 'aac',
+    'audio_bitrate': '128k',
+    'sample_rate': 44100,
+    'channels': 2,
+}
+
+def profile_settings(profile: str = DEFAULT_PROFILE, size: tuple = None) -> dict:
+    """按 video_merger.ENCODING_PROFILES 中的编码配置生成输出参数，size 可以覆盖配置中的分辨率"""
+    config = ENCODING_PROFILES[profile]
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update({
+        'size': tuple(size or config['size']),
+        'fps': str(config['fps']),
+        'preset': config['preset'],
+        'crf': config['crf'],
+        'threads': config['threads'],
+        'audio_bitrate': config['audio_bitrate'],
+    })
+    return settings
+
+def ffmpeg_available() -> bool:
+    return bool(shutil.which(FFMPEG) and shutil.which(FFPROBE))
+
+def run_ffmpeg(args: list, description: str) -> None:
+    """运行 ffmpeg，失败时抛出带 stderr 末尾内容的异常"""
+    result = subprocess.run(
+        [FFMPEG, '-hide_banner', '-loglevel', 'error', '-y'] + args,
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{description}失败: {result.stderr.strip()[-1000:]}")
+
+def clip_window(info: dict) -> tuple:
+    """返回视频实际使用的 (起点, 终点)
+
+    info 中带 start / end 时按指定的裁剪点，没有指定终点时末尾裁掉 TAIL_TRIM 秒。
+    """
+    duration = info['duration']
+    start = min(info.get('start') or 0.0, duration)
+    if info.get('end') is not None:
+        end = min(info['end'], duration)
+    else:
+        end = duration - TAIL_TRIM if duration > 1 else duration
+    return start, max(start, end)
+
+def store_settings(settings: dict, info: dict) -> dict:
+    """增量合并记录片段时使用的参数：编码参数加上裁剪范围"""
+    return dict(settings, window=[round(t, 3) for t in clip_window(info)])
+
+def _channel_layout(settings: dict) -> str:
+    return 'stereo' if settings['channels'] == 2 else 'mono'
+
+def video_filter(settings: dict) -> str:
+    """缩放并加黑边到目标尺寸，统一帧率和像素格式"""
+    width, height = settings['size']
+    return (f"scale={width}:{height}:force_original_aspect_ratio=decrease:force_divisible_by=2,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black,setsar=1,"
+            f"fps={settings['fps']},format={settings['pix_fmt']}")
+
+def audio_filter(settings: dict) -> str:
+    return (f"aresample={settings['sample_rate']},"
+            f"aformat=sample_fmts=fltp:channel_layouts={_channel_layout(settings)}")
+
+def encode_args(settings: dict) -> list:
+    """视频和音频的编码参数"""
+    args = [
+        '-c:v', settings['vcodec'], '-preset', settings['preset'], '-crf', str(settings['crf']),
+        '-profile:v', settings['profile'], '-pix_fmt', settings['pix_fmt'],
+        '-video_track_timescale', str(settings['timescale']),
+        '-c:a', settings['acodec'], '-b:a', settings['audio_bitrate'],
+        '-ar', str(settings['sample_rate']), '-ac', str(settings['channels']),
+    ]
+    if settings.get('threads'):
+        args += ['-threads', str(settings['threads'])]
+    return args
+
+def _silence_input(settings: dict, duration: float) -> list:
+    return ['-f', 'lavfi', '-t', f"{duration:.3f}",
+            '-i', f"anullsrc=r={settings['sample_rate']}:cl={_channel_layout(settings)}"]
+
+def encode_clip_segment(info: dict, dst: str, settings: dict) -> None:
+    """把一个视频重新编码成和参考参数一致的片段（已裁掉末尾）"""
+    start, end = clip_window(info)
+    duration = end - start
+    args = (['-ss', f"{start:.3f}"] if start else []) + ['-t', f"{duration:.3f}", '-i', info['path']]
+    if info['has_audio']:
+        audio_map = '0:a:0'
+    else:
+        args += _silence_input(settings, duration)
+        audio_map = '1:a:0'
+    args += [
+        '-map', '0:v:0', '-map', audio_map,
+        '-vf', video_filter(settings), '-af', audio_filter(settings),
+        '-t', f"{duration:.3f}",
+    ] + encode_args(settings) + ['-movflags', '+faststart', dst]
+    run_ffmpeg(args, f"编码视频 {os.path.basename(info['path'])} ")
+
+def encode_still_segment(image_path: str, dst: str, duration: float, settings: dict,
+                         sound: str = None, sound_max: float = DING_MAX) -> None:
+    """把一张静态图片编码成指定时长的片段，可以带一段音效"""
+    args = ['-loop', '1', '-framerate', str(settings['fps']), '-t', f"{duration:.3f}", '-i', image_path]
+    if sound:
+        args += ['-i', sound]
+        af = (f"atrim=0:{min(sound_max, duration):.3f},asetpts=PTS-STARTPTS,"
+              f"{audio_filter(settings)},apad=whole_dur={duration:.3f}")
+    else:
+        args += _silence_input(settings, duration)
+        af = audio_filter(settings)
+    args += [
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-vf', video_filter(settings), '-af', af,
+        '-t', f"{duration:.3f}",
+    ] + encode_args(settings) + ['-movflags', '+faststart', dst]
+    run_ffmpeg(args, f"编码过渡画面 {os.path.basename(image_path)} ")
+
+def _profile_name(profile: str) -> str:
+    """ffprobe 的 profile 名称转成 x264 的 -profile:v 参数"""
+    return {'constrained baseline': 'baseline'}.get(profile, profile)
+
+def _conform_key(info: dict) -> tuple:
+    return (info['fps_rate'], info['timescale'], info['sample_rate'], info['channels'], _profile_name(info['profile']))
+
+def _is_candidate(info: dict, settings: dict) -> bool:
+    """编码格式、尺寸、像素格式和音频编码都和输出要求一致，才有可能直接复制"""
+    return (
+        info['vcodec'] == 'h264'
+        and (info['width'], info['height']) == tuple(settings['size'])
+        and info['pix_fmt'] == settings['pix_fmt']
+        and info['rotation'] == 0
+        and info['has_audio'] and info['acodec'] == 'aac'
+        and _profile_name(info['profile']) in ('baseline', 'main', 'high')
+        # 从中间开始的裁剪点不一定落在关键帧上，直接复制会多出画面
+        and not info.get('start')
+    )
+
+def plan_merge(infos: list, settings: dict = None) -> tuple:
+    """决定哪些视频可以直接复制流，返回 (参考参数, 每个视频的处理方式 'copy' / 'encode')
+
+    以符合要求的视频中最常见的帧率、时间基、采样率、声道数和 profile 作为参考参数，
+    和参考参数完全一致的视频直接复制，其余视频和过渡画面都按参考参数编码。
+    level、参考帧数等 SPS/PPS 参数不比较：有直接复制的视频时经 MPEG-TS 拼接（见 concat_segments）。
+    """
+    settings = dict(settings or DEFAULT_SETTINGS)
+    candidates = [info for info in infos if _is_candidate(info, settings)]
+    if not candidates:
+        return settings, ['encode'] * len(infos)
+
+    key, _ = Counter(_conform_key(info) for info in candidates).most_common(1)[0]
+    fps_rate, timescale, sample_rate, channels, profile = key
+    settings.update({
+        'fps': fps_rate,
+        'timescale': timescale,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'profile': profile,
+    })
+    plan = ['copy' if _is_candidate(info, settings) and _conform_key(info) == key else 'encode'
+            for info in infos]
+    return settings, plan
+
+def _quote(path: str) -> str:
+    return "'" + path.replace("'", "'\\''") + "'"
+
+def write_concat_list(entries: list, list_path: str) -> None:
+    """写 concat demuxer 的列表文件，entries 中可以带 inpoint / outpoint"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write("ffconcat version 1.0\n")
+        for entry in entries:
+            f.write(f"file {_quote(entry['path'])}\n")
+            if entry.get('inpoint'):
+                f.write(f"inpoint {entry['inpoint']:.3f}\n")
+            if entry.get('outpoint') is not None:
+                f.write(f"outpoint {entry['outpoint']:.3f}\n")
+
+def remux_annexb(entry: dict, dst: str) -> None:
+    """把一个片段无损转成 MPEG-TS（H.264 Annex-B），每个关键帧前都带上自己的 SPS/PPS，按 inpoint / outpoint 裁剪"""
+    start = entry.get('inpoint') or 0.0
+    args = (['-ss', f"{start:.3f}"] if start else []) + ['-i', entry['path']]
+    if entry.get('outpoint') is not None:
+        args += ['-t', f"{entry['outpoint'] - start:.3f}"]
+    args += ['-map', '0', '-c', 'copy', '-bsf:v', 'h264_mp4toannexb', '-f', 'mpegts', dst]
+    run_ffmpeg(args, f"转换片段 {os.path.basename(entry['path'])} ")
+
+def concat_segments(entries: list, output_path: str, work_dir: str, annexb: bool = False) -> None:
+    """用 concat demuxer 把片段直接拼接（不重新编码）
+
+    MP4 拼接只保留第一个文件的 avcC（SPS/PPS），只适合编码参数完全相同的片段（例如都由本程序编码）。
+    混有直接复制的原视频时传 annexb=True：先把每个片段转成 MPEG-TS，参数集随码流携带，再拼接成 MP4。
+    """
+    if annexb:
+        with merge_trace.span('remux', segments=len(entries)):
+            remuxed = []
+            for k, entry in enumerate(entries):
+                dst = os.path.join(work_dir, f'segment_{k:04d}.ts')
+                remux_annexb(entry, dst)
+                remuxed.append({'path': dst})
+        entries = remuxed
+    list_path = os.path.join(work_dir, 'concat.txt')
+    write_concat_list(entries, list_path)
+    extra = ['-bsf:a', 'aac_adtstoasc'] if annexb else []
+    with merge_trace.span('concatenate', segments=len(entries)):
+        run_ffmpeg(
+            ['-f', 'concat', '-safe', '0', '-i', list_path, '-map', '0', '-c', 'copy'] + extra +
+            ['-movflags', '+faststart', output_path],
+            "拼接片段"
+        )
+    _count_written(output_path)
+
+def _count_written(path: str) -> None:
+    """把写出的文件大小计入 trace"""
+    if path and os.path.exists(path):
+        merge_trace.count('bytes_written', os.path.getsize(path))
+
+def _probe_all(clips: list) -> list:
+    """读取所有视频的信息（使用文件夹的信息索引），读取失败的视频跳过
+
+    clips 的格式见 video_merger.normalize_clips，返回的信息中带有裁剪点 start / end。
+    """
+    clips = normalize_clips(clips)
+    with merge_trace.span('open', clips=len(clips)):
+        probed = probe_many([clip['path'] for clip in clips])
+    infos = []
+    for clip in clips:
+        info = probed.get(clip['path'])
+        if info is None:
+            logging.error(f"跳过无法读取的视频: {os.path.basename(clip['path'])}")
+            continue
+        infos.append(dict(info, start=clip['start'], end=clip['end']))
+    if not infos:
+        raise RuntimeError("没有可用的视频片段")
+    return infos
+
+def _render_transition(work_dir: str, number: int, settings: dict, title=None, author=None,
+                       color_scheme='p6', is_final=False) -> str:
+    """把过渡画面绘制成 PNG 保存到临时目录，返回文件路径"""
+    image_path = os.path.join(work_dir, 'final.png' if is_final else f'transition_{number}.png')
+    Image.fromarray(transition_frame(
+        number, settings['size'], is_final=is_final,
+        title_text=title, author_name=author, color_scheme=color_scheme
+    )).save(image_path)
+    return image_path
+
+def transition_segment(work_dir: str, number: int, settings: dict, title=None, author=None,
+                       color_scheme='p6', is_final=False, cache_dir: str = None) -> str:
+    """编码一个带音效的过渡画面片段，返回文件路径
+
+    片段缓存按画面内容、时长、音效内容和编码参数寻址，命中时直接返回缓存文件，不再编码。
+    全局缓存关闭时，可以用 cache_dir 指定一个单独的缓存目录（增量合并使用）。
+    """
+    frame = transition_frame(number, settings['size'], is_final=is_final,
+                             title_text=title, author_name=author, color_scheme=color_scheme)
+    if is_final:
+        duration, sound, sound_max = FINAL_DURATION, sound_path('end.wav'), END_MAX
+    else:
+        duration, sound, sound_max = TRANSITION_DURATION, sound_path('ding.wav'), DING_MAX
+
+    def build(dst):
+        image_path = dst + '.png'
+        Image.fromarray(frame).save(image_path)
+        try:
+            encode_still_segment(image_path, dst, duration, settings, sound, sound_max)
+        finally:
+            os.remove(image_path)
+
+    cache = get_segment_cache()
+    if cache is None and cache_dir:
+        cache = SegmentCache(cache_dir, max_bytes=float('inf'))
+    if cache is None:
+        dst = os.path.join(work_dir, 'final.mp4' if is_final else f'transition_{number}.mp4')
+        build(dst)
+        return dst
+
+    key = cache.key(frame.tobytes(), {
+        'shape': frame.shape,
+        'duration': duration,
+        'sound': file_digest(sound),
+        'sound_max': sound_max,
+        'settings': settings,
+    })
+    return cache.get_or_create(key, build)
+
+def check_duration(output_path: str, expected: float) -> None:
+    info = probe_media(output_path)
+    actual = info['duration']
+    merge_trace.count('frames', int(actual * (info['fps'] or 0)))
+    if abs(actual - expected) > max(1.0, expected * 0.02):
+        raise RuntimeError(f"合并后时长异常: {actual:.2f}s，预期 {expected:.2f}s")
+
+def merge_with_concat(clips: list, output_path: str, title="今日份快乐", author="",
+                      color_scheme='p6', settings: dict = None, incremental: bool = False, progress=None) -> None:
+    """用 concat demuxer 合并视频：格式一致的视频直接复制流，只编码过渡画面和不一致的视频
+
+    incremental 为 True 时，编码过的视频片段保存在 <输出>.segments/ 中，下次合并直接使用。
+    progress(完成数, 总数, 视频名) 在每个视频处理完成时调用。
+    """
+    work_dir = tempfile.mkdtemp(prefix='merge_', dir=os.path.dirname(os.path.abspath(output_path)))
+    store = SegmentStore(output_path) if incremental else None
+    cache_dir = store.transitions_dir if store else None
+    success = False
+    try:
+        infos = _probe_all(clips)
+        settings, plan = plan_merge(infos, settings)
+        logging.info(f"合并计划: {plan.count('copy')} 个视频直接复制，{plan.count('encode')} 个视频需要重新编码")
+
+        entries = []
+        expected = 0.0
+        for i, (info, action) in enumerate(zip(infos, plan), 1):
+            name = os.path.basename(info['path'])
+            logging.info(f"\n处理第 {i} 个视频: {name} ({action})")
+            with merge_trace.span('transition', clip=i):
+                entries.append({'path': transition_segment(work_dir, i, settings, title, author, color_scheme,
+                                                           cache_dir=cache_dir)})
+
+            start, end = clip_window(info)
+            if action == 'copy':
+                entries.append({'path': info['path'], 'inpoint': start, 'outpoint': end})
+            elif store:
+                params = store_settings(settings, info)
+                segment = store.get(info['path'], params)
+                if segment is None:
+                    segment = store.reserve(info['path'], params)
+                    with merge_trace.span('encode', clip=i, file=name):
+                        encode_clip_segment(info, segment, settings)
+                    _count_written(segment)
+                    store.put(info['path'], params, segment, end - start)
+                else:
+                    logging.info("使用已有片段")
+                entries.append({'path': segment})
+            else:
+                segment = os.path.join(work_dir, f'clip_{i}.mp4')
+                with merge_trace.span('encode', clip=i, file=name):
+                    encode_clip_segment(info, segment, settings)
+                _count_written(segment)
+                entries.append({'path': segment})
+            expected += TRANSITION_DURATION + end - start
+            if progress:
+                progress(i, len(infos) + 1, name)
+
+        # 最终画面
+        with merge_trace.span('transition', clip=len(infos) + 1):
+            entries.append({'path': transition_segment(work_dir, len(infos) + 1, settings,
+                                                       color_scheme=color_scheme, is_final=True, cache_dir=cache_dir)})
+        expected += FINAL_DURATION
+        if progress:
+            progress(len(infos) + 1, len(infos) + 1, 'final')
+
+        # 直接复制的原视频和本程序编码的片段 SPS/PPS 不同（level、参考帧数、熵编码等），经 MPEG-TS 拼接
+        concat_segments(entries, output_path, work_dir, annexb='copy' in plan)
+
+        # 直接复制时切点只能落在关键帧上，时长偏差太大说明拼接结果不可靠
+        check_duration(output_path, expected)
+        success = True
+    finally:
+        with merge_trace.span('cleanup'):
+            if store:
+                store.save(prune=success)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def build_filtergraph(segments: list, settings: dict, ding_input: int = None, end_input: int = None) -> str:
+    """把整条时间线编译成一个 filter_complex
+
+    segments 中每一项是 {'input': 输入序号, 'kind': 'still' / 'clip' / 'final', 'duration': 秒, 'has_audio': bool}，
+    静态画面的音效来自 ding_input / end_input（没有音效文件时用静音），
+    视频统一缩放加黑边、统一帧率，按时长裁掉末尾后和音频一起 concat。
+    """
+    lines = _ding_split(segments, ding_input)
+    pairs = []
+    ding_index = 0
+    for k, seg in enumerate(segments):
+        duration = f"{seg['duration']:.3f}"
+        lines.append(
+            f"[{seg['input']}:v]trim=duration={duration},setpts=PTS-STARTPTS,{video_filter(settings)}[v{k}]"
+        )
+
+        lines.append(_audio_chain(seg, k, settings, ding_index, ding_input, end_input))
+        if seg['kind'] == 'still':
+            ding_index += 1
+        pairs.append(f"[v{k}][a{k}]")
+
+    lines.append(f"{''.join(pairs)}concat=n={len(segments)}:v=1:a=1[outv][outa]")
+    return ';\n'.join(lines)
+
+def _ding_split(segments: list, ding_input: int = None) -> list:
+    """多个过渡画面共用一个音效输入时，先用 asplit 分成 [ding0]、[ding1]..."""
+    stills = sum(1 for seg in segments if seg['kind'] == 'still')
+    if ding_input is None or not stills:
+        return []
+    outputs = ''.join(f'[ding{i}]' for i in range(stills))
+    return [f"[{ding_input}:a]asplit={stills}{outputs}"]
+
+def _audio_chain(seg: dict, k: int, settings: dict, ding_index: int, ding_input: int = None,
+                 end_input: int = None) -> str:
+    """第 k 段的音频滤镜，输出标签 [a{k}]"""
+    duration = f"{seg['duration']:.3f}"
+    if seg['kind'] == 'clip' and seg['has_audio']:
+        source = f"[{seg['input']}:a]atrim=duration={duration},asetpts=PTS-STARTPTS,"
+    elif seg['kind'] == 'still' and ding_input is not None:
+        source = f"[ding{ding_index}]atrim=0:{min(DING_MAX, seg['duration']):.3f},asetpts=PTS-STARTPTS,"
+    elif seg['kind'] == 'final' and end_input is not None:
+        source = f"[{end_input}:a]atrim=0:{min(END_MAX, seg['duration']):.3f},asetpts=PTS-STARTPTS,"
+    else:
+        source = f"anullsrc=r={settings['sample_rate']}:cl={_channel_layout(settings)},"
+    # 音频补齐或截断到和画面一样长，保证 concat 后音画同步
+    return f"{source}{audio_filter(settings)},apad=whole_dur={duration},atrim=duration={duration}[a{k}]"
+
+def build_target_filtergraph(segments: list, targets: list, ding_input: int = None, end_input: int = None) -> str:
+    """把整条时间线编译成同时输出多个目标的 filter_complex
+
+    segments 同 build_filtergraph，但过渡画面（'still' / 'final'）的 'input' 是每个目标各自一张图片的输入序号列表；
+    targets 为每个目标的编码参数。视频只解码一次，用 split 分给各个目标分别缩放加黑边；
+    音频只处理一次，用 asplit 分给各个目标。输出标签为 [outv0][outa0]、[outv1][outa1]...
+    """
+    count = len(targets)
+    lines = _ding_split(segments, ding_input)
+    ding_index = 0
+    for k, seg in enumerate(segments):
+        duration = f"{seg['duration']:.3f}"
+        if seg['kind'] == 'clip':
+            outputs = ''.join(f'[s{k}_{t}]' for t in range(count))
+            lines.append(f"[{seg['input']}:v]trim=duration={duration},setpts=PTS-STARTPTS,split={count}{outputs}")
+            lines.extend(f"[s{k}_{t}]{video_filter(target)}[v{k}_{t}]" for t, target in enumerate(targets))
+        else:
+            lines.extend(
+                f"[{seg['input'][t]}:v]trim=duration={duration},setpts=PTS-STARTPTS,{video_filter(target)}[v{k}_{t}]"
+                for t, target in enumerate(targets)
+            )
+
+        # 各目标的音频采样率和声道数相同（都来自 DEFAULT_SETTINGS），只有编码码率不同
+        lines.append(_audio_chain(seg, k, targets[0], ding_index, ding_input, end_input))
+        if seg['kind'] == 'still':
+            ding_index += 1
+
+    audio = ''.join(f'[a{k}]' for k in range(len(segments)))
+    outputs = ''.join(f'[outa{t}]' for t in range(count))
+    lines.append(f"{audio}concat=n={len(segments)}:v=0:a=1,asplit={count}{outputs}")
+    for t in range(count):
+        video = ''.join(f'[v{k}_{t}]' for k in range(len(segments)))
+        lines.append(f"{video}concat=n={len(segments)}:v=1:a=0[outv{t}]")
+    return ';\n'.join(lines)
+
+def _sound_inputs(items: list, first_input: int) -> tuple:
+    """过渡画面和最终画面的音效输入，返回 (参数, 过渡音效输入序号, 结束音效输入序号)，没有音效时序号为 None"""
+    args = []
+    ding_input = end_input = None
+    ding = sound_path('ding.wav') if any(item['kind'] == 'still' for item in items) else None
+    end = sound_path('end.wav') if any(item['kind'] == 'final' for item in items) else None
+    if ding:
+        ding_input = first_input
+        args.extend(['-i', ding])
+    if end:
+        end_input = first_input + (1 if ding else 0)
+        args.extend(['-i', end])
+    return args, ding_input, end_input
+
+def render_timeline(items: list, dst: str, settings: dict, script_path: str, extra_args: list = None) -> None:
+    """用一次 ffmpeg 调用把一段时间线渲染成文件
+
+    items 中每一项是 {'kind': 'still' / 'clip' / 'final', 'path': 文件, 'duration': 秒, 'has_audio': bool}，
+    'still' 和 'final' 是过渡画面图片，'clip' 是视频（从 start 秒开始截取 duration 秒）。
+    """
+    args = []
+    segments = []
+    for item in items:
+        if item['kind'] == 'clip':
+            if item.get('start'):
+                args.extend(['-ss', f"{item['start']:.3f}"])
+            args.extend(['-t', f"{item['duration']:.3f}", '-i', item['path']])
+        else:
+            args.extend(['-loop', '1', '-framerate', str(settings['fps']),
+                         '-t', f"{item['duration']:.3f}", '-i', item['path']])
+        segments.append({'input': len(segments), 'kind': item['kind'], 'duration': item['duration'],
+                         'has_audio': item.get('has_audio', False)})
+
+    sound_args, ding_input, end_input = _sound_inputs(items, len(segments))
+    args.extend(sound_args)
+
+    # 滤镜图可能很长，写入文件避免超出命令行长度限制
+    with open(script_path, 'w', encoding='utf-8') as f:
+        f.write(build_filtergraph(segments, settings, ding_input, end_input))
+
+    run_ffmpeg(
+        args + ['-filter_complex_script', script_path, '-map', '[outv]', '-map', '[outa]']
+        + encode_args(settings) + (extra_args or []) + ['-movflags', '+faststart', dst],
+        f"渲染 {os.path.basename(dst)} "
+    )
+
+def render_targets(items: list, targets: list, script_path: str) -> None:
+    """用一次 ffmpeg 调用把同一条时间线渲染成多个输出
+
+    items 同 render_timeline，但过渡画面（'still' / 'final'）的 'path' 是每个目标各自尺寸的图片列表；
+    targets 中每一项是 {'path': 输出文件, 'settings': 编码参数}。
+    """
+    args = []
+    segments = []
+    inputs = 0
+    for item in items:
+        duration = f"{item['duration']:.3f}"
+        if item['kind'] == 'clip':
+            if item.get('start'):
+                args.extend(['-ss', f"{item['start']:.3f}"])
+            args.extend(['-t', duration, '-i', item['path']])
+            index, inputs = inputs, inputs + 1
+        else:
+            for path, target in zip(item['path'], targets):
+                args.extend(['-loop', '1', '-framerate', str(target['settings']['fps']), '-t', duration, '-i', path])
+            index, inputs = list(range(inputs, inputs + len(targets))), inputs + len(targets)
+        segments.append({'input': index, 'kind': item['kind'], 'duration': item['duration'],
+                         'has_audio': item.get('has_audio', False)})
+
+    sound_args, ding_input, end_input = _sound_inputs(items, inputs)
+    args.extend(sound_args)
+
+    with open(script_path, 'w', encoding='utf-8') as f:
+        f.write(build_target_filtergraph(segments, [target['settings'] for target in targets], ding_input, end_input))
+
+    outputs = []
+    for t, target in enumerate(targets):
+        outputs += (['-map', f'[outv{t}]', '-map', f'[outa{t}]'] + encode_args(target['settings'])
+                    + ['-movflags', '+faststart', target['path']])
+    run_ffmpeg(args + ['-filter_complex_script', script_path] + outputs, f"渲染 {len(targets)} 个输出 ")
+
+def _timeline_items(work_dir: str, infos: list, settings: dict, title, author, color_scheme) -> list:
+    """生成每个视频对应的时间线片段 [[过渡画面, 视频], ...]，最后一组是最终画面"""
+    groups = []
+    for i, info in enumerate(infos, 1):
+        start, end = clip_window(info)
+        groups.append([
+            {'kind': 'still', 'duration': TRANSITION_DURATION,
+             'path': _render_transition(work_dir, i, settings, title, author, color_scheme)},
+            {'kind': 'clip', 'path': info['path'], 'start': start, 'duration': end - start,
+             'has_audio': info['has_audio']},
+        ])
+    groups.append([
+        {'kind': 'final', 'duration': FINAL_DURATION,
+         'path': _render_transition(work_dir, len(infos) + 1, settings, color_scheme=color_scheme, is_final=True)},
+    ])
+    return groups
+
+def merge_with_filtergraph(clips: list, output_path: str, title="今日份快乐", author="",
+                           color_scheme='p6', settings: dict = None) -> None:
+    """用一次 ffmpeg 调用完成缩放、黑边、裁剪、拼接和音效混合，不经过 Python 逐帧处理"""
+    settings = dict(settings or DEFAULT_SETTINGS)
+    work_dir = tempfile.mkdtemp(prefix='merge_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        infos = _probe_all(clips)
+        with merge_trace.span('transition', clips=len(infos) + 1):
+            items = [item for group in _timeline_items(work_dir, infos, settings, title, author, color_scheme)
+                     for item in group]
+
+        logging.info(f"单次 ffmpeg 渲染 {len(infos)} 个视频")
+        # 缩放、拼接和编码都在同一个 ffmpeg 进程中完成，只能整体计时
+        with merge_trace.span('encode', clips=len(infos)):
+            render_timeline(items, output_path, settings, os.path.join(work_dir, 'filtergraph.txt'))
+        _count_written(output_path)
+        check_duration(output_path, sum(item['duration'] for item in items))
+    finally:
+        with merge_trace.span('cleanup'):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def segment_args(settings: dict, workers: int) -> list:
+    """并行编码片段时的额外参数：固定关键帧间隔，保证片段可以直接拼接
+
+    编码配置没有指定线程数时，按进程数平分 CPU，避免进程数 x 线程数远超核数。
+    """
+    args = ['-sc_threshold', '0', '-force_key_frames', 'expr:gte(t,n_forced*2)']
+    if not settings.get('threads'):
+        args += ['-threads', str(max(1, (os.cpu_count() or 1) // workers))]
+    return args
+
+def encode_normalized(info: dict, dst: str, settings: dict, extra_args: list = None) -> None:
+    """把一个视频缩放加黑边、统一参数后编码成可以直接拼接的片段"""
+    start, end = clip_window(info)
+    script_path = dst + '.filtergraph.txt'
+    try:
+        render_timeline([{'kind': 'clip', 'path': info['path'], 'start': start, 'duration': end - start,
+                          'has_audio': info['has_audio']}],
+                        dst, settings, script_path, extra_args)
+    finally:
+        if os.path.exists(script_path):
+            os.remove(script_path)
+
+def merge_targets(clips: list, targets: list, title="今日份快乐", author="", color_scheme='p6') -> None:
+    """一次解码同时输出多个目标（例如 720x1280、1080x1920 和 1080x1080）
+
+    targets 中每一项是 {'path': 输出文件, 'settings': 编码参数}。每个视频只解码一次，
+    过渡画面按每个目标的尺寸分别绘制，缩放、黑边和编码按目标各自进行。
+    """
+    work_dir = tempfile.mkdtemp(prefix='merge_', dir=os.path.dirname(os.path.abspath(targets[0]['path'])))
+    try:
+        infos = _probe_all(clips)
+        with merge_trace.span('transition', clips=len(infos) + 1, outputs=len(targets)):
+            timelines = []
+            for t, target in enumerate(targets):
+                target_dir = os.path.join(work_dir, f'target_{t}')
+                os.makedirs(target_dir)
+                timelines.append([item for group in _timeline_items(target_dir, infos, target['settings'],
+                                                                    title, author, color_scheme)
+                                  for item in group])
+        # 视频在每个目标的时间线中都一样，过渡画面换成各目标的图片列表
+        items = [item if item['kind'] == 'clip' else dict(item, path=[timeline[k]['path'] for timeline in timelines])
+                 for k, item in enumerate(timelines[0])]
+
+        logging.info(f"单次 ffmpeg 渲染 {len(infos)} 个视频，同时输出 {len(targets)} 个文件")
+        with merge_trace.span('encode', clips=len(infos), outputs=len(targets)):
+            render_targets(items, targets, os.path.join(work_dir, 'filtergraph.txt'))
+        expected = sum(item['duration'] for item in items)
+        for target in targets:
+            _count_written(target['path'])
+            check_duration(target['path'], expected)
+    finally:
+        with merge_trace.span('cleanup'):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def _segment_job(job: dict) -> str:
+    """进程池中执行：编码一个中间片段（过渡画面或视频），返回片段路径"""
+    if job['kind'] == 'transition':
+        return transition_segment(job['work_dir'], job['number'], job['settings'], job['title'],
+                                  job['author'], job['color_scheme'], job['is_final'], job['cache_dir'])
+    render_timeline(job['items'], job['dst'], job['settings'], job['dst'] + '.filtergraph.txt', job['extra_args'])
+    return job['dst']
+
+def merge_with_segments(clips: list, output_path: str, title="今日份快乐", author="",
+                        color_scheme='p6', settings: dict = None, workers: int = None,
+                        retries: int = 2, progress=None, incremental: bool = False) -> None:
+    """多进程并行编码：过渡画面和每个视频各自编码成一个中间片段，最后无损拼接
+
+    片段使用相同的编码参数和固定关键帧间隔，拼接时直接复制流；过渡画面优先使用片段缓存。
+    workers 为并行进程数（默认 CPU 核数），失败的片段单独重试 retries 次，不影响其他片段。
+    progress(完成数, 总数, 片段名) 在每个片段完成时调用。
+    incremental 为 True 时片段保存在 <输出>.segments/ 中，再次合并只编码新增或修改过的视频。
+    """
+    settings = dict(settings or DEFAULT_SETTINGS)
+    workers = max(1, workers or os.cpu_count() or 1)
+    work_dir = tempfile.mkdtemp(prefix='merge_', dir=os.path.dirname(os.path.abspath(output_path)))
+    store = SegmentStore(output_path) if incremental else None
+    success = False
+    try:
+        infos = _probe_all(clips)
+
+        extra_args = segment_args(settings, workers)
+
+        def transition_job(number, is_final=False):
+            return {
+                'kind': 'transition', 'name': 'final' if is_final else f'transition_{number}',
+                'duration': FINAL_DURATION if is_final else TRANSITION_DURATION,
+                'work_dir': work_dir, 'number': number, 'settings': settings, 'title': title,
+                'author': author, 'color_scheme': color_scheme, 'is_final': is_final,
+                'cache_dir': store.transitions_dir if store else None,
+            }
+
+        jobs = []
+        for i, info in enumerate(infos, 1):
+            jobs.append(transition_job(i))
+            start, end = clip_window(info)
+            job = {
+                'kind': 'clip', 'name': os.path.basename(info['path']), 'duration': end - start,
+                'items': [{'kind': 'clip', 'path': info['path'], 'start': start, 'duration': end - start,
+                           'has_audio': info['has_audio']}],
+                'dst': os.path.join(work_dir, f'clip_{i:04d}.mp4'),
+                'settings': settings,
+                'extra_args': extra_args,
+            }
+            if store:
+                job['store_settings'] = store_settings(settings, info)
+                job['path'] = store.get(info['path'], job['store_settings'])
+                job['dst'] = job['path'] or store.reserve(info['path'], job['store_settings'])
+            jobs.append(job)
+        jobs.append(transition_job(len(infos) + 1, is_final=True))
+
+        paths = [job.get('path') for job in jobs]
+        pending = [index for index, path in enumerate(paths) if path is None]
+        done = len(jobs) - len(pending)
+        logging.info(f"并行编码 {len(pending)} 个片段（{done} 个已有片段直接使用），{workers} 个进程")
+        tracer = merge_trace.current()
+        for attempt in range(retries + 1):
+            if not pending:
+                break
+            failed = []
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+                submitted = tracer.now()
+                futures = {pool.submit(_segment_job, jobs[index]): index for index in pending}
+                for future in as_completed(futures):
+                    index = futures[future]
+                    name = jobs[index]['name']
+                    # 片段在子进程中编码，这里记录从提交到完成的时间（包括排队），每个片段单独一行
+                    tracer.add_span('encode' if jobs[index]['kind'] == 'clip' else 'transition',
+                                    submitted, tracer.now(), tid=index + 1, file=name, attempt=attempt + 1)
+                    try:
+                        paths[index] = future.result()
+                        if jobs[index]['kind'] == 'clip':
+                            _count_written(paths[index])
+                        if store and jobs[index]['kind'] == 'clip':
+                            store.put(jobs[index]['items'][0]['path'], jobs[index]['store_settings'],
+                                      paths[index], jobs[index]['duration'])
+                    except Exception as e:
+                        failed.append(index)
+                        logging.warning(f"片段 {name} 编码失败 ({attempt + 1}/{retries + 1}): {str(e)}")
+                        continue
+                    done += 1
+                    logging.info(f"片段完成 {done}/{len(jobs)}: {name}")
+                    if progress:
+                        progress(done, len(jobs), name)
+            if not failed:
+                break
+            pending = sorted(failed)
+        else:
+            raise RuntimeError(f"{len(pending)} 个片段多次编码失败")
+
+        concat_segments([{'path': path} for path in paths], output_path, work_dir)
+        check_duration(output_path, sum(job['duration'] for job in jobs))
+        success = True
+    finally:
+        with merge_trace.span('cleanup'):
+            if store:
+                store.save(prune=success)
+            shutil.rmtree(work_dir, ignore_errors=True)
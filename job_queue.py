@@ -0,0 +1,402 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+from download_manifest import extract_shortcode
+
+# 任务库默认放在下载根目录，Docker 中随 downloads 一起映射到宿主机
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "./downloads/.download_jobs.sqlite3")
+
+# 链接状态
+PENDING = "pending"
+RESOLVING = "resolving"
+DOWNLOADING = "downloading"
+DONE = "done"
+FAILED = "failed"
+
+STATE_LABELS = {
+    PENDING: "等待中",
+    RESOLVING: "解析中",
+    DOWNLOADING: "下载中",
+    DONE: "已完成",
+    FAILED: "失败",
+}
+
+class JobStore:
+    """持久化的下载任务库（SQLite）
+
+    每条链接一行，记录状态、尝试次数、失败原因和下一次重试时间。
+    失败且 next_attempt_at 为空表示已放弃重试。
+    调度器用 claim_due() 领取任务并持有租约（lease_until），多个调度器（例如 Web 界面和命令行）
+    共用同一个任务库时不会重复处理；租约过期的任务由 recover() 放回等待队列。
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch_id TEXT NOT NULL,
+                link TEXT NOT NULL,
+                output_folder TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at REAL,
+                concurrency INTEGER,
+                fetch_mode TEXT,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, next_attempt_at);
+            CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id);
+        """)
+        # 旧版任务库没有按批次保存的下载参数（为空时使用调度器默认值）和租约，补上这些列
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("concurrency", "INTEGER"), ("fetch_mode", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.commit()
+
+    def submit(self, links: List[str], output_folder: str, concurrency: int = None,
+               fetch_mode: str = None) -> str:
+        """提交一批链接，返回批次号；concurrency / fetch_mode 随批次保存，为空时使用调度器默认值"""
+        batch_id = time.strftime("%m%d-%H%M%S-") + uuid.uuid4().hex[:4]
+        now = time.time()
+        output_folder = os.path.abspath(output_folder)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO jobs (batch_id, link, output_folder, state, next_attempt_at, concurrency, fetch_mode, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(batch_id, link, output_folder, PENDING, now, concurrency, fetch_mode, now, now) for link in links]
+            )
+            self._conn.commit()
+        return batch_id
+
+    def recover(self) -> int:
+        """把中断在 resolving / downloading 且租约已过期的任务放回等待队列，返回数量
+
+        其他调度器正在处理（租约未过期）的任务不受影响。
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET state = ?, next_attempt_at = ?, lease_until = NULL, updated_at = ? "
+                "WHERE state IN (?, ?) AND (lease_until IS NULL OR lease_until < ?)",
+                (PENDING, now, now, RESOLVING, DOWNLOADING, now)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def claim_due(self, lease: float, limit: int = 50) -> List[dict]:
+        """领取到期的任务（等待中的，以及到了重试时间的失败任务），标记为解析中并持有 lease 秒的租约
+
+        查询和更新在同一个写事务中完成，同一个任务不会被两个调度器同时领取。
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [row[0] for row in self._conn.execute(
+                    "SELECT id FROM jobs WHERE state IN (?, ?) AND next_attempt_at IS NOT NULL "
+                    "AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                    (PENDING, FAILED, now, limit)
+                )]
+                placeholders = ",".join("?" * len(ids))
+                if ids:
+                    self._conn.execute(
+                        f"UPDATE jobs SET state = ?, lease_until = ?, updated_at = ? WHERE id IN ({placeholders})",
+                        [RESOLVING, now + lease, now] + ids
+                    )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            if not ids:
+                return []
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs WHERE id IN ({placeholders}) ORDER BY next_attempt_at, id", ids
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def renew(self, job_ids: List[int], lease: float) -> None:
+        """延长仍在处理中的任务的租约"""
+        if not job_ids:
+            return
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET lease_until = ? WHERE id IN ({','.join('?' * len(job_ids))}) "
+                "AND state IN (?, ?)",
+                [time.time() + lease] + list(job_ids) + [RESOLVING, DOWNLOADING]
+            )
+            self._conn.commit()
+
+    def next_due_at(self) -> Optional[float]:
+        """最近一个待执行任务的时间，没有则返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM jobs WHERE state IN (?, ?) AND next_attempt_at IS NOT NULL",
+                (PENDING, FAILED)
+            ).fetchone()
+        return row[0]
+
+    def set_state(self, job_id: int, state: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (state, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def mark_done(self, job_id: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, last_error = NULL, "
+                "next_attempt_at = NULL, lease_until = NULL, updated_at = ? WHERE id = ?",
+                (DONE, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def mark_failed(self, job_id: int, reason: str, retry_at: Optional[float]) -> None:
+        """记录失败；retry_at 为空表示不再重试"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, last_error = ?, "
+                "next_attempt_at = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                (FAILED, reason, retry_at, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def batches(self, limit: int = 10) -> List[dict]:
+        """最近的批次及各状态数量"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT batch_id, output_folder, MIN(created_at) AS created_at, "
+                "SUM(state = 'pending') AS pending, SUM(state = 'resolving') AS resolving, "
+                "SUM(state = 'downloading') AS downloading, SUM(state = 'done') AS done, "
+                "SUM(state = 'failed' AND next_attempt_at IS NOT NULL) AS retrying, "
+                "SUM(state = 'failed' AND next_attempt_at IS NULL) AS failed, COUNT(*) AS total "
+                "FROM jobs GROUP BY batch_id ORDER BY created_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def batch_jobs(self, batch_id: str) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE batch_id = ? ORDER BY id", (batch_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+def format_status(store: JobStore, batch_id: str = None, limit: int = 10) -> str:
+    """生成队列状态文本，指定批次时列出每条链接"""
+    if batch_id:
+        jobs = store.batch_jobs(batch_id)
+        if not jobs:
+            return f"未找到批次: {batch_id}"
+        lines = [f"批次 {batch_id} -> {jobs[0]['output_folder']}"]
+        for job in jobs:
+            line = f"[{STATE_LABELS.get(job['state'], job['state'])}] {job['link']} (尝试 {job['attempts']} 次)"
+            if job["last_error"]:
+                line += f" 原因: {job['last_error']}"
+            if job["state"] == FAILED and job["next_attempt_at"]:
+                line += f" 下次重试: {time.strftime('%H:%M:%S', time.localtime(job['next_attempt_at']))}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    batches = store.batches(limit)
+    if not batches:
+        return "队列为空"
+    lines = []
+    for b in batches:
+        lines.append(
+            f"{b['batch_id']}  完成 {b['done']}/{b['total']}  等待 {b['pending']}  "
+            f"进行中 {b['resolving'] + b['downloading']}  待重试 {b['retrying']}  失败 {b['failed']}  "
+            f"-> {b['output_folder']}"
+        )
+    return "\n".join(lines)
+
+class JobScheduler:
+    """下载任务调度器
+
+    定期从任务库取出到期的任务，按输出目录和下载参数分组交给异步下载引擎；
+    每个批次提交时保存的并发数和下载方式优先，未指定时使用调度器的默认值；
+    失败的链接按指数退避加随机抖动安排重试，超过最大次数后放弃。
+    领取的任务持有 lease 秒的租约，处理期间定期续租；进程退出后租约过期，任务会被重新领取。
+    """
+
+    def __init__(self, store: JobStore, concurrency: int = 3, fetch_mode: str = "http",
+                 max_attempts: int = 5, base_delay: float = 30.0, max_delay: float = 1800.0,
+                 poll_interval: float = 5.0, lease: float = 300.0):
+        self.store = store
+        self.concurrency = concurrency
+        self.fetch_mode = fetch_mode
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._wakeup = None
+
+    def retry_delay(self, attempts: int) -> float:
+        """第 attempts 次失败后的等待时间（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1)))
+
+    def wake(self) -> None:
+        """有新任务提交时唤醒调度循环（可以从其他线程调用）"""
+        if self._wakeup is not None:
+            loop, event = self._wakeup
+            loop.call_soon_threadsafe(event.set)
+
+    async def _run_group(self, output_folder: str, jobs: List[dict], service=None,
+                         concurrency: int = None, fetch_mode: str = None) -> None:
+        """用下载引擎处理同一个输出目录、同样下载参数的一组任务"""
+        from video_down_play import download_videos_async
+
+        # 引擎按短码去重，同一个帖子的多条任务一起更新
+        by_key = {}
+        for job in jobs:
+            by_key.setdefault(extract_shortcode(job["link"]) or job["link"], []).append(job)
+        finished = set()
+
+        def on_state(link: str, state: str, reason: str = None) -> None:
+            for job in by_key.get(extract_shortcode(link) or link, []):
+                if state == DONE:
+                    self.store.mark_done(job["id"])
+                    finished.add(job["id"])
+                elif state == FAILED:
+                    self._fail(job, reason)
+                    finished.add(job["id"])
+                else:
+                    self.store.set_state(job["id"], state)
+
+        async def keep_leases() -> None:
+            while True:
+                await asyncio.sleep(self.lease / 3)
+                self.store.renew([job["id"] for job in jobs if job["id"] not in finished], self.lease)
+
+        links = [job["link"] for job in jobs]
+        heartbeat = asyncio.create_task(keep_leases())
+        try:
+            result = await download_videos_async(
+                links, output_folder, concurrency=concurrency or self.concurrency,
+                fetch_mode=fetch_mode or self.fetch_mode,
+                service=service, on_state=on_state
+            )
+        finally:
+            heartbeat.cancel()
+        print(result)
+
+        # 引擎整体出错时没有回调，这些任务同样按失败处理
+        for job in jobs:
+            if job["id"] not in finished:
+                self._fail(job, result.strip().splitlines()[0] if result else "下载未完成")
+
+    def _fail(self, job: dict, reason: str) -> None:
+        attempts = job["attempts"] + 1
+        retry_at = None
+        if attempts < self.max_attempts:
+            retry_at = time.time() + self.retry_delay(attempts)
+        self.store.mark_failed(job["id"], reason or "未知错误", retry_at)
+
+    async def run_once(self, service=None) -> int:
+        """处理一轮到期任务，返回处理的任务数"""
+        jobs = self.store.claim_due(self.lease)
+        groups = {}
+        for job in jobs:
+            key = (job["output_folder"], job["concurrency"], job["fetch_mode"])
+            groups.setdefault(key, []).append(job)
+        for (output_folder, concurrency, fetch_mode), group in groups.items():
+            await self._run_group(output_folder, group, service, concurrency, fetch_mode)
+        return len(jobs)
+
+    async def run_forever(self, service=None, stop_when_idle: bool = False) -> None:
+        """持续调度；stop_when_idle 为 True 时所有任务都结束（完成或放弃）后返回"""
+        event = asyncio.Event()
+        self._wakeup = (asyncio.get_running_loop(), event)
+        recovered = self.store.recover()
+        if recovered:
+            print(f"恢复了 {recovered} 个中断的任务")
+
+        while True:
+            try:
+                processed = await self.run_once(service)
+            except Exception as e:
+                print(f"调度出错: {str(e)}")
+                processed = 0
+            if processed:
+                continue
+
+            next_due = self.store.next_due_at()
+            if next_due is None and stop_when_idle:
+                return
+            timeout = self.poll_interval if next_due is None else min(
+                self.poll_interval * 12, max(0.0, next_due - time.time())
+            )
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+def _read_links(source: str) -> List[str]:
+    """从文件或标准输入读取链接"""
+    import sys
+    from video_down_play import extract_video_links
+    text = sys.stdin.read() if source == "-" else open(source, encoding="utf-8").read()
+    return extract_video_links(text)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='下载任务队列')
+    parser.add_argument('--db', type=str, default=JOB_DB_PATH, help='任务库路径')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    submit_parser = subparsers.add_parser('submit', help='提交链接')
+    submit_parser.add_argument('source', type=str, help='包含链接的文本文件，- 表示标准输入')
+    submit_parser.add_argument('--output_folder', '-o', type=str, default='./downloads', help='下载目录')
+    submit_parser.add_argument('--concurrency', '-c', type=int, help='该批次的并发页面数，默认使用调度器设置')
+    submit_parser.add_argument('--fetch_mode', type=str, choices=['http', 'browser'], help='该批次的下载方式，默认使用调度器设置')
+
+    status_parser = subparsers.add_parser('status', help='查看队列状态')
+    status_parser.add_argument('--batch', '-b', type=str, help='批次号，指定时列出每条链接')
+
+    run_parser = subparsers.add_parser('run', help='运行调度器，处理完所有任务后退出')
+    run_parser.add_argument('--concurrency', '-c', type=int, default=3, help='批次未指定时的并发页面数')
+    run_parser.add_argument('--fetch_mode', type=str, choices=['http', 'browser'], default='http', help='批次未指定时的下载方式')
+    run_parser.add_argument('--max_attempts', type=int, default=5, help='每条链接最多尝试次数')
+    run_parser.add_argument('--forever', action='store_true', help='持续运行，等待新任务')
+
+    args = parser.parse_args()
+    store = JobStore(args.db)
+
+    if args.command == 'submit':
+        links = _read_links(args.source)
+        if not links:
+            print("未找到有效的视频链接")
+        else:
+            batch_id = store.submit(links, args.output_folder, args.concurrency, args.fetch_mode)
+            print(f"已提交 {len(links)} 条链接，批次号: {batch_id}")
+    elif args.command == 'status':
+        print(format_status(store, args.batch))
+    elif args.command == 'run':
+        scheduler = JobScheduler(store, concurrency=args.concurrency, fetch_mode=args.fetch_mode,
+                                 max_attempts=args.max_attempts)
+        try:
+            asyncio.run(scheduler.run_forever(stop_when_idle=not args.forever))
+        except KeyboardInterrupt:
+            print("\n调度器已停止，未完成的任务下次启动时继续")
+        print(format_status(store))
@@ -0,0 +1,100 @@
+import os
+import httpx
+from rate_limiter import RateLimiter, get_rate_limiter
+
+# 每次写入磁盘的块大小
+CHUNK_SIZE = 256 * 1024
+
+# 连接池配置：同一个 CDN 主机的连接会被复用
+POOL_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=8, keepalive_expiry=30)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Connection': 'keep-alive',
+}
+
+def _retry_after(response) -> float:
+    """解析 Retry-After 头（只支持秒数形式）"""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+class MediaFetcher:
+    """用一个共享的连接池直接下载媒体地址
+
+    数据边下载边写入 <目标文件>.part，完成后重命名为最终文件；
+    传输中断时下一次尝试用 Range 请求从已写入的位置续传。
+    每个请求前向限速器领取令牌，429 和服务器错误会让该主机进入冷却期。
+    """
+
+    def __init__(self, referer: str = None, retries: int = 3, timeout: float = 60.0,
+                 rate_limiter: RateLimiter = None):
+        headers = dict(DEFAULT_HEADERS)
+        if referer:
+            headers['Referer'] = referer
+        self.retries = retries
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            limits=POOL_LIMITS,
+            timeout=httpx.Timeout(timeout, connect=15.0),
+            follow_redirects=True,
+        )
+
+    async def fetch(self, url: str, save_path: str) -> int:
+        """下载 url 到 save_path，返回文件大小（字节）"""
+        part_path = save_path + ".part"
+        last_error = None
+
+        for attempt in range(1, self.retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            await self.rate_limiter.acquire_async(url)
+            try:
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    if offset and response.status_code == 416:
+                        # 服务器认为已经没有剩余内容，说明上次其实已下载完整
+                        break
+                    response.raise_for_status()
+
+                    if offset and response.status_code != 206:
+                        # 服务器不支持 Range，只能从头开始
+                        offset = 0
+
+                    expected = None
+                    if 'Content-Length' in response.headers:
+                        expected = offset + int(response.headers['Content-Length'])
+
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                            f.write(chunk)
+
+                size = os.path.getsize(part_path)
+                if expected is not None and size < expected:
+                    raise httpx.ReadError(f"传输中断: {size}/{expected} 字节")
+                self.rate_limiter.reward(url)
+                break
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                last_error = e
+                retry_after = None
+                if isinstance(e, httpx.HTTPStatusError):
+                    status = e.response.status_code
+                    # 4xx 错误重试也没有意义（429 除外）
+                    if status < 500 and status != 429:
+                        raise
+                    retry_after = _retry_after(e.response)
+                # 冷却期由限速器统一控制，下一次 acquire 会自动等待
+                self.rate_limiter.penalize(url, retry_after)
+                if attempt < self.retries:
+                    print(f"下载中断，准备续传 ({attempt}/{self.retries}): {str(e)}")
+        else:
+            raise Exception(f"下载失败: {str(last_error)}")
+
+        os.replace(part_path, save_path)
+        return os.path.getsize(save_path)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
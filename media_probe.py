@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+
+FFPROBE = os.getenv("FFPROBE_BINARY", "ffprobe")
+
+# 每个文件夹的视频信息索引
+INDEX_NAME = ".media_index.json"
+INDEX_VERSION = 1
+
+# 并行运行的 ffprobe 数量
+PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", 8))
+
+_index_lock = threading.Lock()
+
+def ffprobe_available() -> bool:
+    return shutil.which(FFPROBE) is not None
+
+def _fps(rate: str) -> float:
+    """把 ffprobe 的帧率（如 30000/1001）转成浮点数"""
+    try:
+        value = Fraction(rate)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return 0.0
+    return float(value) if value.denominator else 0.0
+
+def _rotation(stream: dict) -> int:
+    """读取视频旋转角度（新版 ffprobe 在 side_data 中，旧版在 tags 中）"""
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            return int(float(side_data["rotation"])) % 360
+    try:
+        return int(stream.get("tags", {}).get("rotate", 0)) % 360
+    except ValueError:
+        return 0
+
+def probe_media(path: str) -> dict:
+    """用 ffprobe 读取媒体文件的基本信息
+
+    返回的字典包含：duration、width、height（已按旋转角度换算成显示尺寸）、fps、fps_rate、
+    vcodec、profile、pix_fmt、timescale、rotation、has_audio、acodec、sample_rate、channels。
+    """
+    result = subprocess.run(
+        [FFPROBE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe 读取失败 {path}: {result.stderr.strip()}")
+    data = json.loads(result.stdout or "{}")
+
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"
+                  and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    if video is None:
+        raise RuntimeError(f"没有视频流: {path}")
+
+    duration = float(data.get("format", {}).get("duration") or video.get("duration") or 0)
+    rotation = _rotation(video)
+    width, height = int(video.get("width", 0)), int(video.get("height", 0))
+    if rotation in (90, 270):
+        width, height = height, width
+
+    fps_rate = video.get("r_frame_rate") or video.get("avg_frame_rate") or "0/1"
+    time_base = video.get("time_base", "1/1")
+
+    return {
+        "path": os.path.abspath(path),
+        "duration": duration,
+        "width": width,
+        "height": height,
+        "fps": _fps(fps_rate),
+        "fps_rate": fps_rate,
+        "vcodec": video.get("codec_name"),
+        "profile": (video.get("profile") or "").lower(),
+        "pix_fmt": video.get("pix_fmt"),
+        "timescale": Fraction(time_base).denominator if "/" in time_base else 0,
+        "rotation": rotation,
+        "has_audio": audio is not None,
+        "acodec": audio.get("codec_name") if audio else None,
+        "sample_rate": int(audio.get("sample_rate", 0)) if audio else 0,
+        "channels": int(audio.get("channels", 0)) if audio else 0,
+    }
+
+def _fingerprint(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _load_index(folder: str) -> dict:
+    try:
+        with open(os.path.join(folder, INDEX_NAME), encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data.get("files", {}) if data.get("version") == INDEX_VERSION else {}
+
+def _save_index(folder: str, files: dict) -> None:
+    index_path = os.path.join(folder, INDEX_NAME)
+    tmp_path = index_path + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": INDEX_VERSION, "files": files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        # 只读目录等情况下不保存索引，下次重新读取
+        logging.debug(f"保存视频信息索引失败 {folder}: {str(e)}")
+
+def probe_many(paths: list, workers: int = PROBE_WORKERS) -> dict:
+    """批量读取视频信息，返回 {绝对路径: probe_media 的结果}，读取失败的文件不在结果中
+
+    结果按文件名、大小和修改时间缓存在各文件夹的 .media_index.json 中，
+    只有新增或变化的文件才会并行调用 ffprobe。
+    """
+    by_folder = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        by_folder.setdefault(os.path.dirname(path), []).append(path)
+
+    results = {}
+    for folder, folder_paths in by_folder.items():
+        with _index_lock:
+            files = _load_index(folder)
+
+        missing = []
+        for path in folder_paths:
+            try:
+                fingerprint = _fingerprint(path)
+            except OSError:
+                continue
+            entry = files.get(os.path.basename(path))
+            if entry and entry.get("fingerprint") == fingerprint:
+                results[path] = dict(entry["info"], path=path)
+            else:
+                missing.append((path, fingerprint))
+
+        if not missing:
+            continue
+        if not ffprobe_available():
+            logging.warning("未找到 ffprobe，无法读取视频信息")
+            continue
+
+        def probe(item):
+            path, fingerprint = item
+            try:
+                return path, fingerprint, probe_media(path)
+            except Exception as e:
+                logging.error(f"读取视频信息 {os.path.basename(path)} 失败: {str(e)}")
+                return path, fingerprint, None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+            probed = list(pool.map(probe, missing))
+
+        with _index_lock:
+            # 重新读取，合并其他线程同时写入的结果
+            files = _load_index(folder)
+            for path, fingerprint, info in probed:
+                if info is None:
+                    continue
+                results[path] = info
+                files[os.path.basename(path)] = {"fingerprint": fingerprint, "info": info}
+            # 删除已经不存在的文件
+            files = {name: entry for name, entry in files.items() if os.path.exists(os.path.join(folder, name))}
+            _save_index(folder, files)
+
+    return results
@@ -0,0 +1,114 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class MergeTrace:
+    """记录合并过程中各阶段的耗时（span）和计数器
+
+    span 按 Chrome trace-event 格式保存，可以用 chrome://tracing 或 Perfetto 打开；
+    summary() 按阶段汇总次数、总耗时和最长耗时。
+    """
+
+    def __init__(self):
+        self.events = []
+        self.counters = {}
+        self.output_path = None
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def now(self) -> float:
+        """相对于开始时间的微秒数"""
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def add_span(self, name: str, start: float, end: float, tid: int = None, **args) -> None:
+        """记录一个已经结束的 span（start / end 为 now() 的返回值）"""
+        event = {
+            "name": name, "cat": "merge", "ph": "X", "pid": self._pid,
+            "tid": tid if tid is not None else threading.get_ident(),
+            "ts": round(start, 1), "dur": round(end - start, 1),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, self.now(), **args)
+
+    def count(self, name: str, amount: float = 1) -> None:
+        """累加计数器（例如处理的帧数、写入的字节数）"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            self.events.append({
+                "name": name, "ph": "C", "pid": self._pid, "ts": round(self.now(), 1),
+                "args": {name: self.counters[name]},
+            })
+
+    def summary(self) -> str:
+        stats = {}
+        with self._lock:
+            for event in self.events:
+                if event["ph"] != "X":
+                    continue
+                count, total, longest = stats.get(event["name"], (0, 0.0, 0.0))
+                stats[event["name"]] = (count + 1, total + event["dur"], max(longest, event["dur"]))
+            counters = dict(self.counters)
+
+        lines = ["=== 合并各阶段耗时 ===", f"{'阶段':<14}{'次数':>6}{'总耗时s':>10}{'最长s':>9}"]
+        for name, (count, total, longest) in sorted(stats.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<14}{count:>6}{total / 1e6:>10.2f}{longest / 1e6:>9.2f}")
+        for name, value in counters.items():
+            lines.append(f"{name}: {int(value)}")
+        return "\n".join(lines)
+
+    def export(self, path: str) -> None:
+        """导出为 Chrome trace-event JSON"""
+        with self._lock:
+            data = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+class _NullTrace(MergeTrace):
+    """没有正在进行的合并时使用，不记录任何内容"""
+
+    def add_span(self, *args, **kwargs) -> None:
+        pass
+
+    def count(self, *args, **kwargs) -> None:
+        pass
+
+# 当前合并的 trace 保存在上下文变量中，同时进行的多个合并（不同线程或协程）互不影响
+_current = contextvars.ContextVar('merge_trace', default=_NullTrace())
+
+def current() -> MergeTrace:
+    """当前合并的 trace，没有时返回一个不记录的空对象"""
+    return _current.get()
+
+@contextmanager
+def tracing():
+    """在 with 块中启用 trace，合并过程中的 span 和计数器都记录到返回的对象中"""
+    tracer = MergeTrace()
+    token = _current.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current.reset(token)
+
+def submit(pool, fn, *args, **kwargs):
+    """把任务提交到线程池，任务中记录的 span 归入提交时的 trace（线程池不会自动带上上下文）"""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def span(name: str, **args):
+    return _current.get().span(name, **args)
+
+def count(name: str, amount: float = 1) -> None:
+    _current.get().count(name, amount)
@@ -0,0 +1,138 @@
+import logging
+import merge_trace
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ffmpeg_merge import (check_duration, clip_window, concat_segments, encode_normalized, profile_settings,
+                          segment_args, store_settings, transition_segment)
+from media_probe import probe_media
+from segment_store import SegmentStore
+from video_merger import (DEFAULT_PROFILE, FINAL_DURATION, TRANSITION_DURATION, is_video_file, list_video_files,
+                          merge_videos)
+
+class MergePipeline:
+    """边下载边合并
+
+    每个下载完成的视频立即交给后台线程读取信息、缩放加黑边并编码成统一参数的片段
+    （编码在 ffmpeg 进程中进行，线程只负责等待），片段保存在 <输出>.segments/ 中。
+    全部下载结束后 finish() 只需要编码过渡画面（有缓存）并无损拼接，
+    总耗时接近 max(下载, 编码)，而不是两者之和。
+
+        pipeline = MergePipeline(folder, output_path, title, author)
+        pipeline.start()                     # 文件夹中已有的视频先开始编码
+        ... 下载，每个文件完成时调用 pipeline.submit(path) ...
+        pipeline.finish()                    # 拼接，返回输出路径
+    """
+
+    def __init__(self, folder: str, output_path: str, title="今日份快乐", author="", color_scheme='p6',
+                 profile=DEFAULT_PROFILE, workers: int = None):
+        self.folder = os.path.abspath(folder)
+        self.output_path = os.path.abspath(output_path)
+        self.title = title
+        self.author = author
+        self.color_scheme = color_scheme
+        self.profile = profile
+        self.settings = profile_settings(profile)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.extra_args = segment_args(self.settings, self.workers)
+        self.store = SegmentStore(self.output_path)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='normalize')
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """把文件夹中已有的视频交给后台编码"""
+        os.makedirs(self.folder, exist_ok=True)
+        for path in list_video_files(self.folder, exclude=self.output_path):
+            self.submit(path)
+
+    def submit(self, path: str) -> None:
+        """提交一个下载完成的文件，不是视频或已经提交过时忽略；可以在任意线程中调用，不会阻塞"""
+        path = os.path.abspath(path)
+        if not is_video_file(path) or path == self.output_path or os.path.dirname(path) != self.folder:
+            return
+        with self._lock:
+            if path not in self._futures:
+                self._futures[path] = merge_trace.submit(self._pool, self._normalize, path)
+
+    def _normalize(self, path: str) -> tuple:
+        """读取视频信息并编码成片段，返回 (片段路径, 时长)；片段已存在且视频没有变化时直接使用"""
+        info = probe_media(path)
+        start, end = clip_window(info)
+        params = store_settings(self.settings, info)
+        segment = self.store.get(path, params)
+        if segment is None:
+            segment = self.store.reserve(path, params)
+            started = time.monotonic()
+            encode_normalized(info, segment, self.settings, self.extra_args)
+            self.store.put(path, params, segment, end - start)
+            logging.info(f"片段完成: {os.path.basename(path)} ({time.monotonic() - started:.1f}s)")
+        return segment, end - start
+
+    def finish(self) -> str:
+        """等待所有片段编码完成，按文件名顺序加上过渡画面拼接成输出文件，返回输出路径
+
+        拼接失败时改用 merge_videos 的 parallel 方式增量合并，编码参数和片段记录与这里相同，已编码的片段继续使用。
+        """
+        # 重新扫描一次，补上没有经过 submit 的文件
+        self.start()
+        paths = list_video_files(self.folder, exclude=self.output_path)
+        if not paths:
+            raise RuntimeError(f"未找到视频文件: {self.folder}")
+
+        waited = time.monotonic()
+        segments = []
+        for path in paths:
+            try:
+                segments.append(self._futures[os.path.abspath(path)].result())
+            except Exception as e:
+                logging.error(f"跳过无法处理的视频 {os.path.basename(path)}: {str(e)}")
+        if not segments:
+            raise RuntimeError("没有可用的视频片段")
+        logging.info(f"等待剩余片段 {time.monotonic() - waited:.1f}s")
+
+        work_dir = tempfile.mkdtemp(prefix='merge_', dir=os.path.dirname(self.output_path))
+        success = False
+        try:
+            # 过渡画面和 concat 方式使用相同的参数，可以共用片段缓存
+            transitions = [
+                merge_trace.submit(self._pool, transition_segment, work_dir, number, self.settings, self.title, self.author,
+                                  self.color_scheme, False, self.store.transitions_dir)
+                for number in range(1, len(segments) + 1)
+            ]
+            transitions.append(merge_trace.submit(self._pool, transition_segment, work_dir, len(segments) + 1,
+                                                  self.settings, None, None, self.color_scheme, True,
+                                                  self.store.transitions_dir))
+            entries = []
+            expected = FINAL_DURATION
+            for transition, (segment, duration) in zip(transitions, segments):
+                entries += [{'path': transition.result()}, {'path': segment}]
+                expected += TRANSITION_DURATION + duration
+            entries.append({'path': transitions[-1].result()})
+
+            concat_segments(entries, self.output_path, work_dir)
+            check_duration(self.output_path, expected)
+            success = True
+        except Exception as e:
+            logging.error(f"拼接失败，改用增量合并: {str(e)}")
+        finally:
+            # 失败时保留全部片段和记录，增量合并可以直接使用
+            self.store.save(prune=success)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if success:
+            logging.info(f"拼接完成，共 {len(segments)} 个视频: {self.output_path}")
+            return self.output_path
+        # concat 方式会按视频情况改写编码参数，片段记录对不上，所以固定用 parallel
+        if not merge_videos(input_dir=self.folder, output_path=self.output_path, title=self.title,
+                            author=self.author, color_scheme=self.color_scheme, engine='parallel',
+                            workers=self.workers, incremental=True, profile=self.profile):
+            raise RuntimeError("合并失败，请查看 video_merger.log")
+        return self.output_path
+
+    def close(self) -> None:
+        """停止后台编码，未开始的任务直接取消"""
+        self._pool.shutdown(wait=True, cancel_futures=True)
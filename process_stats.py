@@ -0,0 +1,104 @@
+import os
+import threading
+
+def _proc_children() -> dict:
+    """读取 /proc 得到 {父进程号: [子进程号]}（仅 Linux）"""
+    children = {}
+    if not os.path.isdir("/proc"):
+        return children
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+def _proc_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def process_usage(pid: int = None, include_self: bool = True) -> tuple:
+    """返回 (进程及其所有子孙进程的常驻内存字节数, 子孙进程数)
+
+    include_self 为 False 时只统计子孙进程（例如只看浏览器子进程）。
+    优先使用 psutil，没有安装时读取 /proc；两者都不可用时返回 (0, 0)。
+    """
+    pid = pid or os.getpid()
+    try:
+        import psutil
+        try:
+            proc = psutil.Process(pid)
+            descendants = proc.children(recursive=True)
+            rss = proc.memory_info().rss if include_self else 0
+        except psutil.Error:
+            return 0, 0
+        for child in descendants:
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                continue
+        return rss, len(descendants)
+    except ImportError:
+        pass
+
+    children = _proc_children()
+    descendants = []
+    stack = list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        descendants.append(child)
+        stack.extend(children.get(child, []))
+    rss = _proc_rss(pid) if include_self else 0
+    return rss + sum(_proc_rss(child) for child in descendants), len(descendants)
+
+class UsageSampler:
+    """后台线程定期采样内存和子进程数，记录峰值
+
+        with UsageSampler() as usage:
+            ...
+        print(usage.peak_rss, usage.peak_children)
+
+    默认统计当前进程及其子孙进程；pid 指定要统计的进程（例如一个子进程），
+    include_self 为 False 时不计入该进程本身。
+    """
+
+    def __init__(self, interval: float = 0.5, pid: int = None, include_self: bool = True):
+        self.interval = interval
+        self.pid = pid
+        self.include_self = include_self
+        self.peak_rss = 0
+        self.peak_children = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="usage-sampler", daemon=True)
+
+    def sample(self) -> None:
+        rss, children = process_usage(self.pid, self.include_self)
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_children = max(self.peak_children, children)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def summary(self) -> str:
+        return f"峰值内存 {self.peak_rss / 1024 / 1024:.1f} MB，峰值子进程数 {self.peak_children}"
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+# 各主机的默认限速：(每秒请求数, 突发数)
+HOST_LIMITS = {
+    "snapinsta.to": (0.5, 2),
+    "www.instagram.com": (0.3, 1),
+    "instagram.com": (0.3, 1),
+}
+
+# 未单独配置的主机（主要是媒体 CDN）
+DEFAULT_RATE = 4.0
+DEFAULT_BURST = 8
+
+def host_of(url: str) -> str:
+    """取出链接的主机名，传入的已经是主机名时原样返回"""
+    if "://" not in url:
+        return url.lower()
+    return (urlsplit(url).hostname or "").lower()
+
+class _Bucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.cooldown_until = 0.0
+        self.strikes = 0
+
+class RateLimiter:
+    """按主机的令牌桶限速器，线程和协程都可以使用
+
+    每个请求前调用 acquire / acquire_async 领取令牌，令牌不足时等待；
+    遇到 429 或错误时调用 penalize，该主机进入冷却期，连续出错时冷却时间翻倍；
+    请求成功后调用 reward 清除连续出错计数。
+    """
+
+    def __init__(self, host_limits: dict = None, default_rate: float = DEFAULT_RATE,
+                 default_burst: int = DEFAULT_BURST, cooldown: float = 5.0, max_cooldown: float = 120.0):
+        self.host_limits = dict(HOST_LIMITS if host_limits is None else host_limits)
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, host: str) -> _Bucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            rate, burst = self.host_limits.get(host, (self.default_rate, self.default_burst))
+            bucket = self._buckets[host] = _Bucket(rate, burst)
+        return bucket
+
+    def _reserve(self, url: str) -> float:
+        """预订一个令牌，返回需要等待的秒数"""
+        host = host_of(url)
+        with self._lock:
+            bucket = self._bucket(host)
+            now = time.monotonic()
+            bucket.tokens = min(bucket.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+            bucket.updated = now
+            # 令牌可以预支成负数，后来的请求排在更后面
+            bucket.tokens -= 1
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+            return max(wait, bucket.cooldown_until - now)
+
+    def acquire(self, url: str) -> float:
+        """阻塞直到可以向该主机发请求，返回实际等待的秒数"""
+        wait = self._reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, url: str) -> float:
+        wait = self._reserve(url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, url: str, retry_after: float = None) -> float:
+        """主机返回 429 或请求出错，进入冷却期，返回冷却秒数"""
+        host = host_of(url)
+        with self._lock:
+            bucket = self._bucket(host)
+            bucket.strikes += 1
+            cooldown = retry_after if retry_after else min(
+                self.max_cooldown, self.cooldown * 2 ** (bucket.strikes - 1)
+            )
+            bucket.cooldown_until = max(bucket.cooldown_until, time.monotonic() + cooldown)
+            bucket.tokens = min(bucket.tokens, 0.0)
+        print(f"[限速] {host} 进入冷却 {cooldown:.1f} 秒")
+        return cooldown
+
+    def reward(self, url: str) -> None:
+        """请求成功，清除该主机的连续出错计数"""
+        with self._lock:
+            self._bucket(host_of(url)).strikes = 0
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    """进程内共享的限速器
+
+    环境变量 RATE_LIMIT_DEFAULT="每秒请求数:突发数" 调整未单独配置的主机，
+    RATE_LIMIT_HOSTS="snapinsta.to=1:3,cdn.example.com=8:16" 覆盖指定主机。
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            host_limits = dict(HOST_LIMITS)
+            for entry in os.getenv("RATE_LIMIT_HOSTS", "").split(","):
+                if "=" in entry:
+                    host, spec = entry.split("=", 1)
+                    rate, burst = spec.split(":")
+                    host_limits[host.strip().lower()] = (float(rate), int(burst))
+            default_rate, default_burst = DEFAULT_RATE, DEFAULT_BURST
+            if os.getenv("RATE_LIMIT_DEFAULT"):
+                rate, burst = os.getenv("RATE_LIMIT_DEFAULT").split(":")
+                default_rate, default_burst = float(rate), int(burst)
+            _limiter = RateLimiter(
+                host_limits=host_limits,
+                default_rate=default_rate,
+                default_burst=default_burst,
+                cooldown=float(os.getenv("RATE_LIMIT_COOLDOWN", 5.0)),
+            )
+        return _limiter
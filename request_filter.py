@@ -0,0 +1,126 @@
+import os
+from urllib.parse import urlsplit
+
+# 自动化流程用不到的资源类型
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+
+# 广告、统计和字体服务，按域名后缀匹配
+BLOCKED_DOMAINS = (
+    "doubleclick.net",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "adservice.google.com",
+    "googletagmanager.com",
+    "googletagservices.com",
+    "google-analytics.com",
+    "analytics.google.com",
+    "fonts.googleapis.com",
+    "fonts.gstatic.com",
+    "facebook.net",
+    "hotjar.com",
+    "clarity.ms",
+    "scorecardresearch.com",
+    "cloudflareinsights.com",
+    "taboola.com",
+    "outbrain.com",
+    "popads.net",
+    "popcash.net",
+    "propellerads.com",
+    "adsterra.com",
+    "onclickads.net",
+)
+
+def _env_list(name: str) -> list:
+    value = os.getenv(name, "")
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+class RequestFilter:
+    """页面请求过滤器
+
+    通过 context.route 按资源类型和域名黑名单中止请求，只放行表单需要的内容。
+    页面导航（document）永远放行，浏览器下载模式的文件请求不受影响。
+    每次页面加载结束后打印拦截和放行的请求数量；dry_run 模式只统计不拦截，
+    此时还能测出这些请求本来会消耗多少流量。
+    """
+
+    def __init__(self, blocked_types=None, blocked_domains=None, dry_run: bool = False):
+        self.blocked_types = set(BLOCKED_RESOURCE_TYPES if blocked_types is None else blocked_types)
+        self.blocked_domains = tuple(BLOCKED_DOMAINS if blocked_domains is None else blocked_domains)
+        self.dry_run = dry_run
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取配置，REQUEST_FILTER=off 时返回 None（不过滤）"""
+        mode = os.getenv("REQUEST_FILTER", "on").lower()
+        if mode in ("0", "off", "false", "no"):
+            return None
+        blocked_types = _env_list("REQUEST_FILTER_TYPES") or None
+        return cls(
+            blocked_types=blocked_types,
+            blocked_domains=BLOCKED_DOMAINS + tuple(_env_list("REQUEST_FILTER_DOMAINS")),
+            dry_run=mode == "dry_run",
+        )
+
+    def should_block(self, resource_type: str, url: str) -> bool:
+        if resource_type == "document":
+            return False
+        if resource_type in self.blocked_types:
+            return True
+        host = (urlsplit(url).hostname or "").lower()
+        return any(host == d or host.endswith("." + d) for d in self.blocked_domains)
+
+    async def install(self, context) -> None:
+        """在上下文上安装过滤规则和统计"""
+        counters = _new_counters()
+
+        async def handle(route, request):
+            if self.should_block(request.resource_type, request.url):
+                counters["blocked"] += 1
+                counters["blocked_types"][request.resource_type] = \
+                    counters["blocked_types"].get(request.resource_type, 0) + 1
+                if not self.dry_run:
+                    await route.abort("blockedbyclient")
+                    return
+                counters["would_block"].add(request)
+            await route.continue_()
+
+        def on_response(response):
+            size = int(response.headers.get("content-length", 0) or 0)
+            if response.request in counters["would_block"]:
+                counters["blocked_bytes"] += size
+                counters["would_block"].discard(response.request)
+            else:
+                counters["allowed"] += 1
+                counters["allowed_bytes"] += size
+
+        def on_load(page):
+            self._log(page.url, counters)
+            counters.update(_new_counters())
+
+        await context.route("**/*", handle)
+        context.on("response", on_response)
+        context.on("page", lambda page: page.on("load", on_load))
+        for page in context.pages:
+            page.on("load", on_load)
+
+    def _log(self, url: str, counters: dict) -> None:
+        host = urlsplit(url).hostname or url
+        by_type = ", ".join(f"{t} {n}" for t, n in sorted(counters["blocked_types"].items()))
+        action = "可拦截" if self.dry_run else "拦截"
+        line = f"[请求过滤] {host} {action} {counters['blocked']} 个请求"
+        if by_type:
+            line += f" ({by_type})"
+        if self.dry_run:
+            line += f" / {counters['blocked_bytes'] / 1024:.0f} KB"
+        line += f"，放行 {counters['allowed']} 个 / {counters['allowed_bytes'] / 1024:.0f} KB"
+        print(line)
+
+def _new_counters() -> dict:
+    return {
+        "blocked": 0,
+        "blocked_types": {},
+        "blocked_bytes": 0,
+        "would_block": set(),
+        "allowed": 0,
+        "allowed_bytes": 0,
+    }
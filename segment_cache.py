@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from functools import lru_cache
+
+# 缓存目录和容量上限，可用环境变量覆盖；SEGMENT_CACHE=off 关闭缓存
+CACHE_DIR = os.getenv("SEGMENT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "instagramtool", "segments"))
+CACHE_MAX_MB = int(os.getenv("SEGMENT_CACHE_MAX_MB", 512))
+
+# 编码方式变化时修改版本号，让旧缓存全部失效
+CACHE_VERSION = 1
+
+@lru_cache(maxsize=64)
+def _file_digest(path: str, mtime: float, size: int) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def file_digest(path: str) -> str:
+    """文件内容的哈希（按路径、修改时间和大小缓存），文件不存在时返回 None"""
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+class SegmentCache:
+    """按内容寻址的已编码片段缓存
+
+    键由画面内容和编码参数的哈希组成，相同的过渡画面在不同的合并任务之间直接复用；
+    命中时更新文件修改时间，总大小超过上限时按最久未使用的顺序删除。
+    写入先写临时文件再原子替换，多个进程同时使用同一个目录是安全的。
+    """
+
+    def __init__(self, folder: str = CACHE_DIR, max_bytes: int = CACHE_MAX_MB * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(content: bytes, params: dict) -> str:
+        sha = hashlib.sha256()
+        sha.update(content)
+        sha.update(json.dumps({'version': CACHE_VERSION, **params}, sort_keys=True, default=str).encode())
+        return sha.hexdigest()
+
+    def path_for(self, key: str, ext: str = '.mp4') -> str:
+        return os.path.join(self.folder, key + ext)
+
+    def get(self, key: str, ext: str = '.mp4') -> str:
+        """命中时返回缓存文件路径并标记为最近使用，未命中返回 None"""
+        path = self.path_for(key, ext)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def get_or_create(self, key: str, build, ext: str = '.mp4') -> str:
+        """取出缓存文件；未命中时调用 build(临时路径) 生成文件后放入缓存"""
+        path = self.get(key, ext)
+        if path:
+            return path
+
+        tmp_path = os.path.join(self.folder, f"{key}.tmp-{os.getpid()}-{threading.get_ident()}{ext}")
+        try:
+            build(tmp_path)
+            os.replace(tmp_path, self.path_for(key, ext))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return self.path_for(key, ext)
+
+    def evict(self) -> int:
+        """总大小超过上限时删除最久未使用的文件，返回删除的文件数"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.folder):
+                if '.tmp-' in name:
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.folder, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            if removed:
+                logging.info(f"片段缓存清理了 {removed} 个文件")
+            return removed
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_segment_cache() -> SegmentCache:
+    """进程内共享的片段缓存，设置 SEGMENT_CACHE=off 时返回 None"""
+    global _cache
+    if os.getenv("SEGMENT_CACHE", "on").lower() in ("off", "0", "false"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = SegmentCache()
+            except OSError as e:
+                logging.warning(f"无法创建片段缓存目录 {CACHE_DIR}: {str(e)}")
+                return None
+        return _cache
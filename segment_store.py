@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# 记录格式变化时修改版本号，旧记录会被忽略
+STORE_VERSION = 1
+
+class SegmentStore:
+    """增量合并的片段目录
+
+    每个输出文件对应一个记录文件 <输出>.merge.json 和一个片段目录 <输出>.segments/，
+    记录每个输入视频（按路径、大小、修改时间）在什么编码参数下编码成了哪个片段。
+    再次合并时，没有变化的视频直接使用已有片段，只编码新增或修改过的视频。
+    """
+
+    def __init__(self, output_path: str):
+        output_path = os.path.abspath(output_path)
+        self.sidecar = output_path + '.merge.json'
+        self.folder = output_path + '.segments'
+        self.transitions_dir = os.path.join(self.folder, 'transitions')
+        os.makedirs(self.folder, exist_ok=True)
+        self.clips = {}
+        self.used = set()
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.sidecar, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == STORE_VERSION:
+                self.clips = data.get('clips', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取合并记录失败，将重新编码全部视频: {str(e)}")
+
+    @staticmethod
+    def _key(path: str, settings: dict) -> str:
+        stat = os.stat(path)
+        fingerprint = {
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'settings': settings,
+        }
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, path: str, settings: dict) -> str:
+        """视频没有变化且片段还在时返回片段路径，否则返回 None"""
+        path = os.path.abspath(path)
+        entry = self.clips.get(path)
+        if not entry or entry.get('key') != self._key(path, settings):
+            return None
+        segment = os.path.join(self.folder, entry['segment'])
+        if not os.path.exists(segment):
+            return None
+        with self._lock:
+            self.used.add(entry['segment'])
+        return segment
+
+    def reserve(self, path: str, settings: dict) -> str:
+        """返回新片段应该写入的路径"""
+        return os.path.join(self.folder, f"clip_{self._key(path, settings)[:16]}.mp4")
+
+    def put(self, path: str, settings: dict, segment: str, duration: float) -> None:
+        """记录视频编码成了哪个片段"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            self.clips[path] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'key': self._key(path, settings),
+                'segment': os.path.basename(segment),
+                'duration': duration,
+            }
+            self.used.add(os.path.basename(segment))
+
+    def save(self, prune: bool = True) -> None:
+        """写入记录文件；prune 为 True 时删除本次没有用到的片段和记录"""
+        with self._lock:
+            if prune:
+                self.clips = {path: entry for path, entry in self.clips.items() if entry['segment'] in self.used}
+                for name in os.listdir(self.folder):
+                    if name.startswith('clip_') and name not in self.used:
+                        try:
+                            os.remove(os.path.join(self.folder, name))
+                        except OSError:
+                            pass
+
+            tmp_path = self.sidecar + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': STORE_VERSION, 'clips': self.clips}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.sidecar)
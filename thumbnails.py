@@ -0,0 +1,80 @@
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from segment_cache import SegmentCache
+
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# 缩略图缓存目录和容量上限
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "instagramtool", "thumbnails"))
+THUMBNAIL_MAX_MB = int(os.getenv("THUMBNAIL_CACHE_MAX_MB", 64))
+
+# 缩略图宽度（高度按比例）和 JPEG 质量（2-31，越小越好）
+THUMBNAIL_WIDTH = 270
+THUMBNAIL_QUALITY = 5
+
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 8))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _get_cache() -> SegmentCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SegmentCache(THUMBNAIL_DIR, max_bytes=THUMBNAIL_MAX_MB * 1024 * 1024)
+        return _cache
+
+def _extract_frame(path: str, dst: str, position: float) -> None:
+    result = subprocess.run(
+        [FFMPEG, '-hide_banner', '-loglevel', 'error', '-y', '-ss', f"{position:.2f}", '-i', path,
+         '-frames:v', '1', '-vf', f"scale={THUMBNAIL_WIDTH}:-2", '-q:v', str(THUMBNAIL_QUALITY), dst],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0 or not os.path.exists(dst) or os.path.getsize(dst) == 0:
+        raise RuntimeError(result.stderr.strip() or "没有截取到画面")
+
+def thumbnail_for(path: str, duration: float = None) -> str:
+    """返回视频封面缩略图的路径，失败时返回 None
+
+    缩略图按视频路径、大小和修改时间缓存，视频变化后才重新生成。
+    默认截取第 1 秒的画面（视频较短时取中间），截取失败时退回第一帧。
+    """
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = hashlib.sha256(
+        f"{path}|{stat.st_size}|{stat.st_mtime_ns}|{THUMBNAIL_WIDTH}|{THUMBNAIL_QUALITY}".encode()
+    ).hexdigest()
+    position = min(1.0, duration / 2) if duration else 1.0
+
+    def build(dst):
+        try:
+            _extract_frame(path, dst, position)
+        except RuntimeError:
+            _extract_frame(path, dst, 0.0)
+
+    try:
+        return _get_cache().get_or_create(key, build, ext='.jpg')
+    except Exception as e:
+        logging.warning(f"生成缩略图失败 {os.path.basename(path)}: {str(e)}")
+        return None
+
+def thumbnails(paths: list, durations: dict = None, workers: int = THUMBNAIL_WORKERS) -> dict:
+    """并行生成一批视频的缩略图，返回 {视频路径: 缩略图路径}（失败或没有 ffmpeg 时为 None）"""
+    if not paths:
+        return {}
+    if not shutil.which(FFMPEG):
+        logging.warning("未找到 ffmpeg，无法生成缩略图")
+        return {path: None for path in paths}
+
+    durations = durations or {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(paths)))) as pool:
+        results = pool.map(lambda path: thumbnail_for(path, durations.get(path)), paths)
+        return dict(zip(paths, results))
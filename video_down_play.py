@@ -1,9 +1,39 @@
+import asyncio
 import os
+import threading
 from typing import List
-from playwright.sync_api import sync_playwright
-import random
+from playwright.async_api import async_playwright
+from browser_service import ContextPool, launch_browser
+from request_filter import RequestFilter
+from rate_limiter import get_rate_limiter, host_of
 import time
+from contextlib import contextmanager
 from datetime import datetime  # 添加这一行
+from urllib.parse import urljoin
+from media_fetcher import MediaFetcher
+from download_manifest import DownloadManifest, extract_shortcode
+
+# 可以指向本地的模拟服务（见 benchmarks/snapinsta_stub.py）做离线测试
+SNAPINSTA_URL = os.getenv("SNAPINSTA_URL", "https://snapinsta.to/")
+
+RESULT_ITEMS_SELECTOR = "ul.download-box > li > div.download-items"
+MODAL_CLOSE_SELECTOR = "#closeModalBtn"
+
+# 每个步骤的超时时间（毫秒）
+STEP_TIMEOUTS = {
+    "open_form": 30000,   # 打开页面直到输入框可见
+    "submit": 10000,      # 填写链接并点击 Download
+    "results": 30000,     # 等待结果列表或模态框出现
+    "modal": 3000,        # 关闭模态框
+    "settle": 3000,       # 等待多图结果渲染完整
+    "download": 60000,    # 单个文件下载
+}
+
+# 等待结果数量稳定时的轮询间隔（秒）
+SETTLE_POLL_INTERVAL = 0.15
+
+# 并发下载时保护文件名分配，避免同一秒内生成相同的文件名
+_save_path_lock = threading.Lock()
 
 def extract_video_links(text: str) -> List[str]:
     """从文本中提取视频链接"""
@@ -13,107 +43,505 @@ def extract_video_links(text: str) -> List[str]:
     links = re.findall(pattern, text)
     return [link for link in links if link.strip()]
 
-def download_videos_with_playwright(links_list: List[str], output_folder: str) -> str:
+def _reserve_save_path(output_folder: str, ext: str, seq: int = None) -> str:
+    """生成带时间戳的文件名，并发时自动追加序号避免互相覆盖；给出 seq 时写在文件名最前面"""
+    with _save_path_lock:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        prefix = f"{seq:04d}_" if seq is not None else ""
+        save_path = os.path.join(output_folder, f"{prefix}snapinsta_{timestamp}{ext}")
+        n = 1
+        while os.path.exists(save_path):
+            save_path = os.path.join(output_folder, f"{prefix}snapinsta_{timestamp}_{n}{ext}")
+            n += 1
+        # 先占位，其他任务就不会拿到同一个文件名
+        open(save_path, 'wb').close()
+        return save_path
+
+def _media_ext(button_text: str) -> str:
+    """根据按钮文本判断媒体类型"""
+    if "Download Video" in button_text:
+        return ".mp4"
+    if "Download Photo" in button_text:
+        return ".jpg"
+    return ".bin"  # 默认兜底
+
+class ThrottledError(Exception):
+    """SnapInsta 限流或服务出错（429 / 5xx、打不开页面），需要让整个主机冷却
+
+    帖子不存在、私密等单条链接的问题不算，不影响其他链接的请求节奏。
+    """
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def _throttle_status(response) -> bool:
+    return response.status == 429 or response.status >= 500
+
+def _retry_after(response) -> float:
+    """解析 Retry-After 头（只支持秒数形式）"""
     try:
-        # 确保输出目录存在
-        os.makedirs(output_folder, exist_ok=True)
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
 
-        with sync_playwright() as p:
-            # 初始化浏览器
-            headless_env = os.getenv("HEADLESS", "true").lower()
-            headless = headless_env in ["1", "true", "yes"]
+class StepTimings:
+    """记录下载流程中每个步骤的实际耗时"""
 
-            browser = p.chromium.launch(
-                headless=headless,
-                args=['--start-maximized']
-            )
-            context = browser.new_context(
-                accept_downloads=True,
-                viewport={'width': 1920, 'height': 1080}
+    def __init__(self):
+        self.samples = {}
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(name, []).append(time.monotonic() - start)
+
+    def summary(self) -> str:
+        """按步骤汇总平均值、p95 和最大值"""
+        lines = []
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            lines.append(
+                f"  {name}: 平均 {sum(values) / len(values):.2f}s / p95 {p95:.2f}s / "
+                f"最大 {ordered[-1]:.2f}s (n={len(values)})"
             )
-            page = context.new_page()
+        return "\n".join(lines)
+
+def _unique_links(links_list: List[str]) -> List[str]:
+    """按帖子短码（识别不出时按原链接）去重，保持原始顺序"""
+    seen = set()
+    unique = []
+    for video_url in links_list:
+        key = extract_shortcode(video_url) or video_url
+        if key not in seen:
+            seen.add(key)
+            unique.append(video_url)
+    return unique
+
+def _link_state(stats: dict, video_url: str, state: str, reason: str = None) -> None:
+    """通知调用方链接状态变化：resolving / downloading / done / failed"""
+    if state == "failed":
+        stats["failed_links"].append(video_url)
+    on_state = stats.get("on_state")
+    if on_state is not None:
+        try:
+            on_state(video_url, state, reason)
+        except Exception as e:
+            print(f"状态回调出错: {str(e)}")
+
+def _file_done(stats: dict, save_path: str) -> None:
+    """通知调用方一个媒体文件已经下载完成"""
+    on_file = stats.get("on_file")
+    if on_file is not None:
+        try:
+            on_file(save_path)
+        except Exception as e:
+            print(f"文件回调出错: {str(e)}")
+
+def _format_report(links_list: List[str], stats: dict) -> str:
+    """生成结果报告，失败链接按原始顺序输出"""
+    failed = set(stats["failed_links"])
+    failed_links = [link for link in links_list if link in failed]
+
+    result = f"下载完成！成功: {stats['success_count']}个媒体/{len(links_list)}条链接\n"
+    if stats["skipped_links"] or stats["skipped_items"]:
+        result += f"已下载过，跳过: {stats['skipped_links']}条链接，{stats['skipped_items']}个媒体\n"
+    if failed_links:
+        result += "失败的链接:\n" + "\n".join(failed_links) + "\n"
+    if stats["timings"].samples:
+        result += "步骤耗时:\n" + stats["timings"].summary()
+    return result
+
+async def _dismiss_modal(page) -> None:
+    """关闭可能出现的模态框（不存在时立即返回）"""
+    try:
+        modal = page.locator(MODAL_CLOSE_SELECTOR)
+        if await modal.is_visible():
+            await modal.click(timeout=STEP_TIMEOUTS["modal"])
+            await modal.wait_for(state="hidden", timeout=STEP_TIMEOUTS["modal"])
+    except Exception:
+        pass
+
+async def _wait_items_settled(page) -> int:
+    """等待下载项数量稳定下来（多图帖子的结果会陆续渲染），返回下载项数量"""
+    items = page.locator(RESULT_ITEMS_SELECTOR)
+    deadline = time.monotonic() + STEP_TIMEOUTS["settle"] / 1000
+    count = await items.count()
+    stable_polls = 0
+    while stable_polls < 2 and time.monotonic() < deadline:
+        await asyncio.sleep(SETTLE_POLL_INTERVAL)
+        new_count = await items.count()
+        stable_polls = stable_polls + 1 if new_count == count else 0
+        count = new_count
+    return count
+
+async def _form_ready(page) -> bool:
+    """页面是否已经停在未使用过的 SnapInsta 表单上"""
+    try:
+        if not page.url.startswith(SNAPINSTA_URL):
+            return False
+        form_input = page.locator("#s_input")
+        if not await form_input.is_visible() or await form_input.input_value():
+            return False
+        return await page.locator(RESULT_ITEMS_SELECTOR).count() == 0
+    except Exception:
+        return False
+
+async def _resolve_items(page, video_url: str, timings: StepTimings) -> list:
+    """在 SnapInsta 上解析一条链接，返回 [(下载按钮, 扩展名), ...]
+
+    每一步都等待页面上真正的元素就绪，而不是固定睡眠；各步骤耗时记录在 timings 中。
+    """
+    # 访问下载网站，输入框出现即可操作，不必等所有广告和统计脚本加载完
+    # 预热过的页面已经停在空白表单上，可以跳过这次导航
+    # 打不开表单页（超时、网络错误、429 / 5xx）说明主机在限流或出错
+    with timings.step("open_form"):
+        if not await _form_ready(page):
+            try:
+                response = await page.goto(SNAPINSTA_URL, wait_until='domcontentloaded', timeout=STEP_TIMEOUTS["open_form"])
+            except Exception as e:
+                raise ThrottledError(f"SnapInsta 页面打不开: {str(e)}")
+            if response is not None and _throttle_status(response):
+                raise ThrottledError(f"SnapInsta 请求过于频繁或出错 ({response.status})", _retry_after(response))
+            try:
+                await page.wait_for_selector("#s_input", state="visible", timeout=STEP_TIMEOUTS["open_form"])
+            except Exception:
+                raise ThrottledError("SnapInsta 页面没有加载完成")
+
+    # 记录提交后 SnapInsta 返回的 429 / 5xx，用来区分限流和链接本身的问题
+    throttled = []
+
+    def on_response(response) -> None:
+        if host_of(response.url) == host_of(SNAPINSTA_URL) and _throttle_status(response):
+            throttled.append(response)
+
+    page.on("response", on_response)
+    try:
+        # 输入视频URL并点击提交按钮
+        with timings.step("submit"):
+            await page.fill("#s_input", video_url, timeout=STEP_TIMEOUTS["submit"])
+            await page.locator("button:has-text('Download')").first.click(timeout=STEP_TIMEOUTS["submit"])
+
+        # 等待结果列表或模态框出现
+        with timings.step("results"):
+            try:
+                await page.wait_for_selector(
+                    f"{RESULT_ITEMS_SELECTOR}, {MODAL_CLOSE_SELECTOR}",
+                    state="visible",
+                    timeout=STEP_TIMEOUTS["results"]
+                )
+            except Exception:
+                if throttled:
+                    raise ThrottledError(f"SnapInsta 请求过于频繁或出错 ({throttled[-1].status})",
+                                         _retry_after(throttled[-1]))
+                raise Exception("下载项未找到")
+    finally:
+        page.remove_listener("response", on_response)
+
+    with timings.step("modal"):
+        await _dismiss_modal(page)
+
+    with timings.step("settle"):
+        try:
+            await page.wait_for_selector(RESULT_ITEMS_SELECTOR, state="attached", timeout=STEP_TIMEOUTS["results"])
+        except Exception:
+            raise Exception("下载项未找到")
+        await _wait_items_settled(page)
+
+    download_items = await page.query_selector_all(RESULT_ITEMS_SELECTOR)
+    if not download_items:
+        raise Exception("下载项未找到")
+
+    items = []
+    for item in download_items:
+        download_button = await item.query_selector(".download-items__btn > a")
+        if not download_button:
+            print("下载按钮未找到，跳过该项")
+            continue
 
-            success_count = 0
-            failed_links = []
+        # 获取按钮文本，用于判断类型
+        button_text = (await download_button.inner_text()).strip()
+        items.append((download_button, _media_ext(button_text)))
 
-            for video_url in links_list:
+    print(f"{video_url} 找到 {len(items)} 个下载项")
+    return items
+
+def _plan_downloads(manifest: DownloadManifest, seq: int, shortcode: str, items: list, output_folder: str,
+                    stats: dict) -> list:
+    """跳过清单中已有的媒体，为其余媒体分配保存路径，返回 [(序号, 下载按钮, 保存路径), ...]
+
+    seq 是链接在本批中的顺序号，写在文件名最前面，合并时按粘贴顺序排列。
+    """
+    plan = []
+    for item_index, (download_button, ext) in enumerate(items):
+        if shortcode is None:
+            # 无法识别短码的链接不进清单，沿用时间戳文件名
+            plan.append((item_index, download_button, _reserve_save_path(output_folder, ext, seq)))
+            continue
+
+        if manifest.has_item(shortcode, item_index):
+            stats["skipped_items"] += 1
+            continue
+
+        existing = manifest.find_media(shortcode, item_index, ext)
+        if existing is not None:
+            # 文件还在但清单里没有（例如清单被删除），直接登记
+            manifest.record_item(shortcode, item_index, existing, seq)
+            stats["skipped_items"] += 1
+            continue
+
+        plan.append((item_index, download_button, manifest.media_path(seq, shortcode, item_index, ext)))
+    return plan
+
+def _discard_placeholders(plan: list) -> None:
+    """删除下载失败后留下的空占位文件，避免之后被当成视频合并"""
+    for _, _, save_path in plan:
+        try:
+            if os.path.getsize(save_path) == 0:
+                os.remove(save_path)
+        except OSError:
+            pass
+
+async def _record_item(manifest: DownloadManifest, shortcode: str, item_index: int, save_path: str,
+                       seq: int = None) -> str:
+    """把下载完成的文件登记到清单（计算哈希放到线程里，避免阻塞事件循环），返回最终保存位置
+
+    内容和已有文件重复时新文件会被删除，返回的是已有文件的路径。
+    """
+    if shortcode is None:
+        return save_path
+    return await asyncio.to_thread(manifest.record_item, shortcode, item_index, save_path, seq)
+
+def _file_saved(stats: dict, save_path: str, kept_path: str) -> None:
+    """新文件被保留时才通知调用方；内容重复的文件已被删除，不再通知"""
+    if os.path.abspath(kept_path) == os.path.abspath(save_path):
+        _file_done(stats, save_path)
+
+async def _save_with_browser(page, plan: list, manifest: DownloadManifest, seq: int, shortcode: str,
+                             stats: dict) -> None:
+    """逐个点击下载按钮，通过浏览器的下载管理器保存
+
+    每保存一个就计入 success_count，中途出错时已经保存的文件同样计数。
+    """
+    for item_index, download_button, save_path in plan:
+        href = await download_button.get_attribute("href")
+        if href:
+            await get_rate_limiter().acquire_async(urljoin(page.url, href))
+
+        # 模态框可能在结果出现后才弹出，挡住点击
+        await _dismiss_modal(page)
+
+        # 设置下载处理
+        with stats["timings"].step("download"):
+            async with page.expect_download(timeout=STEP_TIMEOUTS["download"]) as download_info:
+                await download_button.click()
+
+            download = await download_info.value
+            print(f"正在下载到: {save_path}")
+            await download.save_as(save_path)
+        kept_path = await _record_item(manifest, shortcode, item_index, save_path, seq)
+        stats["success_count"] += 1
+        print("下载完成！")
+        _file_saved(stats, save_path, kept_path)
+
+async def _media_urls(page, plan: list) -> list:
+    """读取下载按钮的 href，返回 [(序号, 绝对地址, 保存路径), ...]"""
+    media = []
+    for item_index, download_button, save_path in plan:
+        href = await download_button.get_attribute("href")
+        if not href or href.startswith(("javascript:", "#")):
+            raise Exception("下载按钮没有可用的链接地址")
+        media.append((item_index, urljoin(page.url, href), save_path))
+    return media
+
+async def _fetch_link_media(fetcher: MediaFetcher, manifest: DownloadManifest, video_url: str, seq: int,
+                            shortcode: str, media: list, item_count: int, stats: dict) -> None:
+    """后台直接下载一条链接解析出的所有媒体，浏览器无需等待"""
+    async def fetch_one(item_index: int, url: str, save_path: str) -> None:
+        try:
+            print(f"正在下载到: {save_path}")
+            with stats["timings"].step("fetch"):
+                size = await fetcher.fetch(url, save_path)
+            kept_path = await _record_item(manifest, shortcode, item_index, save_path, seq)
+            print(f"下载完成！{save_path} ({size / 1024 / 1024:.1f} MB)")
+            _file_saved(stats, save_path, kept_path)
+        except Exception:
+            # 清理占位的空文件
+            if os.path.exists(save_path) and os.path.getsize(save_path) == 0:
+                os.remove(save_path)
+            raise
+
+    results = await asyncio.gather(*[fetch_one(*entry) for entry in media], return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    stats["success_count"] += len(results) - len(errors)
+    if errors:
+        print(f"下载失败 {video_url}: {str(errors[0])}")
+        _link_state(stats, video_url, "failed", str(errors[0]))
+        return
+
+    if shortcode is not None:
+        manifest.mark_link_done(shortcode, video_url, item_count, seq)
+    _link_state(stats, video_url, "done")
+
+async def _page_worker(pool: ContextPool, link_queue: asyncio.Queue, manifest: DownloadManifest,
+                       output_folder: str, stats: dict, fetcher: MediaFetcher = None) -> None:
+    """工作协程：从上下文池领取一个上下文，不断从队列取链接下载
+
+    提供 fetcher 时浏览器只负责解析地址，文件交给后台任务直接下载，
+    页面随即处理下一条链接。页面崩溃时把上下文还给池子回收，换一个新的继续。
+    清单中已完整下载的链接直接跳过，不占用浏览器。
+    """
+    limiter = get_rate_limiter()
+    context = await pool.acquire()
+    try:
+        while True:
+            try:
+                seq, video_url = link_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+
+            shortcode = extract_shortcode(video_url)
+            if shortcode is not None and manifest.link_done(shortcode):
+                print(f"已下载过，跳过: {video_url}")
+                stats["skipped_links"] += 1
+                _link_state(stats, video_url, "done")
+                continue
+
+            _link_state(stats, video_url, "resolving")
+            plan = []
+            try:
+                if not context.pages or context.pages[0].is_closed():
+                    await pool.release(context)
+                    context = None
+                    context = await pool.acquire()
+                page = context.pages[0]
+                # 限速器统一控制对 SnapInsta 的请求节奏
+                with stats["timings"].step("throttle"):
+                    await limiter.acquire_async(SNAPINSTA_URL)
+                # 只有限流和服务出错才让主机冷却；帖子不存在等单条链接的失败不影响冷却计数
                 try:
-                    # 访问下载网站
-                    page.goto("https://snapinsta.to/", wait_until='networkidle')
-                    time.sleep(2)
+                    items = await _resolve_items(page, video_url, stats["timings"])
+                except ThrottledError as e:
+                    limiter.penalize(SNAPINSTA_URL, e.retry_after)
+                    raise
+                limiter.reward(SNAPINSTA_URL)
+                plan = _plan_downloads(manifest, seq, shortcode, items, output_folder, stats)
+                _link_state(stats, video_url, "downloading")
+                if fetcher is not None:
+                    media = await _media_urls(page, plan)
+                    stats["fetch_tasks"].append(asyncio.create_task(
+                        _fetch_link_media(fetcher, manifest, video_url, seq, shortcode, media, len(items), stats)
+                    ))
+                else:
+                    await _save_with_browser(page, plan, manifest, seq, shortcode, stats)
+                    if shortcode is not None:
+                        manifest.mark_link_done(shortcode, video_url, len(items), seq)
+                    _link_state(stats, video_url, "done")
+            except Exception as e:
+                print(f"下载失败 {video_url}: {str(e)}")
+                _discard_placeholders(plan)
+                _link_state(stats, video_url, "failed", str(e))
+                if context is None:
+                    # 连新的上下文都拿不到，交给其他协程处理剩下的链接
+                    raise
+    finally:
+        if context is not None:
+            await pool.release(context)
+
+async def _run_workers(pool: ContextPool, links_list: List[str], manifest: DownloadManifest, output_folder: str,
+                       concurrency: int, stats: dict, fetcher: MediaFetcher = None, first_seq: int = 1) -> None:
+    """启动 concurrency 个工作协程处理全部链接，第 i 条链接的文件名序号为 first_seq + i"""
+    link_queue = asyncio.Queue()
+    for i, video_url in enumerate(_unique_links(links_list)):
+        link_queue.put_nowait((first_seq + i, video_url))
+
+    results = await asyncio.gather(*[
+        _page_worker(pool, link_queue, manifest, output_folder, stats, fetcher)
+        for _ in range(concurrency)
+    ], return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"下载协程出错: {str(result)}")
+
+    # 所有协程都异常退出时，剩下的链接记为失败
+    while not link_queue.empty():
+        _link_state(stats, link_queue.get_nowait()[1], "failed", "没有可用的浏览器页面")
+
+async def download_videos_async(links_list: List[str], output_folder: str, concurrency: int = 4,
+                                fetch_mode: str = "browser", service=None, on_state=None, on_file=None) -> str:
+    """异步下载引擎
+
+    在同一个 Chromium 实例中开启 concurrency 个上下文，
+    由一个事件循环驱动，各自从 asyncio 队列中领取链接。
 
-                    # 输入视频URL
-                    page.fill("#s_input", video_url)
-                    time.sleep(0.2)
+    fetch_mode:
+        "browser" 点击按钮由 Chromium 下载后 save_as
+        "http"    只用浏览器解析地址，用共享连接池直接下载到目标文件
 
-                    # 点击提交按钮
-                    download_button = page.locator("button:has-text('Download')")
-                    download_button.click()
-                    time.sleep(10)
+    传入 service（BrowserService）时使用其常驻浏览器和预热上下文，
+    此时必须通过 service.run() 在服务的事件循环中执行。
 
-                    # 关闭可能出现的模态框
+    on_state(链接, 状态, 原因) 在每条链接进入 resolving / downloading / done / failed 时调用。
+    on_file(文件路径) 在每个媒体文件下载完成时调用（在下载的事件循环中执行，不能阻塞）。
+    """
+    try:
+        # 确保输出目录存在
+        os.makedirs(output_folder, exist_ok=True)
+        concurrency = max(1, min(int(concurrency), len(links_list) or 1))
+
+        stats = {
+            "success_count": 0,
+            "failed_links": [],
+            "skipped_links": 0,
+            "skipped_items": 0,
+            "timings": StepTimings(),
+            "fetch_tasks": [],
+            "on_state": on_state,
+            "on_file": on_file,
+        }
+        manifest = DownloadManifest(output_folder)
+        # 按粘贴顺序给链接编号，浏览器重启后重试也沿用同一组序号
+        first_seq = manifest.reserve_sequence(len(_unique_links(links_list)))
+        fetcher = MediaFetcher(referer=SNAPINSTA_URL) if fetch_mode == "http" else None
+
+        try:
+            if service is not None:
+                pool = await service.ensure_browser()
+                await _run_workers(pool, links_list, manifest, output_folder, concurrency, stats, fetcher, first_seq)
+            else:
+                async with async_playwright() as p:
+                    # 初始化浏览器
+                    browser = await launch_browser(p)
                     try:
-                        modal = page.query_selector("#closeModalBtn")
-                        if modal:
-                            modal.click()
-                    except:
-                        pass
-
-                    # 等待所有下载项出现
-                    download_items = page.query_selector_all("ul.download-box > li > div.download-items")
-
-                    if not download_items:
-                        raise Exception("下载项未找到")
-
-                    for item in download_items:
-                        download_button = item.query_selector(".download-items__btn > a")
-                        if not download_button:
-                            print("下载按钮未找到，跳过该项")
-                            continue
-
-                        # 获取按钮文本，用于判断类型
-                        button_text = download_button.inner_text().strip()
-                        if "Download Video" in button_text:
-                            ext = ".mp4"
-                        elif "Download Photo" in button_text:
-                            ext = ".jpg"
-                        else:
-                            ext = ".bin"  # 默认兜底
-
-                        # 生成带时间戳的文件名
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = f"snapinsta_{timestamp}{ext}"
-                        save_path = os.path.join(output_folder, filename)
-
-                        # 设置下载处理
-                        with page.expect_download(timeout=60000) as download_info:
-                            download_button.click()
-
-                        download = download_info.value
-                        print(f"正在下载到: {save_path}")
-                        download.save_as(save_path)
-                        print("下载完成！")
-
-                        success_count += 1
-
-                        # 每次下载后添加随机延迟
-                        time.sleep(random.uniform(1, 3))
-
-                except Exception as e:
-                    print(f"下载失败 {video_url}: {str(e)}")
-                    failed_links.append(video_url)
-                    continue
-
-            # 最后才关闭浏览器
-            context.close()
-            browser.close()
-
-            # 生成结果报告
-            result = f"下载完成！成功: {success_count}个媒体/{len(links_list)}条链接\n"
-            if failed_links:
-                result += "失败的链接:\n" + "\n".join(failed_links)
-
-            return result
+                        pool = ContextPool(browser, max_size=concurrency, request_filter=RequestFilter.from_env())
+                        await _run_workers(pool, links_list, manifest, output_folder, concurrency, stats, fetcher, first_seq)
+                        await pool.close()
+                    finally:
+                        # 最后才关闭浏览器
+                        await browser.close()
+
+            # 浏览器已经解析完所有链接，等待后台下载结束
+            if stats["fetch_tasks"]:
+                await asyncio.gather(*stats["fetch_tasks"])
+        finally:
+            if fetcher is not None:
+                await fetcher.aclose()
+            manifest.close()
+
+        return _format_report(links_list, stats)
 
     except Exception as e:
         return f"启动浏览器出错: {str(e)}"
+
+def download_videos_with_playwright(links_list: List[str], output_folder: str, concurrency: int = 1,
+                                    fetch_mode: str = "browser") -> str:
+    """使用 SnapInsta 批量下载（同步入口）
+
+    在当前线程中运行异步下载引擎，concurrency 为同时工作的页面数量。
+    """
+    return asyncio.run(download_videos_async(links_list, output_folder, concurrency=concurrency,
+                                             fetch_mode=fetch_mode))
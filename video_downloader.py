@@ -3,17 +3,12 @@ from datetime import datetime
 import yt_dlp
 import os
 import csv
-import time
 import random
 import shutil
 import json
 from fake_useragent import UserAgent
 import browser_cookie3
-
-def get_random_delay():
-    """生成随机延迟时间"""
-    # 生成2-5秒的随机延迟
-    return random.uniform(2, 5)
+from rate_limiter import get_rate_limiter
 
 def get_random_user_agent():
     """获取随机User-Agent"""
@@ -103,25 +98,32 @@ def download_videos(links, output_path='downloads'):
         }
     }
 
+    # 请求节奏由共享的限速器控制
+    limiter = get_rate_limiter()
+
     for i, link in enumerate(links, 1):
         try:
+            waited = limiter.acquire(link)
+            if waited > 0:
+                print(f"限速等待 {waited:.1f} 秒")
             print(f"\n[{i}/{len(links)}] 正在下载: {link}")
             
             # 每次下载前更新User-Agent
             ydl_opts['http_headers']['User-Agent'] = get_random_user_agent()
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([link])
-            
-            # 模拟真实用户行为的随机延迟
-            delay = get_random_delay()
-            print(f"等待 {delay:.1f} 秒后继续...")
-            time.sleep(delay)
+                retcode = ydl.download([link])
+
+            # ignoreerrors 模式下失败不会抛异常，只能看返回码
+            if retcode:
+                limiter.penalize(link)
+            else:
+                limiter.reward(link)
             
         except Exception as e:
             print(f"下载失败: {str(e)}")
-            # 发生错误时增加额外延迟
-            time.sleep(random.uniform(5, 8))
+            # 出错后该主机进入冷却期，下一次 acquire 会自动等待
+            limiter.penalize(link)
             continue
 
 if __name__ == "__main__":
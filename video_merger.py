@@ -1,4 +1,5 @@
 from moviepy.editor import VideoFileClip, concatenate_videoclips, ImageClip, AudioFileClip
+from moviepy.audio.AudioClip import AudioArrayClip
 from PIL import Image, ImageDraw, ImageFont
 from PIL.Image import Resampling
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
@@ -13,9 +14,12 @@ import logging
 import sys
 import platform
 import subprocess
+import tempfile
 from contextlib import contextmanager
+from functools import lru_cache
 import traceback
 import warnings
+import merge_trace
 
 # 禁用所有警告
 warnings.filterwarnings('ignore')
@@ -76,6 +80,79 @@ COLOR_SCHEMES = {
     }
 }
 
+# 每个视频末尾裁掉的时长（秒），避免末尾帧的问题
+TAIL_TRIM = 0.1
+
+# 过渡画面和最终画面的时长（秒）
+TRANSITION_DURATION = 0.5
+FINAL_DURATION = 2.0
+
+# 音效只使用开头一段（秒）
+DING_MAX = 0.5
+END_MAX = 1.0
+
+# 解码音效使用的采样率
+SOUND_FPS = 44100
+
+# 流式合并时每批同时打开的视频数
+STREAM_CHUNK_SIZE = 8
+
+# ffmpeg 方式失败时改用 moviepy 的方式；concat / parallel 失败时直接报错，方便定位问题
+MOVIEPY_FALLBACK_ENGINES = ('auto', 'filtergraph')
+
+# 编码配置：draft 用于快速检查顺序和过渡画面，final 为默认的成品，archive 用于存档
+ENCODING_PROFILES = {
+    'draft': {
+        'name': '草稿（540p 快速预览）',
+        'size': (540, 960),
+        'fps': 30,
+        'preset': 'ultrafast',
+        'crf': 32,
+        'threads': 0,  # 0 表示由编码器自动决定
+        'audio_bitrate': '64k',
+    },
+    'final': {
+        'name': '成品（720p）',
+        'size': (720, 1280),
+        'fps': 30,
+        'preset': 'medium',
+        'crf': 23,
+        'threads': 0,
+        'audio_bitrate': '128k',
+    },
+    'archive': {
+        'name': '存档（720p 高质量）',
+        'size': (720, 1280),
+        'fps': 30,
+        'preset': 'slow',
+        'crf': 18,
+        'threads': 0,
+        'audio_bitrate': '192k',
+    },
+}
+
+DEFAULT_PROFILE = 'final'
+
+def write_params(profile=DEFAULT_PROFILE):
+    """moviepy write_videofile 使用的参数"""
+    config = ENCODING_PROFILES[profile]
+    return {
+        'codec': 'libx264',
+        'audio_codec': 'aac',
+        'audio_fps': SOUND_FPS,
+        'audio_bitrate': config['audio_bitrate'],
+        'fps': config['fps'],
+        'preset': config['preset'],
+        'threads': config['threads'] or None,
+        'ffmpeg_params': [
+            '-strict', '-2',
+            '-crf', str(config['crf']),
+            '-profile:v', 'high',
+            '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart'
+        ],
+    }
+
 @contextmanager
 def managed_resource(resource, resource_type="resource"):
     """资源管理器，确保资源被正确释放"""
@@ -99,8 +176,9 @@ def managed_resource(resource, resource_type="resource"):
             except Exception as e:
                 logging.debug(f"Error closing {resource_type}: {str(e)}")
 
+@lru_cache(maxsize=None)
 def load_system_font(font_size):
-    """跨平台字体加载函数"""
+    """跨平台字体加载函数（同一字号只加载一次）"""
     system = platform.system()
     
     # Windows字体路径
@@ -132,131 +210,163 @@ def load_system_font(font_size):
     logging.warning("未找到系统字体，使用默认字体")
     return ImageFont.load_default()
 
-def create_number_transition(number, duration=1.0, size=(720, 1280), is_final=False, video_count=None, title_text="今日份快乐", author_name="", color_scheme='p6'):
-    """创建带数字的过渡画面（跨平台版）"""
-    try:
-        scheme = COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES['p6'])
-        bg_color = scheme['background']
-        text_color = scheme['text']
+def render_transition_image(number, size=(720, 1280), is_final=False, title_text="今日份快乐", author_name="", color_scheme='p6', date_text=None):
+    """绘制过渡画面图片（不含音效），返回 PIL 图片
 
-        width, height = size
-        background = Image.new('RGB', (width, height), bg_color)
-        draw = ImageDraw.Draw(background)
+    布局按 720x1280 设计，其他尺寸（例如 1080x1920、1080x1080）按 min(宽/720, 高/1280) 等比缩放字号、线宽和间距。
+    """
+    scheme = COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES['p6'])
+    bg_color = scheme['background']
+    text_color = scheme['text']
 
-        if not is_final:
-            # 主字体加载
-            font = load_system_font(80)
-            
-            # 动态计算布局
-            text = str(number)
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            ascent, descent = font.getmetrics()
-
-            # 平台垂直位置补偿
-            vertical_offset = 30 if platform.system() == "Darwin" else 0
-            circle_radius = max(text_width, text_height) * 0.8
-            circle_x = width // 2
-            circle_y = height // 2 + vertical_offset
-
-            # 绘制圆形
-            draw.ellipse(
-                [circle_x - circle_radius, circle_y - circle_radius,
-                 circle_x + circle_radius, circle_y + circle_radius],
-                outline=text_color,
-                width=5
-            )
+    width, height = size
+    scale = min(width / 720, height / 1280)
 
-            # 文字位置计算
-            text_offset = (ascent - descent) // 2
-            text_x = circle_x - text_width // 2
-            text_y = circle_y - text_height // 2 - text_offset + (15 if platform.system() == "Darwin" else 0)
-
-            draw.text((text_x, text_y), text, font=font, fill=text_color)
-
-            # 作者信息
-            if number == 1 and author_name:
-                author_font = load_system_font(40)
-                author_text = f"@{author_name}"
-                author_bbox = draw.textbbox((0, 0), author_text, font=author_font)
-                author_x = (width - (author_bbox[2] - author_bbox[0])) // 2
-                author_y = circle_y + circle_radius + (340 if platform.system() == "Darwin" else 320)
-                draw.text((author_x, author_y), author_text, font=author_font, fill=text_color)
-
-            # 标题框
-            if number == 1:
-                title_font = load_system_font(60)
-                today = datetime.now().strftime("%m-%d")
-
-                # 动态计算标题框尺寸
-                title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
-                date_bbox = draw.textbbox((0, 0), today, font=title_font)
-                
-                padding = 20
-                box_width = max(title_bbox[2], date_bbox[2]) + padding*2
-                box_height = (title_bbox[3] + date_bbox[3] + padding*3)
-                
-                # 平台垂直偏移
-                box_y_offset = -300 if platform.system() == "Darwin" else -320
-                box_y = circle_y - circle_radius + box_y_offset
-
-                # 绘制标题框
-                draw.rectangle(
-                    [(width//2 - box_width//2, box_y),
-                     (width//2 + box_width//2, box_y + box_height)],
-                    outline=text_color,
-                    width=3
-                )
+    def px(value):
+        return max(1, round(value * scale))
 
-                # 绘制文字
-                date_x = (width - date_bbox[2]) // 2
-                date_y = box_y + padding
-                draw.text((date_x, date_y), today, font=title_font, fill=text_color)
+    background = Image.new('RGB', (width, height), bg_color)
+    draw = ImageDraw.Draw(background)
 
-                title_x = (width - title_bbox[2]) // 2
-                title_y = date_y + title_bbox[3] + padding
-                draw.text((title_x, title_y), title_text, font=title_font, fill=text_color)
+    if not is_final:
+        # 主字体加载
+        font = load_system_font(px(80))
+        
+        # 动态计算布局
+        text = str(number)
+        bbox = draw.textbbox((0, 0), text, font=font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+        ascent, descent = font.getmetrics()
+
+        # 平台垂直位置补偿
+        vertical_offset = px(30) if platform.system() == "Darwin" else 0
+        circle_radius = max(text_width, text_height) * 0.8
+        circle_x = width // 2
+        circle_y = height // 2 + vertical_offset
+
+        # 绘制圆形
+        draw.ellipse(
+            [circle_x - circle_radius, circle_y - circle_radius,
+             circle_x + circle_radius, circle_y + circle_radius],
+            outline=text_color,
+            width=px(5)
+        )
 
-        else:
-            # 最终画面
-            font = load_system_font(80)
-            texts = ["★ 点赞支持 ★", "☆ 关注收藏 ☆", "◆ 转发分享 ◆"]
+        # 文字位置计算
+        text_offset = (ascent - descent) // 2
+        text_x = circle_x - text_width // 2
+        text_y = circle_y - text_height // 2 - text_offset + (px(15) if platform.system() == "Darwin" else 0)
+
+        draw.text((text_x, text_y), text, font=font, fill=text_color)
+
+        # 作者信息
+        if number == 1 and author_name:
+            author_font = load_system_font(px(40))
+            author_text = f"@{author_name}"
+            author_bbox = draw.textbbox((0, 0), author_text, font=author_font)
+            author_x = (width - (author_bbox[2] - author_bbox[0])) // 2
+            author_y = circle_y + circle_radius + px(340 if platform.system() == "Darwin" else 320)
+            draw.text((author_x, author_y), author_text, font=author_font, fill=text_color)
+
+        # 标题框
+        if number == 1:
+            title_font = load_system_font(px(60))
+            today = date_text or datetime.now().strftime("%m-%d")
+
+            # 动态计算标题框尺寸
+            title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
+            date_bbox = draw.textbbox((0, 0), today, font=title_font)
             
-            total_height = sum(draw.textbbox((0,0), t, font=font)[3] for t in texts)
-            start_y = (height - total_height - 100) // 2  # 100为总行间距
+            padding = px(20)
+            box_width = max(title_bbox[2], date_bbox[2]) + padding*2
+            box_height = (title_bbox[3] + date_bbox[3] + padding*3)
             
-            for text in texts:
-                bbox = draw.textbbox((0,0), text, font=font)
-                text_x = (width - bbox[2]) // 2
-                draw.text((text_x, start_y), text, fill=text_color, font=font)
-                start_y += bbox[3] + 50
-
-        image_path = f'transition_{number}.png'
-        background.save(image_path)
+            # 平台垂直偏移
+            box_y_offset = -px(300 if platform.system() == "Darwin" else 320)
+            box_y = circle_y - circle_radius + box_y_offset
+
+            # 绘制标题框
+            draw.rectangle(
+                [(width//2 - box_width//2, box_y),
+                 (width//2 + box_width//2, box_y + box_height)],
+                outline=text_color,
+                width=px(3)
+            )
+
+            # 绘制文字
+            date_x = (width - date_bbox[2]) // 2
+            date_y = box_y + padding
+            draw.text((date_x, date_y), today, font=title_font, fill=text_color)
+
+            title_x = (width - title_bbox[2]) // 2
+            title_y = date_y + title_bbox[3] + padding
+            draw.text((title_x, title_y), title_text, font=title_font, fill=text_color)
+
+    else:
+        # 最终画面
+        font = load_system_font(px(80))
+        texts = ["★ 点赞支持 ★", "☆ 关注收藏 ☆", "◆ 转发分享 ◆"]
         
-        # 修改音效处理逻辑
-        clip = ImageClip(image_path).set_duration(duration)
-        try:
-            if not is_final:
-                # 普通过渡画面使用 ding 音效
-                audio = AudioFileClip("ding.wav")
-                # 只使用音效的前0.5秒
-                audio = audio.subclip(0, min(0.5, audio.duration))
-                # 将音效设置在画面开始时播放
-                audio = audio.set_start(0)
-                clip = clip.set_audio(audio)
-            else:
-                # 最终画面使用不同的音效
-                try:
-                    audio = AudioFileClip("end.wav")
-                    audio = audio.subclip(0, min(1.0, audio.duration))
-                    audio = audio.set_start(0)
-                    clip = clip.set_audio(audio)
-                except:
-                    pass
-        except:
-            logging.warning("未找到音效文件")
+        total_height = sum(draw.textbbox((0,0), t, font=font)[3] for t in texts)
+        start_y = (height - total_height - px(100)) // 2  # 100为总行间距
+        
+        for text in texts:
+            bbox = draw.textbbox((0,0), text, font=font)
+            text_x = (width - bbox[2]) // 2
+            draw.text((text_x, start_y), text, fill=text_color, font=font)
+            start_y += bbox[3] + px(50)
+
+    return background
+
+@lru_cache(maxsize=256)
+def _transition_frame(number, size, is_final, title_text, author_name, color_scheme, date_text):
+    frame = np.array(render_transition_image(number, size, is_final, title_text, author_name, color_scheme, date_text))
+    # 缓存的画面被多个片段共用，设为只读防止被修改
+    frame.setflags(write=False)
+    return frame
+
+def transition_frame(number, size=(720, 1280), is_final=False, title_text="今日份快乐", author_name="", color_scheme='p6'):
+    """返回过渡画面的 RGB 数组，相同参数（编号、配色、尺寸、标题、作者、日期）只绘制一次"""
+    if is_final:
+        # 最终画面和编号、标题无关
+        number, title_text, author_name, date_text = 0, None, None, None
+    elif number == 1:
+        date_text = datetime.now().strftime("%m-%d")
+    else:
+        title_text, author_name, date_text = None, None, None
+    return _transition_frame(number, tuple(size), is_final, title_text, author_name, color_scheme, date_text)
+
+def sound_path(name):
+    """查找音效文件：先找当前目录，再找本模块所在目录，找不到返回 None"""
+    for folder in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+@lru_cache(maxsize=None)
+def load_sound(name, max_duration):
+    """解码音效文件开头 max_duration 秒，返回采样数组；所有过渡画面共用同一份数据"""
+    path = sound_path(name)
+    if path is None:
+        logging.warning(f"未找到音效文件: {name}")
+        return None
+    with managed_resource(AudioFileClip(path, fps=SOUND_FPS), name) as audio:
+        samples = audio.subclip(0, min(max_duration, audio.duration)).to_soundarray(fps=SOUND_FPS)
+    samples.setflags(write=False)
+    return samples
+
+def create_number_transition(number, duration=1.0, size=(720, 1280), is_final=False, video_count=None, title_text="今日份快乐", author_name="", color_scheme='p6'):
+    """创建带数字的过渡画面（跨平台版）"""
+    try:
+        frame = transition_frame(number, size, is_final, title_text, author_name, color_scheme)
+        clip = ImageClip(frame).set_duration(duration)
+
+        # 普通过渡画面使用 ding 音效，最终画面使用 end 音效，从画面开始时播放
+        samples = load_sound("end.wav", END_MAX) if is_final else load_sound("ding.wav", DING_MAX)
+        if samples is not None:
+            clip = clip.set_audio(AudioArrayClip(samples, fps=SOUND_FPS).set_start(0))
         
         return clip
 
@@ -265,22 +375,94 @@ def create_number_transition(number, duration=1.0, size=(720, 1280), is_final=Fa
         return None
 
 
-def resize_to_target(clip, target_size=(720, 1280)):
-    """智能调整视频尺寸，保持宽高比并添加黑边"""
+def normalize_clips(clips):
+    """把要合并的视频列表统一成 [{'path': 绝对路径, 'start': 秒或 None, 'end': 秒或 None}]
+
+    每一项可以是路径字符串、(路径, 起点, 终点) 元组，或带 path / start / end 的字典。
+    """
+    normalized = []
+    for clip in clips:
+        if isinstance(clip, dict):
+            path, start, end = clip['path'], clip.get('start'), clip.get('end')
+        elif isinstance(clip, (tuple, list)):
+            path, start, end = (tuple(clip) + (None, None))[:3]
+        else:
+            path, start, end = clip, None, None
+        if start is not None and end is not None and end <= start:
+            raise ValueError(f"裁剪点无效 {path}: {start} - {end}")
+        normalized.append({
+            'path': os.path.abspath(path),
+            'start': float(start) if start is not None else None,
+            'end': float(end) if end is not None else None,
+        })
+    return normalized
+
+def normalize_targets(targets, profile=DEFAULT_PROFILE):
+    """整理输出目标列表
+
+    每一项可以是：
+        输出路径                                     使用 profile 的编码配置和分辨率
+        {'path': 路径, 'profile': 配置, 'size': (宽, 高)}  profile、size 可省略，size 默认使用配置的分辨率
+    返回 [{'path': 绝对路径, 'profile': 配置, 'size': (宽, 高)}, ...]
+    """
+    normalized = []
+    for target in targets:
+        if isinstance(target, dict):
+            path, target_profile, size = target['path'], target.get('profile') or profile, target.get('size')
+        else:
+            path, target_profile, size = target, profile, None
+        if target_profile not in ENCODING_PROFILES:
+            raise ValueError(f"未知的编码配置: {target_profile}")
+        width, height = size or ENCODING_PROFILES[target_profile]['size']
+        if width <= 0 or height <= 0 or width % 2 or height % 2:
+            raise ValueError(f"输出尺寸必须是正偶数: {width}x{height}")
+        normalized.append({'path': os.path.abspath(path), 'profile': target_profile, 'size': (int(width), int(height))})
+    return normalized
+
+def is_video_file(path):
+    """文件夹合并时会被选中的视频：.mp4 / .mov，排除合并结果和临时文件"""
+    name = os.path.basename(path)
+    return name.lower().endswith(('.mp4', '.mov')) and not name.startswith(('merged-', 'temp_'))
+
+def list_video_files(folder, exclude=None):
+    """按文件名排序返回文件夹中要合并的视频路径，exclude 为要排除的文件或文件列表（例如输出文件本身）"""
+    if isinstance(exclude, str):
+        exclude = [exclude]
+    excluded = {os.path.abspath(path) for path in exclude or []}
+    paths = [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if is_video_file(f)]
+    return [path for path in paths if os.path.abspath(path) not in excluded]
+
+def estimate_merged_duration(durations):
+    """根据各视频的时长估算合并后的总时长（秒），包括过渡画面、最终画面和末尾裁剪"""
+    clips = sum(d - TAIL_TRIM if d > 1 else d for d in durations)
+    return clips + TRANSITION_DURATION * len(durations) + FINAL_DURATION
+
+def resize_to_target(clip, target_size=(720, 1280), start=None, end=None):
+    """智能调整视频尺寸，保持宽高比并添加黑边；start / end 为可选的裁剪点（秒）"""
     target_width, target_height = target_size
     
-    # 处理视频时间，略微缩短以避免末尾帧的问题
-    safe_duration = clip.duration - 0.1 if clip.duration > 1 else clip.duration
-    clip = clip.subclip(0, safe_duration)
+    # 处理视频时间，没有指定终点时略微缩短以避免末尾帧的问题
+    if end is not None:
+        safe_duration = min(end, clip.duration)
+    else:
+        safe_duration = clip.duration - TAIL_TRIM if clip.duration > 1 else clip.duration
+    clip = clip.subclip(min(start or 0, safe_duration), safe_duration)
     
     # 如果尺寸已经符合要求，直接返回
-    if clip.size == target_size:
+    if tuple(clip.size) == tuple(target_size):
         return clip
         
     # 计算缩放比例，保持宽高比
     scale_ratio = min(target_width / clip.w, target_height / clip.h)
-    new_width = int(clip.w * scale_ratio)
-    new_height = int(clip.h * scale_ratio)
+    new_width = int(clip.w * scale_ratio) // 2 * 2
+    new_height = int(clip.h * scale_ratio) // 2 * 2
+
+    # 按比例缩放（moviepy 自带的 resize 依赖已被 Pillow 10 移除的 ANTIALIAS，这里直接用 PIL 缩放每一帧）
+    audio = clip.audio
+    clip = clip.fl_image(
+        lambda frame: np.array(Image.fromarray(frame).resize((new_width, new_height), Resampling.LANCZOS))
+    )
+    clip.size = (new_width, new_height)
     
     # 创建黑色背景
     background = ColorClip(
@@ -290,8 +472,8 @@ def resize_to_target(clip, target_size=(720, 1280)):
     )
     
     # 计算居中位置
-    x_center = (target_width - clip.w) // 2
-    y_center = (target_height - clip.h) // 2
+    x_center = (target_width - new_width) // 2
+    y_center = (target_height - new_height) // 2
     
     # 合成视频，确保音频正确处理
     final_clip = CompositeVideoClip(
@@ -300,67 +482,251 @@ def resize_to_target(clip, target_size=(720, 1280)):
     ).set_duration(clip.duration)
     
     # 确保音频正确复制
-    if clip.audio is not None:
-        final_clip = final_clip.set_audio(clip.audio)
+    if audio is not None:
+        final_clip = final_clip.set_audio(audio)
     
     return final_clip
 
-def merge_videos(input_dir=None, output_path=None, title="今日份快乐", author="", color_scheme='p6'):
-    """合并视频文件，添加过渡画面"""
-    clips = []  # 存储所有视频片段
-    temp_files = []  # 存储所有临时文件路径
-    temp_dir = None
-    
+def merge_videos(input_dir=None, output_path=None, title="今日份快乐", author="", color_scheme='p6', engine='auto', workers=None, chunk_size=STREAM_CHUNK_SIZE, incremental=False, profile=DEFAULT_PROFILE, clips=None, targets=None, trace=False, profiler=None, progress=None):
+    """合并视频文件，添加过渡画面
+
+    clips 为按顺序排列的视频列表（格式见 normalize_clips，可以带裁剪点），
+    不传时合并 input_dir 中的全部视频（按文件名排序）。
+
+    engine 选择合并方式：
+        'auto'        装有 ffmpeg/ffprobe 时依次尝试 concat、parallel，都失败再用 moviepy（视频较多时用 stream）
+        'concat'      concat 快速路径（格式一致的视频直接复制流，不重新编码）
+        'filtergraph' 整条时间线编译成一个 ffmpeg filter_complex，一次渲染完成，失败时改用 moviepy
+        'parallel'    每个视频连同过渡画面在进程池中各自编码成片段，再无损拼接
+        'moviepy'     用 moviepy 逐帧合成并整体重新编码
+        'stream'      moviepy 流式合并，每次只打开 chunk_size 个视频，内存占用不随视频数增长
+    workers 为 parallel 方式的进程数，默认等于 CPU 核数。
+    progress(完成数, 总数, 名称) 在 concat / parallel 方式每完成一个视频或片段时调用。
+    profile 为 ENCODING_PROFILES 中的编码配置（draft / final / archive），决定分辨率、速度和质量。
+    incremental 为 True 时（concat / parallel 方式），编码过的片段和记录保存在输出文件旁边
+    （<输出>.segments/ 和 <输出>.merge.json），再次合并同一个输出时只编码新增或修改过的视频。
+    targets 为多个输出目标（格式见 normalize_targets，例如 720x1280、1080x1920 和 1080x1080 各一份）时忽略 output_path：
+    auto / filtergraph 方式用一次 ffmpeg 调用解码所有视频并同时编码全部输出，其他方式逐个输出合并。
+
+    每次合并都会记录各阶段（扫描、过渡画面、打开视频、缩放合成、拼接、编码、清理）的耗时，
+    结束时输出汇总；trace 为 True 时另外保存 Chrome trace-event 文件 <输出>.trace.json，
+    可以用 chrome://tracing 或 Perfetto 查看。profiler='cprofile' 时用 cProfile 分析整个合并过程，
+    结果保存为 <输出>.prof（可以用 snakeviz 或 python -m pstats 查看）。
+    """
+    if profiler not in (None, 'cprofile'):
+        logging.error(f"未知的性能分析器: {profiler}")
+        return False
+
+    with merge_trace.tracing() as tracer:
+        prof = None
+        if profiler == 'cprofile':
+            import cProfile
+            prof = cProfile.Profile()
+            prof.enable()
+        try:
+            with tracer.span('merge', engine=engine, profile=profile):
+                return _merge_videos(input_dir, output_path, title, author, color_scheme, engine,
+                                     workers, chunk_size, incremental, profile, clips, targets,
+                                     progress=progress)
+        finally:
+            if prof:
+                prof.disable()
+            _finish_trace(tracer, trace, prof)
+
+def _finish_trace(tracer, export=False, prof=None):
+    """输出各阶段耗时汇总，按需保存 trace 和 cProfile 结果到输出文件旁边"""
+    logging.info("\n" + tracer.summary())
+    if not tracer.output_path:
+        return
     try:
-        # 1. 输入准备阶段
-        input_dir = os.path.abspath(input_dir if input_dir else "./11-23")
-        if not os.path.exists(input_dir):
-            logging.error(f"输入目录不存在: {input_dir}")
+        if export:
+            trace_path = tracer.output_path + '.trace.json'
+            tracer.export(trace_path)
+            logging.info(f"trace 已保存到 {trace_path}")
+        if prof:
+            prof_path = tracer.output_path + '.prof'
+            prof.dump_stats(prof_path)
+            logging.info(f"性能分析结果已保存到 {prof_path}")
+    except OSError as e:
+        logging.warning(f"保存 trace 失败: {str(e)}")
+
+def _merge_targets(sources, targets, title, author, color_scheme, engine, workers, chunk_size, incremental, progress=None):
+    """同一组视频输出多个目标
+
+    auto / filtergraph 方式且装有 ffmpeg 时，用一次 ffmpeg 调用完成：每个视频只解码一次，
+    用 split 分给各个目标分别缩放加黑边和编码，单次渲染失败时逐个目标合并
+    （auto 依次尝试 concat、parallel、moviepy，filtergraph 再尝试 moviepy）。其他方式逐个目标合并。
+    """
+    if engine in ('auto', 'filtergraph'):
+        import ffmpeg_merge
+        if ffmpeg_merge.ffmpeg_available():
+            try:
+                with merge_trace.span('engine:targets', outputs=len(targets)):
+                    ffmpeg_merge.merge_targets(sources, [
+                        {'path': target['path'], 'settings': ffmpeg_merge.profile_settings(target['profile'], target['size'])}
+                        for target in targets
+                    ], title, author, color_scheme)
+                logging.info("\n=== 合并成功 ===")
+                for target in targets:
+                    logging.info(f"输出文件: {target['path']}")
+                    print(f"\n✨ 视频合并完成！输出文件：{target['path']}")
+                return True
+            except Exception as e:
+                logging.error(f"多输出合并失败: {str(e)}")
+        else:
+            logging.warning("未找到 ffmpeg 或 ffprobe")
+
+    logging.info(f"逐个合并 {len(targets)} 个输出")
+    results = [
+        _merge_videos(None, target['path'], title, author, color_scheme, engine,
+                      workers, chunk_size, incremental, target['profile'], sources, size=target['size'],
+                      progress=progress)
+        for target in targets
+    ]
+    return all(results)
+
+def _count_output(clip, path, profile):
+    """把 moviepy 写出的帧数和字节数计入 trace"""
+    merge_trace.count('frames', int(clip.duration * ENCODING_PROFILES[profile]['fps']))
+    if os.path.exists(path):
+        merge_trace.count('bytes_written', os.path.getsize(path))
+
+def _merge_videos(input_dir, output_path, title, author, color_scheme, engine, workers, chunk_size, incremental, profile, clips, targets=None, size=None, progress=None):
+    try:
+        if profile not in ENCODING_PROFILES:
+            logging.error(f"未知的编码配置: {profile}")
             return False
+        if targets is not None:
+            targets = normalize_targets(targets, profile)
+            if not targets:
+                logging.error("没有要输出的目标")
+                return False
+            output_path = targets[0]['path']
+
+        # 1. 输入准备阶段
+        if clips is not None:
+            sources = normalize_clips(clips)
+            if not sources:
+                logging.error("没有要合并的视频")
+                return False
+            missing = [source['path'] for source in sources if not os.path.exists(source['path'])]
+            if missing:
+                logging.error(f"视频文件不存在: {', '.join(missing)}")
+                return False
+            input_dir = os.path.dirname(sources[0]['path'])
+        else:
+            input_dir = os.path.abspath(input_dir if input_dir else "./11-23")
+            if not os.path.exists(input_dir):
+                logging.error(f"输入目录不存在: {input_dir}")
+                return False
 
         # 处理输出路径
         if not output_path:
             output_path = os.path.join(input_dir, f"merged-video-{datetime.now().strftime('%m%d-%H%M')}.mp4")
         output_path = os.path.abspath(output_path)
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        for path in [output_path] + [target['path'] for target in targets or []]:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tracer = merge_trace.current()
+        tracer.output_path = tracer.output_path or output_path
 
         # 扫描并过滤视频文件
-        video_files = [f for f in os.listdir(input_dir) 
-                      if f.lower().endswith(('.mp4', '.mov')) 
-                      and not f.startswith(('merged-', 'temp_'))]
+        if clips is None:
+            with merge_trace.span('scan', folder=input_dir):
+                video_files = list_video_files(input_dir, exclude=[output_path] + [t['path'] for t in targets or []])
 
-        if not video_files:
-            logging.error(f"未找到视频文件: {input_dir}")
-            return False
+            if not video_files:
+                logging.error(f"未找到视频文件: {input_dir}")
+                return False
 
-        video_files.sort()
-        
-        # 创建临时目录
-        temp_dir = os.path.join(input_dir, "temp_transitions")
-        os.makedirs(temp_dir, exist_ok=True)
+            sources = normalize_clips(video_files)
+
+        if targets is not None:
+            return _merge_targets(sources, targets, title, author, color_scheme, engine, workers, chunk_size, incremental, progress)
 
-        # 2. 处理每个视频片段
-        for i, video_file in enumerate(video_files, 1):
+        # 2. ffmpeg 路径，按顺序尝试，失败时交给下一种方式
+        if engine == 'auto':
+            ffmpeg_engines = ['concat', 'parallel']
+        else:
+            ffmpeg_engines = [engine] if engine not in ('moviepy', 'stream') else []
+
+        if ffmpeg_engines:
+            import ffmpeg_merge
+            settings = ffmpeg_merge.profile_settings(profile, size)
+            if not ffmpeg_merge.ffmpeg_available():
+                logging.warning("未找到 ffmpeg 或 ffprobe")
+                if engine not in MOVIEPY_FALLBACK_ENGINES:
+                    return False
+                ffmpeg_engines = []
+
+            for name in ffmpeg_engines:
+                try:
+                    with merge_trace.span(f'engine:{name}'):
+                        if name == 'concat':
+                            ffmpeg_merge.merge_with_concat(sources, output_path, title, author, color_scheme,
+                                                           settings=settings, incremental=incremental,
+                                                           progress=progress)
+                        elif name == 'parallel':
+                            ffmpeg_merge.merge_with_segments(sources, output_path, title, author, color_scheme,
+                                                             settings=settings, workers=workers, incremental=incremental,
+                                                             progress=progress)
+                        else:
+                            ffmpeg_merge.merge_with_filtergraph(sources, output_path, title, author, color_scheme,
+                                                                settings=settings)
+                    logging.info("\n=== 合并成功 ===")
+                    logging.info(f"输出文件: {output_path}")
+                    print(f"\n✨ 视频合并完成！输出文件：{output_path}")
+                    return True
+                except Exception as e:
+                    logging.error(f"{name} 合并失败: {str(e)}")
+
+            if engine not in MOVIEPY_FALLBACK_ENGINES:
+                print("\n❌ 视频合并失败！")
+                return False
+            logging.info("改用 moviepy 合并")
+
+        # 3. moviepy 路径，视频较多时分批流式合并，避免同时打开所有视频
+        if engine == 'stream' or (engine in MOVIEPY_FALLBACK_ENGINES and len(sources) > chunk_size):
+            with merge_trace.span('engine:stream'):
+                return _merge_with_moviepy_streaming(sources, output_path, title, author, color_scheme, chunk_size, profile, size)
+        with merge_trace.span('engine:moviepy'):
+            return _merge_with_moviepy(sources, output_path, title, author, color_scheme, profile, size)
+
+    except Exception as e:
+        logging.error(f"发生错误: {str(e)}")
+        logging.error(traceback.format_exc())
+        print("\n❌ 视频合并失败！")
+        return False
+
+def _merge_with_moviepy(sources, output_path, title="今日份快乐", author="", color_scheme='p6', profile=DEFAULT_PROFILE, size=None):
+    """用 moviepy 逐个处理视频并整体重新编码"""
+    clips = []  # 存储所有视频片段
+    size = tuple(size or ENCODING_PROFILES[profile]['size'])
+    
+    try:
+        # 1. 处理每个视频片段
+        for i, source in enumerate(sources, 1):
+            video_file = os.path.basename(source['path'])
             logging.info(f"\n处理第 {i} 个视频: {video_file}")
             
             # 生成过渡画面
-            transition = create_number_transition(
-                i,
-                duration=0.5,
-                title_text=title if i == 1 else None,
-                author_name=author if i == 1 else None,
-                color_scheme=color_scheme
-            )
+            with merge_trace.span('transition', clip=i):
+                transition = create_number_transition(
+                    i,
+                    duration=TRANSITION_DURATION,
+                    size=size,
+                    title_text=title if i == 1 else None,
+                    author_name=author if i == 1 else None,
+                    color_scheme=color_scheme
+                )
             if transition:
-                # 记录过渡画面文件路径
-                temp_files.append(f'transition_{i}.png')
                 clips.append(transition)
 
             # 加载并处理视频
-            video_path = os.path.join(input_dir, video_file)
             try:
-                video = VideoFileClip(video_path)
-                processed_video = resize_to_target(video)
+                with merge_trace.span('open', clip=i, file=video_file):
+                    video = VideoFileClip(source['path'])
+                with merge_trace.span('resize', clip=i, file=video_file):
+                    processed_video = resize_to_target(video, size, source['start'], source['end'])
                 if processed_video:
                     clips.append(processed_video)
             except Exception as e:
@@ -371,35 +737,26 @@ def merge_videos(input_dir=None, output_path=None, title="今日份快乐", auth
             logging.error("没有可用的视频片段")
             return False
 
-        # 3. 添加最终画面
-        final_transition = create_number_transition(
-            len(video_files) + 1,
-            duration=2.0,
-            is_final=True,
-            color_scheme=color_scheme
-        )
+        # 2. 添加最终画面
+        with merge_trace.span('transition', clip=len(sources) + 1):
+            final_transition = create_number_transition(
+                len(sources) + 1,
+                duration=FINAL_DURATION,
+                size=size,
+                is_final=True,
+                color_scheme=color_scheme
+            )
         if final_transition:
-            # 记录最终过渡画面文件路径
-            temp_files.append(f'transition_{len(video_files) + 1}.png')
             clips.append(final_transition)
 
-        # 4. 合并所有片段，确保音频正确处理
-        final_video = concatenate_videoclips(clips, method="compose")
+        # 3. 合并所有片段，确保音频正确处理
+        with merge_trace.span('concatenate', clips=len(clips)):
+            final_video = concatenate_videoclips(clips, method="compose")
         
-        # 5. 写入最终视频文件，移除 audio_buffersize 参数
-        final_video.write_videofile(
-            output_path,
-            codec='libx264',
-            audio_codec='aac',
-            fps=30,
-            preset='medium',
-            ffmpeg_params=[
-                '-strict', '-2',
-                '-profile:v', 'high',
-                '-pix_fmt', 'yuv420p',
-                '-movflags', '+faststart'
-            ]
-        )
+        # 4. 写入最终视频文件，移除 audio_buffersize 参数（缩放合成在编码时逐帧进行，计入 encode）
+        with merge_trace.span('encode', file=os.path.basename(output_path)):
+            final_video.write_videofile(output_path, **write_params(profile))
+        _count_output(final_video, output_path, profile)
 
         logging.info("\n=== 合并成功 ===")
         logging.info(f"输出文件: {output_path}")
@@ -414,39 +771,115 @@ def merge_videos(input_dir=None, output_path=None, title="今日份快乐", auth
 
     finally:
         # 清理资源
-        for clip in clips:
-            try:
-                clip.close()
-            except:
-                pass
-                
-        # 清理临时文件
-        try:
-            # 清理临时目录
-            if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-            
-            # 清理过渡画面文件
-            for temp_file in temp_files:
-                if os.path.exists(temp_file):
-                    try:
-                        os.remove(temp_file)
-                        logging.debug(f"已删除临时文件: {temp_file}")
-                    except Exception as e:
-                        logging.warning(f"删除临时文件失败 {temp_file}: {str(e)}")
-            
-            # 清理其他可能的临时文件
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            for file in os.listdir(current_dir):
-                if file.startswith('transition_') and file.endswith('.png'):
-                    try:
-                        os.remove(os.path.join(current_dir, file))
-                        logging.debug(f"已删除遗留的临时文件: {file}")
-                    except Exception as e:
-                        logging.warning(f"删除遗留文件失败 {file}: {str(e)}")
-                        
-        except Exception as e:
-            logging.warning(f"清理临时文件时出错: {str(e)}")
+        with merge_trace.span('cleanup'):
+            for clip in clips:
+                try:
+                    clip.close()
+                except:
+                    pass
+
+def _merge_with_moviepy_streaming(sources, output_path, title="今日份快乐", author="", color_scheme='p6', chunk_size=STREAM_CHUNK_SIZE, profile=DEFAULT_PROFILE, size=None):
+    """流式合并：每次只打开 chunk_size 个视频，逐批写成分段文件，最后无损拼接
+
+    内存和 ffmpeg 读取进程数只和 chunk_size 有关，和视频总数无关；结束时输出峰值内存和子进程数。
+    """
+    from ffmpeg_merge import concat_segments
+    from process_stats import UsageSampler
+
+    chunk_size = max(1, chunk_size)
+    size = tuple(size or ENCODING_PROFILES[profile]['size'])
+    work_dir = tempfile.mkdtemp(prefix='merge_', dir=os.path.dirname(output_path))
+    chunk_paths = []
+
+    try:
+        with UsageSampler() as usage:
+            for start in range(0, len(sources), chunk_size):
+                batch = sources[start:start + chunk_size]
+                is_last = start + chunk_size >= len(sources)
+                clips = []
+                try:
+                    for i, source in enumerate(batch, start + 1):
+                        video_file = os.path.basename(source['path'])
+                        logging.info(f"\n处理第 {i} 个视频: {video_file}")
+
+                        with merge_trace.span('transition', clip=i):
+                            transition = create_number_transition(
+                                i,
+                                duration=TRANSITION_DURATION,
+                                size=size,
+                                title_text=title if i == 1 else None,
+                                author_name=author if i == 1 else None,
+                                color_scheme=color_scheme
+                            )
+                        if transition:
+                            clips.append(transition)
+
+                        try:
+                            with merge_trace.span('open', clip=i, file=video_file):
+                                video = VideoFileClip(source['path'])
+                            with merge_trace.span('resize', clip=i, file=video_file):
+                                clips.append(resize_to_target(video, size, source['start'], source['end']))
+                        except Exception as e:
+                            logging.error(f"处理视频 {video_file} 失败: {str(e)}")
+
+                    if is_last:
+                        with merge_trace.span('transition', clip=len(sources) + 1):
+                            final_transition = create_number_transition(
+                                len(sources) + 1,
+                                duration=FINAL_DURATION,
+                                size=size,
+                                is_final=True,
+                                color_scheme=color_scheme
+                            )
+                        if final_transition:
+                            clips.append(final_transition)
+
+                    if not clips:
+                        continue
+
+                    chunk_path = os.path.join(work_dir, f'chunk_{len(chunk_paths):04d}.mp4')
+                    with merge_trace.span('concatenate', clips=len(clips)):
+                        chunk = concatenate_videoclips(clips, method="compose")
+                    with merge_trace.span('encode', file=os.path.basename(chunk_path)):
+                        chunk.write_videofile(chunk_path, **write_params(profile))
+                    _count_output(chunk, chunk_path, profile)
+                    chunk.close()
+                    chunk_paths.append(chunk_path)
+                    logging.info(f"已写入分段 {len(chunk_paths)}: 第 {start + 1}-{start + len(batch)} 个视频")
+
+                finally:
+                    # 当前批次的读取进程全部关闭后再打开下一批
+                    with merge_trace.span('cleanup'):
+                        for clip in clips:
+                            try:
+                                clip.close()
+                            except:
+                                pass
+                        clips.clear()
+                        gc.collect()
+
+            if not chunk_paths:
+                logging.error("没有可用的视频片段")
+                return False
+
+            concat_segments([{'path': path} for path in chunk_paths], output_path, work_dir)
+
+        logging.info("\n=== 合并成功 ===")
+        logging.info(f"输出文件: {output_path}")
+        logging.info(f"流式合并 {len(sources)} 个视频，每批 {chunk_size} 个，{usage.summary()}")
+        print(f"\n✨ 视频合并完成！输出文件：{output_path}")
+        print(f"📊 {usage.summary()}")
+        return True
+
+    except Exception as e:
+        logging.error(f"发生错误: {str(e)}")
+        logging.error(traceback.format_exc())
+        print("\n❌ 视频合并失败！")
+        return False
+
+    finally:
+        with merge_trace.span('cleanup'):
+            shutil.rmtree(work_dir, ignore_errors=True)
 
 def test_transition():
     """测试过渡画面创建功能"""
@@ -488,6 +921,19 @@ if __name__ == "__main__":
     parser.add_argument('--author', '-a', type=str, default="Cynvann", help='作者名称')
     parser.add_argument('--color_scheme', '-c', type=str, choices=['p1', 'p2', 'p3', 'p4', 'p5', 'p6'], 
                       default='p6', help='颜色方案选择：\n' + '\n'.join([f"{k}: {v['name']}" for k, v in COLOR_SCHEMES.items()]))
+    parser.add_argument('--engine', '-e', type=str, choices=['auto', 'concat', 'filtergraph', 'parallel', 'moviepy', 'stream'],
+                      default='auto', help='合并方式：auto 依次尝试 concat 快速路径和 parallel 并行分段编码，最后用 moviepy 逐帧合成')
+    parser.add_argument('--workers', '-w', type=int, default=None, help='parallel 方式的并行进程数（默认 CPU 核数）')
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE, help='stream 方式每批同时打开的视频数')
+    parser.add_argument('--profile', '-p', type=str, choices=list(ENCODING_PROFILES), default=DEFAULT_PROFILE,
+                      help='编码配置：' + '，'.join(f"{k}: {v['name']}" for k, v in ENCODING_PROFILES.items()))
+    parser.add_argument('--incremental', action='store_true', help='增量合并：保留已编码的片段，再次合并时只编码新增或修改过的视频')
+    parser.add_argument('--target', action='append', default=None, metavar='文件名[:配置[:宽x高]]',
+                      help='输出目标，可重复指定以一次输出多个尺寸，例如 --target a.mp4 --target b.mp4:final:1080x1920 '
+                           '--target c.mp4:final:1080x1080（文件保存在输入目录中，指定后忽略 --output_path）')
+    parser.add_argument('--trace', action='store_true', help='保存各阶段耗时的 Chrome trace 文件（<输出>.trace.json）')
+    parser.add_argument('--profiler', type=str, choices=['cprofile'], default=None,
+                      help='用 cProfile 分析合并过程，结果保存为 <输出>.prof')
     parser.add_argument('--test', action='store_true', help='运行测试模式')
     
     args = parser.parse_args()
@@ -503,6 +949,7 @@ if __name__ == "__main__":
             print(f"标题: {args.title}")
             print(f"作者: {args.author}")
             print(f"颜色方案: {COLOR_SCHEMES[args.color_scheme]['name']}")
+            print(f"编码配置: {ENCODING_PROFILES[args.profile]['name']}")
             
             # 获取输入目录的绝对路径
             input_dir = args.input_dir
@@ -531,17 +978,42 @@ if __name__ == "__main__":
             final_output = os.path.join(input_dir, output_filename)
             print(f"\n📁 最终输出路径: {final_output}")
             
+            # 解析输出目标（同样保存在输入目录中）
+            targets = None
+            if args.target:
+                targets = []
+                for spec in args.target:
+                    name, target_profile, size = (spec.split(':') + [None, None])[:3]
+                    targets.append({
+                        'path': os.path.join(input_dir, os.path.basename(name)),
+                        'profile': target_profile or args.profile,
+                        'size': tuple(int(v) for v in size.lower().split('x')) if size else None,
+                    })
+                    print(f"输出目标: {targets[-1]['path']} ({targets[-1]['profile']}{', ' + size if size else ''})")
+
             # 运行合并
-            merge_videos(
+            merged = merge_videos(
                 input_dir=input_dir,
                 output_path=final_output,
                 title=args.title,
                 author=args.author,
-                color_scheme=args.color_scheme
+                color_scheme=args.color_scheme,
+                engine=args.engine,
+                workers=args.workers,
+                chunk_size=args.chunk_size,
+                incremental=args.incremental,
+                profile=args.profile,
+                targets=targets,
+                trace=args.trace,
+                profiler=args.profiler,
+                progress=lambda done, total, name: print(f"进度 {done}/{total}: {name}")
             )
             
             # 检查最终文件
-            if os.path.exists(final_output):
+            if targets:
+                if not merged:
+                    print("\n❌ 视频合并失败！")
+            elif os.path.exists(final_output):
                 print(f"\n✨ 视频合并完成！输出文件：{final_output}")
             else:
                 print("\n❌ 视频合并失败！")
@@ -1,21 +1,61 @@
 import os
-import tempfile
+import asyncio
 import json
-import importlib  # 添加这一行
 from typing import Optional, List
 import gradio as gr
 import video_down_play  # 修改这一行
-from video_merger import merge_videos, COLOR_SCHEMES
+from browser_service import get_browser_service
+from job_queue import JobStore, JobScheduler, format_status
+from video_merger import merge_videos, estimate_merged_duration, COLOR_SCHEMES, ENCODING_PROFILES, DEFAULT_PROFILE
+from media_probe import probe_many
+from thumbnails import THUMBNAIL_DIR, thumbnails
+from ffmpeg_merge import ffmpeg_available
+from pipeline import MergePipeline
 # 使用当前日期作为默认下载目录
 from datetime import datetime
 default_folder = datetime.now().strftime("%m-%d")
 
-def download_only(links: str, output_folder: str) -> str:
-    """仅下载视频"""
+# 后台下载队列，在 start_job_scheduler() 中初始化
+job_store = None
+job_scheduler = None
+
+def start_job_scheduler() -> None:
+    """在常驻浏览器服务的事件循环中启动下载队列调度器，继续处理上次未完成的任务"""
+    global job_store, job_scheduler
+    if job_scheduler is not None:
+        return
+    job_store = JobStore()
+    job_scheduler = JobScheduler(job_store)
+    service = get_browser_service()
+    service.start(launch=False)
+    asyncio.run_coroutine_threadsafe(job_scheduler.run_forever(service), service.loop)
+
+def enqueue_download(links: str, output_folder: str, concurrency: int = 3, fetch_mode: str = "http") -> str:
+    """把链接提交到后台下载队列"""
     try:
-        # 重新加载模块以获取最新代码
-        importlib.reload(video_down_play)
+        links_list = video_down_play.extract_video_links(links)
+        if not links_list:
+            return "未找到有效的视频链接，请确保链接格式正确。"
+
+        start_job_scheduler()
+        batch_id = job_store.submit(links_list, output_folder, concurrency, fetch_mode)
+        job_scheduler.wake()
+        return f"已加入队列，批次号: {batch_id}（{len(links_list)} 条链接）\n\n" + format_status(job_store)
+    except Exception as e:
+        return f"加入队列时出错: {str(e)}"
+
+def queue_status(batch_id: str = "") -> str:
+    """查看后台下载队列状态"""
+    try:
+        start_job_scheduler()
+        return format_status(job_store, batch_id.strip() or None)
+    except Exception as e:
+        return f"读取队列状态时出错: {str(e)}"
 
+async def download_only(links: str, output_folder: str, concurrency: int = 1, fetch_mode: str = "browser",
+                        on_file=None, on_state=None) -> str:
+    """仅下载视频，on_file(文件路径) 在每个文件下载完成时调用，on_state(链接, 状态, 原因) 在链接状态变化时调用"""
+    try:
         # 确保输出文件夹存在
         os.makedirs(output_folder, exist_ok=True)
 
@@ -28,8 +68,12 @@ def download_only(links: str, output_folder: str) -> str:
         for link in links_list:
             print(f"- {link}")
 
-        # 使用新的下载方法
-        return video_down_play.download_videos_with_playwright(links_list, output_folder)  # 修改这一行
+        # 在常驻浏览器服务中执行，复用已启动并预热的 Chromium
+        service = get_browser_service()
+        return await service.run(video_down_play.download_videos_async(
+            links_list, output_folder, concurrency=concurrency, fetch_mode=fetch_mode, service=service,
+            on_file=on_file, on_state=on_state
+        ))
 
     except Exception as e:
         return f"下载过程中出错: {str(e)}"
@@ -37,24 +81,57 @@ def download_only(links: str, output_folder: str) -> str:
 def merge_only(input_folder: str, output_path: str, title: str, author: str) -> str:
     """仅合并视频"""
     try:
-        merge_videos(input_folder, output_path, title, author)
+        if not merge_videos(input_folder, output_path, title, author):
+            return "合并失败，请查看 video_merger.log"
         return f"合并完成！视频已保存到: {output_path}"
     except Exception as e:
         return f"合并过程中出错: {str(e)}"
 
-def download_and_merge(links: str, output_folder: str, output_path: str, title: str, author: str) -> str:
-    """下载并合并视频"""
+async def download_and_merge(links: str, output_folder: str, output_path: str, title: str, author: str,
+                             concurrency: int = 1, fetch_mode: str = "browser") -> str:
+    """下载并合并视频
+
+    装有 ffmpeg 时边下载边编码：每个下载完成的视频立即在后台编码成片段，
+    全部下载结束后只需要拼接；没有 ffmpeg 时下载完成后再整体合并。
+    只有所有链接都下载成功才合并，否则返回下载报告，重试下载后再合并（已下载的会跳过）。
+    """
+    # 每条链接最后的状态，浏览器重启后重试的链接以最后一次为准
+    states = {}
+
+    def on_state(link: str, state: str, reason: str = None) -> None:
+        states[link] = state
+
+    def download_failed() -> str:
+        if not states:
+            return "\n下载没有完成，未合并"
+        failed = sum(state != "done" for state in states.values())
+        if failed:
+            return f"\n{failed} 条链接没有下载成功，未合并；重新下载后再合并（已下载的会跳过）"
+        return ""
+
+    if not ffmpeg_available():
+        download_result = await download_only(links, output_folder, concurrency, fetch_mode, on_state=on_state)
+        if download_failed():
+            return download_result + download_failed()
+        # moviepy 合并需要几分钟，放到线程中避免阻塞事件循环
+        merge_result = await asyncio.to_thread(merge_only, output_folder, output_path, title, author)
+        return download_result + "\n" + merge_result
+
+    download_result = ""
+    pipeline = MergePipeline(output_folder, output_path, title, author)
     try:
-        # 先下载
-        download_result = download_only(links, output_folder)
-        if "错误" in download_result:
-            return download_result
-
-        # 再合并
-        merge_result = merge_only(output_folder, output_path, title, author)
-        return merge_result
+        pipeline.start()
+        download_result = await download_only(links, output_folder, concurrency, fetch_mode,
+                                              on_file=pipeline.submit, on_state=on_state)
+        if download_failed():
+            return download_result + download_failed()
+        # 拼接前要等待剩余片段编码完成，放到线程中避免阻塞事件循环
+        await asyncio.to_thread(pipeline.finish)
+        return download_result + f"\n合并完成！视频已保存到: {output_path}"
     except Exception as e:
-        return f"处理过程中出错: {str(e)}"
+        return download_result + f"\n合并过程中出错: {str(e)}"
+    finally:
+        pipeline.close()
 
 def create_ui():
     """创建用户界面"""
@@ -68,17 +145,53 @@ def create_ui():
         if not video_files:
             return [], None, "文件夹中没有找到视频文件"
 
+        # 读取视频信息（有缓存索引，只有新文件才会调用 ffprobe）
+        video_paths = [os.path.join(folder_path, video) for video in video_files]
+        infos = probe_many(video_paths)
+
+        # 并行生成封面缩略图，画廊只加载小图片而不是整个视频
+        durations = {p: infos[os.path.abspath(p)]["duration"] for p in video_paths if os.path.abspath(p) in infos}
+        posters = thumbnails(video_paths, durations)
+
         # 构建视频列表的HTML
         videos_data = []
-        for idx, video in enumerate(video_files):
-            video_path = os.path.join(folder_path, video)
+        for video, video_path in zip(video_files, video_paths):
             videos_data.append({
                 "path": video_path,
                 "name": video,
-                "is_first": False
+                "is_first": False,
+                "info": infos.get(os.path.abspath(video_path)),
+                "thumbnail": posters.get(video_path)
             })
 
-        return videos_data, os.path.join(folder_path, video_files[0]), "找到 {} 个视频文件".format(len(video_files))
+        status = "找到 {} 个视频文件".format(len(video_files))
+        durations = [v["info"]["duration"] for v in videos_data if v["info"]]
+        if durations:
+            minutes, seconds = divmod(int(estimate_merged_duration(durations)), 60)
+            status += f"，预计合并后时长 {minutes}:{seconds:02d}"
+            try:
+                from ffmpeg_merge import plan_merge, profile_settings
+                _, plan = plan_merge([v["info"] for v in videos_data if v["info"]], profile_settings())
+                status += f"，{plan.count('encode')} 个需要重新编码"
+            except Exception:
+                pass
+
+        return videos_data, video_paths[0], status
+
+    def gallery_item(video: dict) -> tuple:
+        """画廊中的一项：有缩略图时显示缩略图，否则显示视频本身"""
+        return video.get("thumbnail") or video["path"], video_label(video)
+
+    def video_label(video: dict) -> str:
+        """画廊中显示的视频名称，带时长、分辨率和编码信息"""
+        label = "[第一个] " if video["is_first"] else ""
+        label += video["name"]
+        info = video.get("info")
+        if info:
+            label += f" · {info['duration']:.1f}s · {info['width']}x{info['height']} {info['vcodec']}"
+            if not info["has_audio"]:
+                label += " · 无声"
+        return label
 
     def set_first_video(videos_data: List[dict], video_idx: int) -> List[dict]:
         """设置指定索引的视频为第一个"""
@@ -134,25 +247,83 @@ def create_ui():
                             placeholder="比如 myvideo",
                         )
 
-                    download_btn = gr.Button("开始下载", variant="primary")
+                    concurrency_slider = gr.Slider(
+                        label="并发页面数",
+                        minimum=1,
+                        maximum=8,
+                        step=1,
+                        value=3
+                    )
+                    fetch_mode_radio = gr.Radio(
+                        label="下载方式",
+                        choices=[("直接下载（连接池，支持断点续传）", "http"), ("浏览器下载", "browser")],
+                        value="http"
+                    )
+
+                    with gr.Row():
+                        merge_name = gr.Textbox(label="合并输出文件名", value="merged_video.mp4")
+                        merge_title = gr.Textbox(label="视频标题", value="今日份快乐")
+                        merge_author = gr.Textbox(label="作者", value="Cynvann")
+
+                    with gr.Row():
+                        download_btn = gr.Button("开始下载", variant="primary")
+                        download_merge_btn = gr.Button("下载并合并")
+                        enqueue_btn = gr.Button("加入后台队列")
                     download_output = gr.Textbox(label="下载结果")
 
+                    with gr.Row():
+                        batch_input = gr.Textbox(label="批次号", placeholder="留空查看最近的批次")
+                        queue_status_btn = gr.Button("刷新队列状态")
+                    queue_output = gr.Textbox(label="队列状态", lines=6)
+
                     # 拼接完整路径再调用下载函数
-                    def download_only_with_prefix(links, subfolder):
+                    async def download_only_with_prefix(links, subfolder, concurrency, fetch_mode):
                         subfolder = subfolder.strip()
                         # 拼接完整路径
                         full_path = os.path.join("./downloads", subfolder)
                         # 确保目录存在
                         os.makedirs(full_path, exist_ok=True)
                         # 调用原来的下载函数
-                        return download_only(links, full_path)
+                        return await download_only(links, full_path, int(concurrency), fetch_mode)
 
                     download_btn.click(
                         fn=download_only_with_prefix,
-                        inputs=[links_input, sub_folder],
+                        inputs=[links_input, sub_folder, concurrency_slider, fetch_mode_radio],
+                        outputs=download_output
+                    )
+
+                    # 边下载边编码，输出文件保存在下载目录中
+                    async def download_and_merge_with_prefix(links, subfolder, concurrency, fetch_mode, name, title, author):
+                        full_path = os.path.join("./downloads", subfolder.strip())
+                        os.makedirs(full_path, exist_ok=True)
+                        output_path = os.path.join(full_path, os.path.basename(name.strip() or "merged_video.mp4"))
+                        return await download_and_merge(links, full_path, output_path, title, author,
+                                                        int(concurrency), fetch_mode)
+
+                    download_merge_btn.click(
+                        fn=download_and_merge_with_prefix,
+                        inputs=[links_input, sub_folder, concurrency_slider, fetch_mode_radio,
+                                merge_name, merge_title, merge_author],
                         outputs=download_output
                     )
 
+                    def enqueue_with_prefix(links, subfolder, concurrency, fetch_mode):
+                        full_path = os.path.join("./downloads", subfolder.strip())
+                        os.makedirs(full_path, exist_ok=True)
+                        return enqueue_download(links, full_path, int(concurrency), fetch_mode)
+
+                    enqueue_btn.click(
+                        fn=enqueue_with_prefix,
+                        inputs=[links_input, sub_folder, concurrency_slider, fetch_mode_radio],
+                        outputs=queue_output
+                    )
+
+                    queue_status_btn.click(
+                        fn=queue_status,
+                        inputs=[batch_input],
+                        outputs=queue_output
+                    )
+
             # 合并标签页
             with gr.Tab("🔄 合并视频"):
                 with gr.Column():
@@ -187,9 +358,7 @@ def create_ui():
                         # 为每个视频创建预览信息
                         gallery_data = []
                         for video in videos_data:
-                            label = "[第一个] " if video["is_first"] else ""
-                            label += video["name"]
-                            gallery_data.append((video["path"], label))
+                            gallery_data.append(gallery_item(video))
 
                         return videos_data, gallery_data, None, status
 
@@ -202,21 +371,18 @@ def create_ui():
                     def handle_set_first(videos_data: List[dict], selected_name: str):
                         """设置选中的视频为第一个"""
                         if not videos_data or selected_name is None:
-                            gallery_data = [(v["path"], f"{'[第一个] ' if v['is_first'] else ''}{v['name']}")
-                                          for v in videos_data]
+                            gallery_data = [gallery_item(v) for v in videos_data]
                             return videos_data, gallery_data, None
 
                         # 根据名称找到索引
                         selected_idx = next((i for i, v in enumerate(videos_data) if v['name'] == selected_name), None)
                         if selected_idx is None:
-                            gallery_data = [(v["path"], f"{'[第一个] ' if v['is_first'] else ''}{v['name']}")
-                                          for v in videos_data]
+                            gallery_data = [gallery_item(v) for v in videos_data]
                             return videos_data, gallery_data, None
 
                         # 更新视频顺序
                         updated_videos = set_first_video(videos_data, selected_idx)
-                        gallery_data = [(v["path"], f"{'[第一个] ' if v['is_first'] else ''}{v['name']}")
-                                      for v in updated_videos]
+                        gallery_data = [gallery_item(v) for v in updated_videos]
                         return updated_videos, gallery_data, None
 
                     def update_preview(videos_data: List[dict], selected_name: str):
@@ -227,7 +393,8 @@ def create_ui():
                         video = next((v for v in videos_data if v['name'] == selected_name), None)
                         return video['path'] if video else None
 
-                    def handle_merge(videos_data: List[dict], output_path: str, title: str, author: str, color_scheme: str):
+                    def handle_merge(videos_data: List[dict], output_path: str, title: str, author: str, color_scheme: str,
+                                     profile: str = DEFAULT_PROFILE, progress=gr.Progress()):
                         if not videos_data:
                             return "没有找到要合并的视频"
 
@@ -244,26 +411,11 @@ def create_ui():
                             output_dir = os.path.dirname(output_path)
                             os.makedirs(output_dir, exist_ok=True)
 
-                            # 将所有视频文件复制到临时目录，按照指定顺序重命名
-                            with tempfile.TemporaryDirectory() as temp_dir:
-                                # 按顺序复制并重命名视频文件
-                                for idx, video_path in enumerate(video_paths):
-                                    new_name = f"{idx+1:03d}_{os.path.basename(video_path)}"
-                                    new_path = os.path.join(temp_dir, new_name)
-                                    try:
-                                        os.link(video_path, new_path)
-                                    except OSError:
-                                        import shutil
-                                        shutil.copy2(video_path, new_path)
-
-                                # 使用临时目录进行合并，确保使用绝对路径
-                                merge_videos(temp_dir, output_path, title, author, color_scheme)
-
-                                if not os.path.exists(output_path):
-                                    return f"合并失败：未找到输出文件 {output_path}"
-
-                                import time
-                                time.sleep(1)
+                            # 按界面上的顺序直接传入视频路径，不复制文件
+                            if not merge_videos(output_path=output_path, title=title, author=author,
+                                                color_scheme=color_scheme, profile=profile, clips=video_paths,
+                                                progress=lambda done, total, name: progress(done / total, desc=name)):
+                                return "合并失败，请查看 video_merger.log"
 
                             if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
                                 return f"合并失败：输出文件无效 {output_path}"
@@ -322,19 +474,29 @@ def create_ui():
                         type="value"
                     )
 
+                    # 编码配置：草稿用于快速检查顺序和过渡画面
+                    encoding_profile = gr.Dropdown(
+                        label="编码配置",
+                        choices=[f"{key} - {config['name']}" for key, config in ENCODING_PROFILES.items()],
+                        value=f"{DEFAULT_PROFILE} - {ENCODING_PROFILES[DEFAULT_PROFILE]['name']}",
+                        type="value"
+                    )
+
                     merge_btn = gr.Button("开始合并", variant="primary")
                     merge_output = gr.Textbox(label="合并结果")
 
                     # 处理颜色方案选择值
-                    def process_merge(*args):
-                        videos_data, output_path, title, author, color_scheme = args
-                        # 从选择值中提取颜色方案代码
+                    # Gradio 只给事件函数本身注入 gr.Progress，再传给 handle_merge
+                    def process_merge(videos_data, output_path, title, author, color_scheme, profile,
+                                      progress=gr.Progress()):
+                        # 从选择值中提取颜色方案和编码配置代码
                         scheme_code = color_scheme.split(" - ")[0]
-                        return handle_merge(videos_data, output_path, title, author, scheme_code)
+                        profile_code = profile.split(" - ")[0]
+                        return handle_merge(videos_data, output_path, title, author, scheme_code, profile_code, progress)
 
                     merge_btn.click(
                         fn=process_merge,
-                        inputs=[videos_state, output_path, title, author, color_scheme],
+                        inputs=[videos_state, output_path, title, author, color_scheme, encoding_profile],
                         outputs=[merge_output]
                     )
 
@@ -343,6 +505,15 @@ def create_ui():
 if __name__ == "__main__":
     app = create_ui()
 
+    # 提前启动浏览器服务，第一次下载无需等待 Chromium 启动
+    try:
+        get_browser_service().start()
+    except Exception as e:
+        print(f"浏览器服务启动失败，将在第一次下载时重试: {str(e)}")
+
+    # 启动后台下载队列，重启前未完成的批次会自动继续
+    start_job_scheduler()
+
     # 从环境变量读取配置
     server_name = os.getenv("SERVER_NAME", "127.0.0.1")  # 默认 127.0.0.1
     server_port = int(os.getenv("SERVER_PORT", 8080))    # 默认 8080
@@ -356,4 +527,5 @@ if __name__ == "__main__":
         auth=None,          # 不设置访问密码
         favicon_path=None,  # 默认网站图标
         quiet=False,        # 减少命令行输出
+        allowed_paths=[THUMBNAIL_DIR],  # 缩略图缓存目录不在工作目录下，需要允许访问
     )